@@ -0,0 +1,246 @@
+"""
+Vectorized load balancing for a tracker's region.
+
+Generator state lives in a GeneratorStateTable: typed column arrays with a
+stable row (slot) per generator id. A rebalance is a handful of masked
+vector operations over those columns instead of DataFrame copies, filters
+and concats.
+"""
+import threading
+import time
+
+import numpy as np
+
+from state_table import GeneratorStateTable
+
+# Electricity Stuff
+RES_CONSUMPTION = 0.00131 # MW
+SAFETY_THRESHOLD = 0.1    # 10% of generator output
+
+
+class LoadBalancer:
+    """Computes load shifts over the live rows of a GeneratorStateTable.
+
+    Not thread safe: allocate() reuses one set of scratch arrays and returns
+    a view of them. Hold one lock across updating the table, allocate() and
+    reading its result, as tracker.py does with state_lock.
+    """
+    def __init__(self, table: GeneratorStateTable = None, safety_threshold: float = SAFETY_THRESHOLD,
+                 res_consumption: float = RES_CONSUMPTION, timer=None):
+        """timer: a metrics.Histogram observing how long each allocate() takes"""
+        self.table = table if table is not None else GeneratorStateTable()
+        self.safety_threshold = safety_threshold
+        self.res_consumption = res_consumption
+        self.summary = None # populated by allocate()
+        self.timer = timer
+        self.capacity = 0
+        self._allocate_scratch(self.table.capacity)
+
+    def _allocate_scratch(self, capacity: int):
+        """scratch space reused by every allocate() call"""
+        self.capacity = capacity
+        self._s_net_cap = np.zeros(capacity, dtype=np.float64)
+        self._share = np.zeros(capacity, dtype=np.float64)
+        self._new_load = np.zeros(capacity, dtype=np.float64)
+        self._surplus = np.zeros(capacity, dtype=bool)
+        self._deficit = np.zeros(capacity, dtype=bool)
+
+    def allocate(self):
+        """Compute the load each generator must take on (+) or shed (-).
+
+        Generators above the safety threshold are in surplus, those below it
+        are in deficit. When the deficit group's load exceeds its safe output
+        the excess is shifted, in whole homes, to the surplus group in
+        proportion to each member's safe net capacity.
+
+        returns:
+            np.ndarray # new load (MW) per row, a view of length `table.size`
+        """
+        if self.timer is None:
+            return self._allocate()
+        start = time.perf_counter()
+        try:
+            return self._allocate()
+        finally:
+            self.timer.observe(time.perf_counter() - start)
+
+    def _allocate(self):
+        table = self.table
+        if self.capacity < table.capacity:
+            self._allocate_scratch(table.capacity)
+        n = table.size
+        factor = 1 - self.safety_threshold
+        output = table.output[:n]
+        demand = table.demand[:n]
+        net_cap = table.net_cap[:n]
+        s_net_cap = self._s_net_cap[:n]
+        share = self._share[:n]
+        new_load = self._new_load[:n]
+        surplus = self._surplus[:n]
+        deficit = self._deficit[:n]
+
+        np.greater(table.percent_use[:n], self.safety_threshold, out=surplus)
+        np.less(table.percent_use[:n], self.safety_threshold, out=deficit)
+
+        # safe net capacity: what is left after reserving the safety margin
+        np.multiply(output, factor, out=s_net_cap)
+        safe_load = s_net_cap.sum()
+        np.subtract(s_net_cap, demand, out=s_net_cap)
+
+        surplus_cap = np.sum(s_net_cap, where=surplus)
+        unsafe_load = np.sum(s_net_cap, where=deficit)
+        new_load.fill(0.0)
+
+        self.summary = {
+            'surplus': int(np.count_nonzero(surplus)),
+            'deficit': int(np.count_nonzero(deficit)),
+            'total_output': output.sum(),
+            'total_demand': demand.sum(),
+            'net_system_cap': np.sum(net_cap, where=surplus) - np.sum(net_cap, where=deficit),
+            'total_safe_capacity': surplus_cap,
+            'safe_load': safe_load,
+            'unsafe_load': unsafe_load,
+            'homes_to_shift': 0,
+            'shifted': 0.0,
+        }
+
+        # nothing to shift when the deficit group is within its safe output
+        if not unsafe_load < 0:
+            return new_load
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            np.divide(s_net_cap, surplus_cap, out=share, where=surplus)
+            np.divide(s_net_cap, unsafe_load, out=share, where=deficit)
+            # surplus generators take whole homes worth of load
+            np.multiply(share, unsafe_load, out=new_load, where=surplus)
+            np.divide(new_load, self.res_consumption, out=new_load, where=surplus)
+            np.round(new_load, out=new_load)
+            np.multiply(new_load, -self.res_consumption, out=new_load, where=surplus)
+            shifted = np.sum(new_load, where=surplus)
+            # and the deficit group sheds exactly what was taken on
+            np.multiply(share, -1 * shifted, out=new_load, where=deficit)
+
+        self.summary['homes_to_shift'] = int(np.ceil(np.abs(unsafe_load) / self.res_consumption))
+        self.summary['shifted'] = abs(shifted)
+        return new_load
+
+    def balance(self, id) -> float:
+        """rebalance the region and return the new demand (MW) for id"""
+        row = self.table.rows[id]
+        previous_load = self.table.demand[row]
+        new_load = self.allocate()
+        return previous_load + new_load[row]
+
+
+class EpochBalancer:
+    """Rebalances once per epoch instead of on every StateUpdate.
+
+    Updates are only recorded. A single rebalance runs once every generator
+    in the table has reported since the previous one (i.e. the round at a
+    lamport ts is complete) or once `epoch` seconds have passed, whichever
+    comes first. Each generator is then answered from that allocation the
+    next time it reports, so a tick costs O(N) instead of O(N^2).
+    """
+    def __init__(self, balancer: LoadBalancer, epoch: float = 2.0, on_rebalance=None,
+                 clock=time.monotonic, lock=None):
+        """lock: guards the table, e.g. one its owner also holds. Reentrant
+        if the owner calls update() or remove() with it held"""
+        self.balancer = balancer
+        self.table = balancer.table
+        self.epoch = epoch
+        self.on_rebalance = on_rebalance # called with balancer.summary
+        self.clock = clock
+        self.lock = lock if lock is not None else threading.Lock()
+        self.rebalances = 0
+        self.last_rebalance = clock()
+        self.num_reported = 0
+        self.capacity = 0
+        self._allocate_rows(self.table.capacity)
+
+    def _allocate_rows(self, capacity: int):
+        old = self.capacity
+        self.capacity = capacity
+        for name, dtype in (('target', np.float64), ('pending', bool), ('reported', bool)):
+            column = np.zeros(capacity, dtype=dtype)
+            if old:
+                column[:old] = getattr(self, name)
+            setattr(self, name, column)
+
+    def update(self, id, ts: int, host: int, tracker: int, output: float, demand: float, time) -> float:
+        """record a StateUpdate and return the demand (MW) to answer with"""
+        with self.lock:
+            row = self._record(id, ts, host, tracker, output, demand, time)
+            self._check_epoch()
+            return self._answer(row, demand)
+
+    def update_many(self, updates, host: int, tracker: int, time) -> list:
+        """update() for a batch of (id, ts, output, demand) tuples. The whole
+        batch is recorded before checking for a rebalance, so it causes at
+        most one.
+
+        returns:
+            list # the demand (MW) to answer each update with
+        """
+        with self.lock:
+            rows = [self._record(id, ts, host, tracker, output, demand, time)
+                    for id, ts, output, demand in updates]
+            self._check_epoch()
+            return [self._answer(row, update[3]) for row, update in zip(rows, updates)]
+
+    def _record(self, id, ts, host, tracker, output, demand, time) -> int:
+        row = self.table.update(id, ts, host, tracker, output, demand, time)
+        if self.capacity < self.table.capacity:
+            self._allocate_rows(self.table.capacity)
+        if not self.reported[row]:
+            self.reported[row] = True
+            self.num_reported += 1
+        return row
+
+    def _check_epoch(self):
+        if (self.num_reported >= self.table.size or
+                self.clock() - self.last_rebalance >= self.epoch):
+            self.rebalance()
+
+    def _answer(self, row: int, demand: float) -> float:
+        if self.pending[row]:
+            self.pending[row] = False
+            return self.target[row]
+        return demand
+
+    def remove(self, id):
+        """drop a generator from the table and the pending allocation"""
+        with self.lock:
+            if id not in self.table:
+                return
+            row = self.table.rows[id]
+            last = self.table.size - 1
+            if self.reported[row]:
+                self.num_reported -= 1
+            for column in (self.target, self.pending, self.reported):
+                column[row] = column[last]
+                column[last] = 0
+            self.table.remove(id)
+
+    def take_pending(self, ids) -> dict:
+        """returns {id: demand (MW)} for the ids with an unanswered allocation
+        and marks them answered. Call with lock held, e.g. from on_rebalance."""
+        targets = {}
+        for id in ids:
+            row = self.table.rows.get(id)
+            if row is not None and self.pending[row]:
+                self.pending[row] = False
+                targets[id] = self.target[row]
+        return targets
+
+    def rebalance(self):
+        """compute a new allocation for every generator. Call with lock held."""
+        n = self.table.size
+        new_load = self.balancer.allocate()
+        np.add(self.table.demand[:n], new_load, out=self.target[:n])
+        self.pending[:n] = True
+        self.reported[:n] = False
+        self.num_reported = 0
+        self.last_rebalance = self.clock()
+        self.rebalances += 1
+        if self.on_rebalance is not None:
+            self.on_rebalance(self.balancer.summary)
@@ -0,0 +1,89 @@
+"""
+Parity check and microbenchmark for balancer.LoadBalancer.
+
+Compares the vectorized engine against the original pandas LoadBalance
+on random region states, then times both at 100, 1k and 10k generators.
+
+    python benchmarks/bench_balancer.py
+"""
+import os
+import sys
+import timeit
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from balancer import LoadBalancer, RES_CONSUMPTION, SAFETY_THRESHOLD
+from state_table import GeneratorStateTable
+
+SIZES = [100, 1000, 10000]
+PARITY_TRIALS = 50
+
+
+def LoadBalanceReference(state, id):
+    """the pandas LoadBalance from tracker.py, minus the logging"""
+    df = state.copy()
+    previous_load = state.loc[id].demand
+    surplus = df[df['percent_use'] > SAFETY_THRESHOLD].copy()
+    deficit = df[df['percent_use'] < SAFETY_THRESHOLD].copy()
+    unsafe_load = (deficit.output * (1 - SAFETY_THRESHOLD) - deficit.demand).sum()
+    if unsafe_load < 0:
+        surplus['s_net_cap'] = (surplus.output * (1 - SAFETY_THRESHOLD)) - surplus.demand
+        deficit['s_net_cap'] = (deficit.output * (1 - SAFETY_THRESHOLD)) - deficit.demand
+        surplus['share_of_net'] = surplus['s_net_cap'] / surplus['s_net_cap'].sum()
+        deficit['share_of_net'] = deficit['s_net_cap'] / deficit['s_net_cap'].sum()
+        surplus['new_load'] = -1 * np.round(
+            (surplus['share_of_net'] * unsafe_load) / RES_CONSUMPTION) * RES_CONSUMPTION
+        deficit['new_load'] = -1 * surplus['new_load'].sum() * deficit['share_of_net']
+        results = pd.concat([surplus, deficit])
+        return previous_load + results.loc[id].new_load
+    return previous_load
+
+
+def RandomRegion(n: int, seed: int):
+    """returns (state, balancer, ids) holding the same n random generators"""
+    rng = np.random.default_rng(seed)
+    output = rng.uniform(0, 500, n)
+    output[rng.random(n) < 0.02] = 0.0 # a few generators offline
+    demand = output * rng.uniform(0.5, 1.2, n)
+    ids = [str(i) for i in rng.choice(2**31, n, replace=False)]
+
+    rows = {}
+    table = GeneratorStateTable()
+    balancer = LoadBalancer(table)
+    for ts, (id, o, d) in enumerate(zip(ids, output, demand)):
+        table.update(id, ts, 0, 0, o, d, np.datetime64('now'))
+        rows[id] = [o, d, o - d, -1.0 if o == 0 else (o - d) / o]
+    state = pd.DataFrame.from_dict(
+        rows, orient='index', columns=['output', 'demand', 'net_cap', 'percent_use'])
+    return state, balancer, ids
+
+
+def CheckParity():
+    checked = 0
+    for trial in range(PARITY_TRIALS):
+        state, balancer, ids = RandomRegion(200, trial)
+        for id in ids[:10]:
+            expected = LoadBalanceReference(state, id)
+            actual = balancer.balance(id)
+            assert np.isclose(expected, actual, rtol=1e-9, atol=1e-9), (trial, id, expected, actual)
+            checked += 1
+    print("parity: {} LoadBalance calls match the pandas reference".format(checked))
+
+
+def Benchmark():
+    print("{:>8} {:>14} {:>14} {:>9}".format('gens', 'pandas (us)', 'numpy (us)', 'speedup'))
+    for n in SIZES:
+        state, balancer, ids = RandomRegion(n, n)
+        id = ids[n // 2]
+        runs = max(3, 20000 // n)
+        reference = min(timeit.repeat(lambda: LoadBalanceReference(state, id), number=runs, repeat=3)) / runs
+        vectorized = min(timeit.repeat(lambda: balancer.balance(id), number=runs * 10, repeat=3)) / (runs * 10)
+        print("{:>8} {:>14.1f} {:>14.1f} {:>8.1f}x".format(
+            n, reference * 1e6, vectorized * 1e6, reference / vectorized))
+
+
+if __name__ == '__main__':
+    CheckParity()
+    Benchmark()
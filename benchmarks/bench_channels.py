@@ -0,0 +1,67 @@
+"""
+Per-update latency against a local Tracker endpoint: a fresh channel per
+call (the old generator.mutate loop) versus a pooled channel from
+channels.ChannelPool.
+
+    python benchmarks/bench_channels.py [calls]
+"""
+from concurrent import futures
+import os
+import statistics
+import sys
+import time
+
+import grpc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import scowl_pb2
+import scowl_pb2_grpc
+from channels import ChannelPool, SERVER_OPTIONS
+
+CALLS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+
+class EchoTracker(scowl_pb2_grpc.TrackerServicer):
+    """answers every StateUpdate with the demand it was sent"""
+    def UpdateGeneratorState(self, request, context):
+        return scowl_pb2.DemandUpdate(demand=request.demand)
+
+
+def Measure(call):
+    latencies = []
+    for ts in range(CALLS):
+        start = time.perf_counter()
+        call(scowl_pb2.StateUpdate(id='1', ts=ts, output=10.0, demand=7.5))
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.99)]
+
+
+def FreshChannel(addr):
+    def call(request):
+        with grpc.insecure_channel(addr) as channel:
+            scowl_pb2_grpc.TrackerStub(channel).UpdateGeneratorState(request)
+    return call
+
+
+def PooledChannel(addr, pool):
+    def call(request):
+        pool.stub(addr, scowl_pb2_grpc.TrackerStub).UpdateGeneratorState(request)
+    return call
+
+
+if __name__ == '__main__':
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=4), options=SERVER_OPTIONS)
+    scowl_pb2_grpc.add_TrackerServicer_to_server(EchoTracker(), server)
+    port = server.add_insecure_port('localhost:0')
+    server.start()
+    addr = 'localhost:{}'.format(port)
+
+    pool = ChannelPool()
+    PooledChannel(addr, pool)(scowl_pb2.StateUpdate()) # warm up
+    print("{:,} StateUpdates against {}".format(CALLS, addr))
+    for name, call in (('fresh channel', FreshChannel(addr)), ('pooled channel', PooledChannel(addr, pool))):
+        p50, p99 = Measure(call)
+        print("{:<15} p50 {:8.1f} us   p99 {:8.1f} us".format(name, p50 * 1e6, p99 * 1e6))
+    pool.close()
+    server.stop(None)
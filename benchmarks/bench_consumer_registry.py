@@ -0,0 +1,86 @@
+"""
+Memory and speed of a ConsumerRegistry holding CONSUMERS consumers, against
+the dict of str ids a tracker would otherwise keep (measured on DICT_SAMPLE
+consumers and scaled up).
+
+Consumers arrive BATCH at a time, as BulkConsumerJoin replies would, with
+random 128-bit ids. Reports registry bytes and process RSS growth, then
+add_many, vectorized and single-id lookups, and single-id removes per second.
+
+    python benchmarks/bench_consumer_registry.py [consumers]
+"""
+import resource
+import time
+import sys
+import os
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from consumers import ConsumerRegistry, ID_DTYPE, UnpackId
+
+CONSUMERS = 10000000
+BATCH = 1000000
+DICT_SAMPLE = 1000000
+LOOKUPS = 100000    # single-id row() and remove() calls
+RES_CONSUMPTION = 0.00131 # MW, as in tracker.py
+
+
+def RSS() -> float:
+    """returns the current resident set size in MB"""
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 2**20
+
+def RandomIds(rng, n: int) -> np.ndarray:
+    return rng.integers(0, 2**64, size=2 * n, dtype=np.uint64).view(ID_DTYPE)
+
+
+def Benchmark(consumers: int = CONSUMERS):
+    rng = np.random.default_rng(0)
+
+    rss = RSS()
+    ids = [UnpackId(record) for record in RandomIds(rng, DICT_SAMPLE)]
+    lookup = {id: [RES_CONSUMPTION, 0.3, 0.5, -1] for id in ids}
+    dict_mb = (RSS() - rss) * consumers / DICT_SAMPLE # the str ids count too
+    del ids, lookup
+
+    rss = RSS()
+    registry = ConsumerRegistry(consumers)
+    added = 0.0
+    for first in range(0, consumers, BATCH):
+        batch = RandomIds(rng, min(BATCH, consumers - first))
+        max_consumption = rng.uniform(0.5, 1.5, batch.size).astype(np.float32) * RES_CONSUMPTION
+        start = time.perf_counter()
+        registry.add_many(batch, max_consumption, 0.3, 0.5)
+        added += time.perf_counter() - start
+    rss_mb = RSS() - rss
+
+    sample = registry.ids[rng.integers(0, len(registry), LOOKUPS)].copy()
+    start = time.perf_counter()
+    rows = registry.rows(sample)
+    rows_time = time.perf_counter() - start
+    assert (rows >= 0).all()
+    sample_ids = [UnpackId(record) for record in sample[:LOOKUPS]]
+    start = time.perf_counter()
+    for id in sample_ids:
+        registry.row(id)
+    row_time = time.perf_counter() - start
+    start = time.perf_counter()
+    removed = 0
+    for id in set(sample_ids):
+        registry.remove(id)
+        removed += 1
+    remove_time = time.perf_counter() - start
+
+    print("{:,} consumers".format(consumers))
+    print("   - registry           {:>9.0f} MB  ({:.1f} bytes per consumer, {:.0f} MB RSS growth)".format(
+        registry.nbytes / 2**20, registry.nbytes / consumers, rss_mb))
+    print("   - dict of str ids    {:>9.0f} MB  (RSS growth for {:,}, scaled up)".format(dict_mb, DICT_SAMPLE))
+    print("   - add_many           {:>9,.0f} consumers/s".format(consumers / added))
+    print("   - rows()             {:>9,.0f} lookups/s".format(LOOKUPS / rows_time))
+    print("   - row()              {:>9,.0f} lookups/s".format(LOOKUPS / row_time))
+    print("   - remove()           {:>9,.0f} removes/s".format(removed / remove_time))
+
+
+if __name__ == '__main__':
+    Benchmark(*[int(a) for a in sys.argv[1:2]])
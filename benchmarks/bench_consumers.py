@@ -0,0 +1,70 @@
+"""
+Consumer join throughput of the bootstrap server.
+
+Joins CONSUMERS consumers against a running bootstrap server with
+BulkConsumerJoin, BATCH addrs per call from CONCURRENCY threads, then
+UNARY more one ConsumerJoin call at a time for comparison. Checks that both
+RPCs sign an addr with the same id and reports consumers/s for each and the
+bootstrap server's consumer count from GetJoinStats.
+
+    python benchmarks/bench_consumers.py <bootstrap addr> [consumers] [batch] [concurrency] [unary]
+"""
+from concurrent import futures
+import statistics
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import scowl_pb2
+import scowl_pb2_grpc
+from channels import GetStub
+
+CONSUMERS = 1000000
+BATCH = 10000      # addrs per BulkConsumerJoin, ~0.6 MB of ids, under grpc's 4 MB message limit
+CONCURRENCY = 4
+UNARY = 10000      # ConsumerJoin calls, a million would take minutes
+
+
+def Benchmark(bootstrap_addr: str, consumers: int = CONSUMERS, batch: int = BATCH,
+              concurrency: int = CONCURRENCY, unary: int = UNARY):
+    stub = GetStub(bootstrap_addr, scowl_pb2_grpc.BootstrapStub)
+    run = time.time_ns() # distinct consumer addrs per run
+    before = stub.GetJoinStats(scowl_pb2.Empty()).consumers
+
+    def bulk_join(first):
+        addrs = ['consumer/{}/{}'.format(run, i) for i in range(first, min(first + batch, consumers))]
+        start = time.perf_counter()
+        reply = stub.BulkConsumerJoin(scowl_pb2.PeerCtxBatch(addrs=addrs))
+        return time.perf_counter() - start, len(reply.ids), reply.ids[0]
+
+    start = time.perf_counter()
+    with futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        calls = list(pool.map(bulk_join, range(0, consumers, batch)))
+    bulk = time.perf_counter() - start
+    joined = sum(n for _, n, _ in calls)
+    latencies = sorted(latency for latency, _, _ in calls)
+
+    start = time.perf_counter()
+    for i in range(unary):
+        reply = stub.ConsumerJoin(scowl_pb2.PeerCtx(addr='consumer/{}/{}'.format(run, i * batch)))
+        if i < len(calls) and reply.id != calls[i][2]:
+            raise AssertionError('consumer/{}/{}: ConsumerJoin and BulkConsumerJoin ids differ'.format(run, i * batch))
+    single = time.perf_counter() - start
+    counted = stub.GetJoinStats(scowl_pb2.Empty()).consumers - before
+
+    print("{:,} consumers in {} BulkConsumerJoin calls of {:,} from {} threads".format(
+        joined, len(calls), batch, concurrency))
+    print("   - joined in          {:>9.2f} s  ({:,.0f} consumers/s)".format(bulk, joined / bulk))
+    print("   - call latency       {:>9.2f} ms p50, {:.2f} ms max".format(
+        statistics.median(latencies) * 1e3, latencies[-1] * 1e3))
+    if unary:
+        print("{:,} ConsumerJoin calls".format(unary))
+        print("   - joined in          {:>9.2f} s  ({:,.0f} consumers/s)".format(single, unary / single))
+        print("   - speedup            {:>9.1f}x".format((joined / bulk) / (unary / single)))
+    print("bootstrap server counted {:,} consumers".format(counted))
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    Benchmark(args[0], *[int(a) for a in args[1:5]])
@@ -0,0 +1,78 @@
+"""
+Compares loading tracker history from csv (as analysis.ipynb does) against
+the columnar binary format read with history.LoadColumnarHistory, and
+checks both give back the same times.
+
+    python benchmarks/bench_history.py [rows_per_tracker] [trackers]
+"""
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from history import HistoryWriter, EncodeColumnarChunk, HistoryTime, LoadColumnarHistory
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+TRACKERS = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+GENERATORS = 500
+
+
+def WriteTracker(folder, tracker, rng):
+    csv = HistoryWriter(os.path.join(folder, 'host_0_tracker_{}.csv'.format(tracker)), mode='w')
+    csv.write('id,ts,host,tracker,output,demand,net_cap,percent_use,time\n')
+    binary = HistoryWriter(os.path.join(folder, 'host_0_tracker_{}.bin'.format(tracker)), mode='w',
+                           binary=True, encode=EncodeColumnarChunk)
+    ids = rng.integers(-2**31, 2**31, GENERATORS)
+    start = datetime.datetime.now() # naive local, as the tracker records it
+    for i in range(ROWS):
+        id = int(ids[i % GENERATORS])
+        ts = i // GENERATORS
+        output = float(rng.uniform(0, 500))
+        demand = output * 0.75
+        now = start + datetime.timedelta(microseconds=i)
+        csv.write('{},{},0,{},{},{},{},{},{}\n'.format(
+            id, ts, tracker, output, demand, output - demand, 0.25, now.isoformat()))
+        binary.write((id, ts, 0, tracker, output, demand, output - demand, 0.25, HistoryTime(now)))
+    csv.close()
+    binary.close()
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as folder:
+        for tracker in range(TRACKERS):
+            WriteTracker(folder, tracker, rng)
+        ts_max = ROWS // GENERATORS
+        ts_range = (ts_max - 10, ts_max) # the last 10 ticks
+
+        start = time.perf_counter()
+        df = pd.DataFrame()
+        for f in sorted(os.listdir(folder)):
+            if f.endswith('.csv'):
+                df = pd.concat([df, pd.read_csv(os.path.join(folder, f))], ignore_index=True)
+        df.time = pd.to_datetime(df.time)
+        df = df[(df.ts >= ts_range[0]) & (df.ts <= ts_range[1])]
+        csv_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        full = LoadColumnarHistory(folder)
+        full_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        ranged = LoadColumnarHistory(folder, *ts_range)
+        ranged_time = time.perf_counter() - start
+        assert len(ranged) == len(df) and len(full) == ROWS * TRACKERS
+        # same rows in the same order, so the formats must agree on every time
+        assert (ranged['time'].values == df['time'].values).all(), 'csv and columnar times differ'
+
+        sizes = {ext: sum(os.path.getsize(os.path.join(folder, f))
+                          for f in os.listdir(folder) if f.endswith(ext)) for ext in ('.csv', '.bin')}
+        print("{:,} rows across {} trackers".format(ROWS * TRACKERS, TRACKERS))
+        print("csv:      {:8.3f} s  ({:.1f} MB)".format(csv_time, sizes['.csv'] / 1e6))
+        print("columnar: {:8.3f} s  ({:.1f} MB, all rows)".format(full_time, sizes['.bin'] / 1e6))
+        print("columnar: {:8.3f} s  (ts in [{}, {}])".format(ranged_time, *ts_range))
@@ -0,0 +1,89 @@
+"""
+Join throughput of the bootstrap server during a mass cold start.
+
+Sends JOINS GeneratorJoin calls from CONCURRENCY threads against a running
+bootstrap server and its trackers. Every join names this process as its
+callback_addr (as a GeneratorFleet does), so one grpc server counts the
+TrackerHellos. Reports joins/s as seen by the callers, the time until the
+last TrackerHello arrived, and the bootstrap server's GetJoinStats.
+
+    python benchmarks/bench_join.py <bootstrap addr> [joins] [concurrency] [callback port]
+"""
+from concurrent import futures
+import threading
+import statistics
+import time
+import sys
+import os
+
+import grpc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import scowl_pb2
+import scowl_pb2_grpc
+from channels import GetStub
+
+JOINS = 5000
+CONCURRENCY = 32
+CALLBACK_PORT = 35000
+HELLO_TIMEOUT = 120 # seconds to wait for the last TrackerHello
+
+
+class HelloCounter(scowl_pb2_grpc.GeneratorServicer):
+    def __init__(self, expected: int):
+        self.expected = expected
+        self.received = 0
+        self.last = None
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+
+    def ReceiveHello(self, request, context):
+        with self.lock:
+            self.received += 1
+            self.last = time.perf_counter()
+            if self.received >= self.expected:
+                self.done.set()
+        return scowl_pb2.Empty()
+
+
+def Benchmark(bootstrap_addr: str, joins: int = JOINS, concurrency: int = CONCURRENCY,
+              callback_port: int = CALLBACK_PORT):
+    callback_addr = 'localhost:{}'.format(callback_port)
+    counter = HelloCounter(joins)
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=16))
+    scowl_pb2_grpc.add_GeneratorServicer_to_server(counter, server)
+    server.add_insecure_port(callback_addr)
+    server.start()
+
+    stub = GetStub(bootstrap_addr, scowl_pb2_grpc.BootstrapStub)
+    run = time.time_ns() # distinct generator addrs, and so ids, per run
+    def join(i):
+        start = time.perf_counter()
+        stub.GeneratorJoin(scowl_pb2.GeneratorCtx(
+            addr='bench/{}/{}'.format(run, i), kind='nuclear', capacity=1000.0,
+            callback_addr=callback_addr))
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = sorted(pool.map(join, range(joins)))
+    joined = time.perf_counter() - start
+    counter.done.wait(HELLO_TIMEOUT)
+    hellos = (counter.last or start) - start
+    stats = stub.GetJoinStats(scowl_pb2.Empty())
+    server.stop(None)
+
+    print("{} joins from {} threads".format(joins, concurrency))
+    print("   - joined in          {:>9.2f} s  ({:,.0f} joins/s)".format(joined, joins / joined))
+    print("   - join latency       {:>9.2f} ms p50, {:.2f} ms p99".format(
+        statistics.median(latencies) * 1e3, latencies[int(0.99 * (joins - 1))] * 1e3))
+    print("   - hellos received    {:>9}  ({:.2f} s after the first join)".format(counter.received, hellos))
+    print("   - bootstrap server   {} joins, {} registered, {} failed, {} pending in {} batches".format(
+        stats.joins, stats.registered, stats.failed, stats.pending, stats.batches))
+    print("                        {:,.0f} joins/s, {:,.0f} registered/s".format(
+        stats.joins_per_sec, stats.registered_per_sec))
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    Benchmark(args[0], *[int(a) for a in args[1:4]])
@@ -0,0 +1,107 @@
+"""
+Parity check and benchmark for mutation.OutputKernel.
+
+Checks that every row of the kernel reproduces the original per-process
+mutateState/GenOutputCoefficient sequence for the same seed, then steps
+100k generators for 1,000 ticks and compares the cost per tick with a
+loop of GeneratorModels.
+
+    python benchmarks/bench_mutation.py
+"""
+from collections import deque
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from mutation import CoefficientTable, GeneratorModel, OutputKernel
+
+GENERATORS = 100000
+TICKS = 1000
+LOOP_TICKS = 5 # GeneratorModel is too slow to run for all TICKS
+PARITY_GENERATORS = 60
+PARITY_TICKS = 300
+
+
+def SyntheticCoefficients():
+    """a month x kind table shaped like output_config.csv"""
+    months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+    rng = np.random.default_rng(0)
+    return CoefficientTable.from_frame(pd.DataFrame({
+        'hydroelectric':       [(mu, 0.2) for mu in rng.uniform(0.6, 1.0, 12)],
+        'utility-scale solar': [(1.0, 0.48670905525976643)] * 12,
+        'land-based wind':     [(1.0, 0.48670905525976643)] * 6 + [(np.nan, np.nan)] * 6,
+        'nuclear':             [(np.nan, np.nan)] * 12,
+    }, index=months))
+
+
+def MutateReference(capacity, params, seed, ticks):
+    """the original generator.py mutateState loop for one generator"""
+    rng = np.random.default_rng(seed)
+    window = deque([]) # no maxlen, as in generator.py
+    outputs = []
+    for state_ts in range(ticks):
+        mu, sigma = params[state_ts % len(params)]
+        if np.isnan(mu):
+            coef = 0.9
+        else:
+            coef = [v if v > 0 else 0.0 for v in rng.normal(mu, sigma, 1)][0]
+        window.append(coef)
+        outputs.append(capacity * np.array(window).mean())
+    return np.array(outputs)
+
+
+def FillKernel(coefficients, n: int):
+    kinds = coefficients.kinds
+    kernel = OutputKernel(coefficients, capacity=n)
+    models = []
+    for i in range(n):
+        kind = kinds[i % len(kinds)]
+        kernel.add(kind, 100.0 + i % 7, seed=i)
+        models.append((kind, 100.0 + i % 7, i))
+    return kernel, models
+
+
+def CheckParity():
+    coefficients = SyntheticCoefficients()
+    kernel, models = FillKernel(coefficients, PARITY_GENERATORS)
+    outputs = np.array([kernel.step() for _ in range(PARITY_TICKS)]).T
+    worst = 0.0
+    for row, (kind, capacity, seed) in enumerate(models):
+        expected = MutateReference(capacity, coefficients[kind], seed, PARITY_TICKS)
+        assert np.allclose(outputs[row], expected, rtol=1e-12, atol=0), row
+        worst = max(worst, np.max(np.abs(outputs[row] - expected) / expected.clip(1e-300)))
+    print("parity: {} generators x {} ticks match mutateState (max rel. err {:.1e})".format(
+        PARITY_GENERATORS, PARITY_TICKS, worst))
+
+
+def Benchmark():
+    coefficients = SyntheticCoefficients()
+    kernel, models = FillKernel(coefficients, GENERATORS)
+    start = time.perf_counter()
+    for _ in range(TICKS):
+        kernel.step()
+    vectorized = (time.perf_counter() - start) / TICKS
+
+    objects = [GeneratorModel(capacity, kind, coefficients[kind], seed)
+               for kind, capacity, seed in models]
+    start = time.perf_counter()
+    for _ in range(LOOP_TICKS):
+        for model in objects:
+            model.step()
+    loop = (time.perf_counter() - start) / LOOP_TICKS
+
+    print("{} generators, {} ticks".format(GENERATORS, TICKS))
+    print("   - OutputKernel       {:>9.2f} ms/tick  ({:.1f} s total)".format(vectorized * 1e3, vectorized * TICKS))
+    print("   - GeneratorModel     {:>9.2f} ms/tick  (over {} ticks)".format(loop * 1e3, LOOP_TICKS))
+    print("   - speedup            {:>9.1f}x".format(loop / vectorized))
+    print("   - kernel memory      {:>9.1f} MB".format(
+        sum(getattr(kernel, name).nbytes for name, _, _ in kernel._columns()) / 2**20))
+
+
+if __name__ == '__main__':
+    CheckParity()
+    Benchmark()
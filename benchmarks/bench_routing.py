@@ -0,0 +1,55 @@
+"""
+Benchmark for assigning generator ids to trackers: the original linear
+scan over the break points, RoutingTable.lookup (bisection) and
+RoutingTable.lookup_many (vectorized) on one million ids.
+
+    python benchmarks/bench_routing.py [num_trackers]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from routing import RoutingTable, HASH_SIZE
+
+NUM_IDS = 1000000
+NUM_TRACKERS = int(sys.argv[1]) if len(sys.argv) > 1 else 12
+
+
+def AssignBucketLinear(hash_result, num_buckets, hash_size=HASH_SIZE):
+    """bootstrap_server.AssignBucket before the routing table"""
+    break_points = np.linspace((2**(hash_size-1) * -1), (2**(hash_size-1)), num_buckets + 1, dtype=int)
+    bucket = None
+    for i in range(num_buckets):
+        if (hash_result >= break_points[i]) and (hash_result < break_points[i+1]):
+            bucket = i
+            break
+    return bucket
+
+
+if __name__ == '__main__':
+    ids = np.random.default_rng(0).integers(-2**31, 2**31, NUM_IDS)
+    id_list = ids.tolist()
+    table = RoutingTable(NUM_TRACKERS)
+
+    sample = id_list[:NUM_IDS // 100] # the linear scan is too slow for all of them
+    start = time.perf_counter()
+    linear = [AssignBucketLinear(id, NUM_TRACKERS) for id in sample]
+    linear_time = (time.perf_counter() - start) * 100
+
+    start = time.perf_counter()
+    bisected = [table.lookup(id) for id in id_list]
+    bisect_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vectorized = table.lookup_many(ids)
+    vector_time = time.perf_counter() - start
+
+    assert linear == bisected[:len(sample)]
+    assert np.array_equal(vectorized, bisected)
+    print("{:,} ids over {} trackers".format(NUM_IDS, NUM_TRACKERS))
+    print("linear scan:  {:8.3f} s  (extrapolated from {:,} ids)".format(linear_time, len(sample)))
+    print("bisection:    {:8.3f} s".format(bisect_time))
+    print("vectorized:   {:8.3f} s".format(vector_time))
@@ -0,0 +1,102 @@
+"""
+Import time and memory of generator.py processes.
+
+Spawns N generator processes (N = 1, 100, 1000 by default). Each one runs
+with -X importtime, imports generator.py, runs startMutationEngine() (the
+imports and config load of the first tick) and reports its peak RSS.
+'eager' mimics the old module header, which also imported pandas, numpy,
+bootstrap_client and logging; 'slim' is generator.py as it is.
+
+At most PARALLEL processes run at once, so "total RSS" is what N
+generators would hold if they were all alive together.
+
+    python benchmarks/bench_startup.py [N ...]
+"""
+import concurrent.futures
+import subprocess
+import statistics
+import tempfile
+import json
+import time
+import sys
+import os
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+COUNTS = [1, 100, 1000]
+PARALLEL = os.cpu_count() or 1
+
+CHILD = """
+import sys, resource, time
+start = time.perf_counter()
+sys.argv = ['generator.py', 'localhost:33000', 'localhost:50051', '10', '140.0', 'hydroelectric']
+{eager}import generator
+imported = time.perf_counter()
+generator.startMutationEngine()
+ready = time.perf_counter()
+print(json.dumps({{'import_ms': (imported - start) * 1e3, 'ready_ms': (ready - start) * 1e3,
+                  'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                  'pandas': 'pandas' in sys.modules}}))
+"""
+MODES = {
+    'eager': 'import pandas, numpy, logging, bootstrap_client\n',
+    'slim':  '',
+}
+
+
+def WriteConfig(path: str):
+    """a synthetic output_config.csv"""
+    months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(',hydroelectric,utility-scale solar,nuclear\n')
+        for month in months:
+            f.write('{},"(0.8, 0.2)","(1.0, 0.48670905525976643)",\n'.format(month))
+
+
+def ImportTime(stderr: str) -> float:
+    """returns the cumulative ms of every top level import in -X importtime output"""
+    total = 0
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not name.startswith('  '): # top level imports only
+            total += int(cumulative)
+    return total / 1e3
+
+
+def Spawn(mode: str, cwd: str, env: dict) -> dict:
+    code = 'import json\n' + CHILD.format(eager=MODES[mode])
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                          cwd=cwd, env=env, capture_output=True, text=True, check=True)
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result['importtime_ms'] = ImportTime(proc.stderr)
+    return result
+
+
+def Benchmark(counts):
+    cwd = tempfile.mkdtemp(prefix='scowl_startup_')
+    WriteConfig(os.path.join(cwd, 'sim/2030/generators/config/output_config.csv'))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        [ROOT] + [p for p in os.environ.get('PYTHONPATH', '').split(os.pathsep) if p]))
+    Spawn('slim', cwd, env) # compile the coefficient cache and warm the page cache
+
+    print("{:>6} {:>6} {:>12} {:>11} {:>9} {:>14} {:>9}".format(
+        'mode', 'procs', 'import (ms)', 'ready (ms)', 'RSS (MB)', 'total RSS (MB)', 'wall (s)'))
+    for n in counts:
+        for mode in MODES:
+            start = time.perf_counter()
+            with concurrent.futures.ThreadPoolExecutor(max_workers=PARALLEL) as pool:
+                results = list(pool.map(lambda _: Spawn(mode, cwd, env), range(n)))
+            wall = time.perf_counter() - start
+            print("{:>6} {:>6} {:>12.1f} {:>11.1f} {:>9.1f} {:>14.0f} {:>9.1f}".format(
+                mode, n,
+                statistics.median(r['importtime_ms'] for r in results),
+                statistics.median(r['ready_ms'] for r in results),
+                statistics.median(r['rss_mb'] for r in results),
+                sum(r['rss_mb'] for r in results),
+                wall))
+
+
+if __name__ == '__main__':
+    Benchmark([int(n) for n in sys.argv[1:]] or COUNTS)
@@ -0,0 +1,47 @@
+"""
+Microbenchmark for recording StateUpdates: GeneratorStateTable.update()
+against the `state.loc[id] = [...]` DataFrame insertion it replaced.
+
+    python benchmarks/bench_state_table.py
+"""
+import datetime
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from state_table import GeneratorStateTable, STATE_COLUMNS
+
+SIZES = [100, 1000, 10000]
+TICKS = 3
+
+
+def UpdatesPerSecond(update, ids, outputs):
+    start = time.perf_counter()
+    for ts in range(TICKS):
+        for id, output in zip(ids, outputs):
+            update(id, ts, output, output * 0.75)
+    return len(ids) * TICKS / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    print("{:>8} {:>16} {:>16}".format('gens', 'pandas (upd/s)', 'table (upd/s)'))
+    for n in SIZES:
+        rng = np.random.default_rng(n)
+        ids = [str(i) for i in rng.choice(2**31, n, replace=False)]
+        outputs = rng.uniform(0, 500, n).tolist()
+
+        frame = pd.DataFrame(columns=STATE_COLUMNS)
+        def FrameUpdate(id, ts, output, demand):
+            frame.loc[id] = [ts, 0, 0, output, demand, output - demand,
+                             (output - demand) / output, datetime.datetime.now().isoformat()]
+
+        table = GeneratorStateTable()
+        def TableUpdate(id, ts, output, demand):
+            table.update(id, ts, 0, 0, output, demand, datetime.datetime.now())
+
+        print("{:>8} {:>16,.0f} {:>16,.0f}".format(
+            n, UpdatesPerSecond(FrameUpdate, ids, outputs), UpdatesPerSecond(TableUpdate, ids, outputs)))
@@ -0,0 +1,220 @@
+"""
+UpdateGeneratorState throughput and latency of one tracker as its region grows.
+
+For each region size N (SIZES) a tracker.py is started in its own process,
+with SendGeneratorHello stubbed out so no generator has to be listening.
+N synthetic generators, with ids signed as GeneratorJoin signs them, are
+registered through RegisterGenerator, each sends one warm-up update, then
+updates are sent round robin for DURATION seconds with up to CONCURRENCY
+calls in flight. RATE caps the updates sent per second (0 sends as fast as
+the tracker answers); with a cap, latency counts from when an update was
+due, so a tracker falling behind shows up in it. Failed calls are counted
+as errors and left out of the latencies. Reports updates/s, client
+p50/p95/p99 and the tracker's own rpc_seconds, and writes everything to a
+JSON file to compare runs by.
+
+Run from the directory holding sim/, as the tracker logs to sim/2030/logs.
+
+    python benchmarks/bench_tracker.py [sizes] [duration] [rate] [concurrency] [update|epoch] [json path]
+
+e.g. bench_tracker.py 10,100,1000,10000 10 0 16 update bench_tracker.json
+"""
+from urllib.request import urlopen
+import multiprocessing
+import subprocess
+import threading
+import datetime
+import platform
+import json
+import time
+import sys
+import os
+
+import numpy as np
+import grpc
+import mmh3
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+import scowl_pb2
+import scowl_pb2_grpc
+
+SIZES = [10, 100, 1000, 10000]
+DURATION = 10      # seconds of updates per size
+RATE = 0           # updates/s, 0 for as fast as the tracker answers
+CONCURRENCY = 16   # calls in flight
+MODE = 'update'
+JSON_PATH = 'bench_tracker.json'
+
+TRACKER_ID = 900   # port START_PORT + 900, away from the trackers of a running sim
+HOST_ID = 999      # keeps the tracker's logs apart from a real host's
+NUM_TRACKERS = 1
+START_PORT = 32000
+METRICS_PORT = 9900 # the tracker's metrics, off in tracker.py by default
+READY_TIMEOUT = 60 # seconds for the tracker to start
+HASH_SEED = 42     # as in bootstrap_server.py
+PERCENTILES = (50, 95, 99)
+
+
+def NoHello(request):
+    pass
+
+def ServeTracker(mode: str):
+    """process target: tracker.py whose registrations send no TrackerHello"""
+    sys.argv = ['tracker.py', str(START_PORT + TRACKER_ID), str(HOST_ID), str(NUM_TRACKERS), mode]
+    sys.stdout = open(os.devnull, 'w') # a block per registration, the log file has them too
+    import tracker # parses sys.argv
+    tracker.SendGeneratorHello = NoHello
+    tracker.METRICS_PORT = METRICS_PORT
+    tracker.serve()
+
+def GitCommit() -> str:
+    try:
+        return subprocess.run(['git', '-C', ROOT, 'rev-parse', 'HEAD'], capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def ServerLatency() -> dict:
+    """returns the tracker's rpc_seconds{method="UpdateGeneratorState"} in ms, {} if not served"""
+    try:
+        with urlopen('http://localhost:{}/metrics.json'.format(METRICS_PORT), timeout=5) as reply:
+            snapshot = json.load(reply)
+    except OSError:
+        return {}
+    seconds = snapshot.get('rpc_seconds{method="UpdateGeneratorState"}', {})
+    return {key: value * 1e3 for key, value in seconds.items() if key != 'count' and key != 'sum'}
+
+
+def GeneratorIds(n: int) -> dict:
+    """returns {id: addr} for n synthetic generators, each id signed as
+    GeneratorJoin signs it: the str of the signed 32-bit mmh3 hash of its addr"""
+    ids = {}
+    port = 40000
+    while len(ids) < n: # skips the rare colliding addr
+        addr = 'localhost:{}'.format(port)
+        ids.setdefault(str(mmh3.hash(addr, HASH_SEED)), addr)
+        port += 1
+    return ids
+
+def Register(stub, n: int) -> list:
+    """returns the ids of n synthetic generators registered one RegisterGenerator call each"""
+    rng = np.random.default_rng(n)
+    ids = GeneratorIds(n)
+    for id, addr in ids.items():
+        stub.RegisterGenerator(scowl_pb2.GeneratorMetadata(
+            addr=addr, id=id, kind='synthetic', capacity=float(rng.uniform(1, 100))))
+    return list(ids)
+
+def Drive(stub, ids: list, duration: float, rate: float, concurrency: int, ts: int = 1) -> dict:
+    """send UpdateGeneratorState round robin over ids for `duration` seconds"""
+    rng = np.random.default_rng(len(ids))
+    outputs = rng.uniform(1, 100, len(ids))
+    latencies = []
+    errors = [] # one entry per failed call, list.append is atomic where += is not
+    slots = threading.Semaphore(concurrency)
+
+    def done(future, start):
+        if future.exception() is None:
+            latencies.append(time.perf_counter() - start) # list.append is atomic
+        else:
+            errors.append(future.code()) # failed calls would skew the percentiles
+        slots.release()
+
+    interval = 1 / rate if rate else 0
+    sent = 0
+    begin = time.perf_counter()
+    due = begin
+    end = begin + duration
+    while True:
+        if interval:
+            wait = due - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+        now = time.perf_counter()
+        if now >= end:
+            break
+        slots.acquire()
+        i = sent % len(ids)
+        output = outputs[i] * (0.9 + 0.2 * ((sent * 7919) % 101) / 100)
+        future = stub.UpdateGeneratorState.future(scowl_pb2.StateUpdate(
+            id=ids[i], ts=ts + sent // len(ids), output=output, demand=output * 0.8))
+        future.add_done_callback(lambda f, start=due if interval else now: done(f, start))
+        sent += 1
+        due += interval
+    for _ in range(concurrency): # the calls still in flight
+        slots.acquire()
+    elapsed = time.perf_counter() - begin
+
+    latencies = np.array(latencies) * 1e3
+    if not latencies.size:
+        latency_ms = dict.fromkeys(['mean', 'max'] + ['p{}'.format(q) for q in PERCENTILES], float('nan'))
+    else:
+        latency_ms = dict(mean=float(latencies.mean()), max=float(latencies.max()),
+                          **{'p{}'.format(q): float(np.percentile(latencies, q)) for q in PERCENTILES})
+    return dict(updates=sent - len(errors), errors=len(errors), seconds=elapsed,
+                updates_per_s=(sent - len(errors)) / elapsed, latency_ms=latency_ms)
+
+
+def Run(n: int, duration: float, rate: float, concurrency: int, mode: str) -> dict:
+    """one tracker process, n generators"""
+    process = multiprocessing.get_context('spawn').Process(
+        target=ServeTracker, args=(mode,), name='bench-tracker', daemon=True)
+    process.start()
+    channel = grpc.insecure_channel('localhost:{}'.format(START_PORT + TRACKER_ID))
+    try:
+        grpc.channel_ready_future(channel).result(timeout=READY_TIMEOUT)
+        stub = scowl_pb2_grpc.TrackerStub(channel)
+
+        start = time.perf_counter()
+        ids = Register(stub, n)
+        registered = time.perf_counter() - start
+        for id in ids: # every generator in the state table before timing
+            stub.UpdateGeneratorState(scowl_pb2.StateUpdate(id=id, ts=0, output=50.0, demand=40.0))
+
+        result = dict(generators=n, register_per_s=n / registered,
+                      **Drive(stub, ids, duration, rate, concurrency))
+        result['server_ms'] = ServerLatency()
+        return result
+    finally:
+        channel.close()
+        process.terminate() # SIGTERM, the tracker flushes its writers
+        process.join(READY_TIMEOUT)
+        if process.is_alive():
+            process.kill()
+            process.join()
+
+
+def Benchmark(sizes=SIZES, duration: float = DURATION, rate: float = RATE,
+              concurrency: int = CONCURRENCY, mode: str = MODE, json_path: str = JSON_PATH):
+    results = []
+    print("{:>10} {:>12} {:>10} {:>9} {:>9} {:>9} {:>9} {:>12} {:>7}".format(
+        'generators', 'registers/s', 'updates/s', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms', 'server p50', 'errors'))
+    for n in sizes:
+        result = Run(n, duration, rate, concurrency, mode)
+        results.append(result)
+        latency = result['latency_ms']
+        print("{:>10,} {:>12,.0f} {:>10,.0f} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f} {:>12.3f} {:>7,}".format(
+            n, result['register_per_s'], result['updates_per_s'], latency['p50'], latency['p95'],
+            latency['p99'], latency['max'], result['server_ms'].get('p50', float('nan')), result['errors']))
+
+    report = dict(
+        benchmark='bench_tracker', time=datetime.datetime.now().isoformat(), commit=GitCommit(),
+        python=platform.python_version(), grpc=grpc.__version__, cpus=os.cpu_count(),
+        duration=duration, rate=rate, concurrency=concurrency, mode=mode, results=results)
+    with open(json_path, 'w') as f:
+        json.dump(report, f, indent=1)
+    print("results written to {}".format(json_path))
+    return report
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    kwargs = {}
+    if len(args) > 0:
+        kwargs['sizes'] = [int(n) for n in args[0].split(',')]
+    for name, convert, arg in (('duration', float, 1), ('rate', float, 2), ('concurrency', int, 3),
+                               ('mode', str, 4), ('json_path', str, 5)):
+        if len(args) > arg:
+            kwargs[name] = convert(args[arg])
+    Benchmark(**kwargs)
@@ -1,6 +1,9 @@
 from concurrent import futures
-import numpy as np
+import bisect
+import threading
 import datetime
+import signal
+import time
 # import logging
 import grpc
 import mmh3
@@ -11,6 +14,11 @@ HASH_SEED = 42 # for use with mmh3
 # Scowl specific imports
 import scowl_pb2
 import scowl_pb2_grpc
+from routing import GetRoutingTable, HashRing
+from channels import GetStub, SERVER_OPTIONS
+from registration import RegistrationDispatcher
+from history import HistoryWriter
+from metrics import REGISTRY, MetricsInterceptor, ServeMetrics
 
 # mmh3 has weird deprication warnings. Don't have time to investigate source
 import warnings
@@ -20,13 +28,27 @@ HASH_SIZE = 32 # bits
 
 # log file path
 LOG_PATH = 'sim/2030/logs/bootstrap_server.log'
+# metrics, see metrics.py. Served on METRICS_PORT (None: not served), written to METRICS_PATH on shutdown
+METRICS_PORT = 50052
+METRICS_PATH = 'sim/2030/logs/bootstrap_server.metrics'
 
 # Tracker IP address and port
 NUM_TRACKERS = int(sys.argv[1]) # used to compute the port and host IP of tracker
 TRACKER_HOST = 'localhost'
 TRACKER_PORT = 32000
 TRACKER_ADDR = TRACKER_HOST + ':' + str(TRACKER_PORT)
-TRACKER_HASH_RANGES = np.linspace((2**(HASH_SIZE-1) * -1), (2**(HASH_SIZE-1)), NUM_TRACKERS + 1, dtype=int)
+ROUTING_TABLE = GetRoutingTable(NUM_TRACKERS, HASH_SIZE)
+TRACKER_HASH_RANGES = ROUTING_TABLE.break_points
+
+# 'range': fixed equal split of the hash space across NUM_TRACKERS
+# 'ring':  consistent hash ring, trackers can be added/removed at runtime
+ROUTING = 'range'
+TRACKER_RING = HashRing()
+for tracker_id in range(NUM_TRACKERS):
+    TRACKER_RING.add(tracker_id)
+# seconds AddTracker/RemoveTracker wait for registrations in flight before
+# migrating, for the migrated generators to be registered, and per UnregisterGenerator
+MIGRATE_TIMEOUT = 30
 
 # Path to Tracker Host IPs
 TRACKER_CONFIG = 'sim/2030/trackers/config/tracker_addrs.txt'
@@ -34,6 +56,8 @@ TRACKER_CONFIG = 'sim/2030/trackers/config/tracker_addrs.txt'
 # this will store the tracker address book
 tracker_lookup = {}
 
+log_writer = None # a HistoryWriter on LOG_PATH, opened by serve()
+
 def LoadTrackers(path: str = TRACKER_CONFIG):
     """takes a path and returns the ip addresses found there"""
     file = ""
@@ -46,16 +70,12 @@ TRACKER_IPS = LoadTrackers(TRACKER_CONFIG)
 
 def LogRequest(request, context, response=None, to_log=False):
     if to_log:
-        with open(LOG_PATH, 'a') as f:
-            f.write('------------ Request Received ------------\n')
-            f.write('Date:     {}\n'.format(datetime.datetime.now()))
-            f.write('From:     {}\n'.format(request.addr))
-            # f.write('Context:  {}\n'.format(context.peer()))
-            f.write('Type:     "{}"\n'.format(request.kind))
-            f.write('Capacity: {}\n'.format(request.capacity))
-            if response is not None:
-                f.write('Response: {}\n'.format(response))
-            # f.write("------------ Request Handled  ------------\n")
+        LogLine('------------ Request Received ------------\n'
+                'Date:     {}\n'
+                'From:     {}\n'
+                'Type:     "{}"\n'
+                'Capacity: {}\n'.format(datetime.datetime.now(), request.addr, request.kind, request.capacity)
+                + ('Response: {}\n'.format(response) if response is not None else ''))
     else:
         print("------------ Request Received ------------")
         print("Date     {}".format(datetime.datetime.now()))
@@ -78,28 +98,45 @@ def GetTrackerLookup(num_trackers: int = NUM_TRACKERS, starting_port: int = TRAC
     return lookup
 
 def AssignBucket(hash_result: int, num_buckets=NUM_TRACKERS, break_points = None, hash_size=HASH_SIZE):
-    break_points = break_points
+    """returns the tracker (bucket) responsible for hash_result, or None"""
     if break_points is None:
-        break_points = np.linspace((2**(hash_size-1) * -1), (2**(hash_size-1)), num_buckets + 1, dtype=int)
-    bucket = None
-    for i in range(num_buckets):
-        if (hash_result >= break_points[i]) and (hash_result < break_points[i+1]):
-            bucket = i
-            break
-    return bucket
+        return GetRoutingTable(num_buckets, hash_size).lookup(hash_result)
+    bucket = bisect.bisect_right(break_points, hash_result) - 1
+    if 0 <= bucket < num_buckets:
+        return bucket
+    return None
 
 def ShareNewGenerator(tracker_addr, gen_addr, id, kind, capacity):
     """Share new Generator w/ Tracker"""
-    with grpc.insecure_channel(tracker_addr) as channel:
-        stub = scowl_pb2_grpc.TrackerStub(channel)
-        stub.RegisterGenerator(scowl_pb2.GeneratorMetadata(
-            addr=gen_addr,
-            id=id,
-            kind=kind,
-            capacity=capacity)) # returns None
+    stub = GetStub(tracker_addr, scowl_pb2_grpc.TrackerStub)
+    stub.RegisterGenerator(scowl_pb2.GeneratorMetadata(
+        addr=gen_addr,
+        id=id,
+        kind=kind,
+        capacity=capacity)) # returns None
     print("--- Triaged Generator ---")
     print("ID: {}".format(id))
 
+def HashConsumers(addrs, seed: int = HASH_SEED) -> list:
+    """returns the 128-bit id of each consumer addr, as ConsumerJoin signs it"""
+    hash128 = mmh3.hash128
+    return [str(hash128(addr, seed)) for addr in addrs]
+
+def LogLine(line: str):
+    """append to the log, from log_writer's thread once serve() has opened it"""
+    if log_writer is not None:
+        log_writer.write(line)
+        return
+    with open(LOG_PATH, 'a') as f:
+        f.write(line)
+
+def CallbackAddr(gen):
+    """returns where the tracker should send the TrackerHello for GeneratorCtx gen"""
+    return gen.callback_addr or gen.addr
+
+def GetTrackerAddr(tracker_id):
+    return tracker_lookup[tracker_id]['addr'] + ":" + tracker_lookup[tracker_id]['port']
+
 def GetOwnIP():
     import socket   
     hostname=socket.gethostname()   
@@ -111,6 +148,19 @@ class BootstrapServicer(scowl_pb2_grpc.BootstrapServicer):
     """Provides methods that implement functionality of scowl Bootstrapping server."""
     def __init__(self):
         self.hash_seed = HASH_SEED
+        self.Generators = {} # id -> [GeneratorCtx, tracker_id], for migrations
+        self.lock = threading.Lock()
+        self.migrate_lock = threading.Lock() # one AddTracker/RemoveTracker at a time, joins go on
+        self.consumers = 0 # consumers given an id, too many to log one by one
+        self.consumer_lock = threading.Lock()
+        # registers joined generators with their trackers in the background
+        self.dispatcher = RegistrationDispatcher(log=LogLine)
+
+    def RouteGenerator(self, id: int):
+        """returns the tracker responsible for id"""
+        if ROUTING == 'ring':
+            return TRACKER_RING.lookup(id)
+        return ROUTING_TABLE.lookup(id)
 
     def GeneratorJoin(self, request, context):
         """request: scowl_pb2.PeerCtx # [str]
@@ -123,27 +173,186 @@ class BootstrapServicer(scowl_pb2_grpc.BootstrapServicer):
         LogRequest(request, context, id, to_log=True)
         # TODO: replace addr with a value from the tracker_lookup,
         #       and 
-        tracker_id = AssignBucket(id, break_points=TRACKER_HASH_RANGES)
-        tracker_addr = tracker_lookup[tracker_id]['addr'] + ":" + tracker_lookup[tracker_id]['port']
-        ShareNewGenerator(tracker_addr, request.addr, str(id), request.kind, request.capacity)
+        with self.lock: # routed and queued before, or after, a ring change, see Migrate
+            tracker_id = self.RouteGenerator(id)
+            self.Generators[str(id)] = [request, tracker_id]
+            tracker_addr = GetTrackerAddr(tracker_id)
+            # answered before the tracker knows, its TrackerHello follows
+            self.dispatcher.submit(tracker_addr, scowl_pb2.GeneratorMetadata(
+                addr=CallbackAddr(request), id=str(id), kind=request.kind, capacity=request.capacity))
         print("Assigned Gen_<{}> to Tracker_{} @ {}".format(id, tracker_id, tracker_addr))
         return scowl_pb2.Id32Bit(id=str(id))
 
+    def GetJoinStats(self, request, context):
+        """returns:
+            scowl_pb2.JoinStats # see RegistrationDispatcher.stats
+        """
+        return scowl_pb2.JoinStats(consumers=self.consumers, **self.dispatcher.stats())
+
     def ConsumerJoin(self, request, context):
         """request: scowl_pb2.PeerCtx # [str]
 
         returns:
-            scowl_pb2.Id32Bit # [int]
+            scowl_pb2.Id128Bit # [int]
         """
         id = mmh3.hash128(request.addr, self.hash_seed)
         # id_str = id.to_bytes(16, "big", signed=True).decode('unicode_escape')
-        LogRequest(request, context, id, to_log=True)
+        with self.consumer_lock:
+            self.consumers += 1
         return scowl_pb2.Id128Bit(id=str(id))
 
+    def BulkConsumerJoin(self, request, context):
+        """request: scowl_pb2.PeerCtxBatch # [str]
+
+        returns:
+            scowl_pb2.Id128BitBatch # [str], one id per addr in request order
+        """
+        start = time.perf_counter()
+        ids = HashConsumers(request.addrs, self.hash_seed)
+        with self.consumer_lock:
+            self.consumers += len(ids)
+            total = self.consumers
+        LogLine('{} BulkConsumerJoin: {} consumers in {:.1f} ms, {} in total\n'.format(
+            datetime.datetime.now(), len(ids), (time.perf_counter() - start) * 1e3, total))
+        return scowl_pb2.Id128BitBatch(ids=ids)
+
+    def AddTracker(self, request, context):
+        """request: scowl_pb2.TrackerCtx
+
+        returns:
+            scowl_pb2.MigrationPlan # generators moved to the new tracker
+        """
+        if ROUTING != 'ring':
+            context.abort(grpc.StatusCode.FAILED_PRECONDITION, "trackers can only be added with ROUTING = 'ring'")
+        host, _, port = request.addr.rpartition(':')
+        if not host or not port.isdigit():
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, "tracker addr must be host:port, got '{}'".format(request.addr))
+        if request.weight < 0:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, 'tracker weight must be positive')
+        with self.migrate_lock:
+            with self.lock:
+                tracker_lookup[request.tracker_id] = {'host_id': 0, 'addr': host, 'port': port}
+                plan = TRACKER_RING.add(request.tracker_id, request.weight or 1.0, ids=self.Generators)
+                moves = self.PlanMoves(plan)
+            failed = self.Migrate(moves, unshare=True)
+        return MigrationPlanMessage(plan, failed)
+
+    def RemoveTracker(self, request, context):
+        """request: scowl_pb2.TrackerCtx, only tracker_id is used
+
+        returns:
+            scowl_pb2.MigrationPlan # generators moved off the removed tracker
+        """
+        if ROUTING != 'ring':
+            context.abort(grpc.StatusCode.FAILED_PRECONDITION, "trackers can only be removed with ROUTING = 'ring'")
+        with self.migrate_lock:
+            with self.lock:
+                if request.tracker_id not in TRACKER_RING:
+                    context.abort(grpc.StatusCode.NOT_FOUND, 'unknown tracker {}'.format(request.tracker_id))
+                if len(TRACKER_RING) == 1 and self.Generators:
+                    context.abort(grpc.StatusCode.FAILED_PRECONDITION,
+                                  'cannot remove the last tracker while it owns generators')
+                plan = TRACKER_RING.remove(request.tracker_id, ids=self.Generators)
+                moves = self.PlanMoves(plan)
+            # the removed tracker is leaving, no need to unregister from it
+            failed = self.Migrate(moves, unshare=False)
+            with self.lock:
+                tracker_lookup.pop(request.tracker_id, None)
+        return MigrationPlanMessage(plan, failed)
+
+    def FlushRegistrations(self):
+        """wait, without the lock, for the registrations in flight before a
+        migration. A join still being registered would otherwise reach its
+        old tracker after the new one and say hello from there. A tracker
+        that stops answering costs at most MIGRATE_TIMEOUT"""
+        if not self.dispatcher.flush(timeout=MIGRATE_TIMEOUT):
+            LogLine('{} migrating with {} registrations still pending\n'.format(
+                datetime.datetime.now(), self.dispatcher.pending))
+
+    def PlanMoves(self, plan) -> list:
+        """returns [(GeneratorMetadata, old tracker addr, new tracker addr)] for
+        plan. Call with lock held, in the same hold as the ring change: joins
+        before it were queued for their old tracker and are in plan, joins
+        after it are routed by the new ring."""
+        moves = []
+        for gen_id, old_tracker, new_tracker in plan:
+            gen, _ = self.Generators[gen_id]
+            old_addr = GetTrackerAddr(old_tracker) if old_tracker in tracker_lookup else None
+            moves.append((scowl_pb2.GeneratorMetadata(
+                addr=CallbackAddr(gen), id=gen_id, kind=gen.kind, capacity=gen.capacity),
+                old_addr, GetTrackerAddr(new_tracker)))
+        return moves
+
+    def Migrate(self, moves, unshare: bool) -> list:
+        """register each moved generator with its new tracker through the
+        dispatcher, then unregister it from its old one. Call without the
+        lock, joins go on meanwhile.
+
+        returns:
+            list # ids the new tracker did not register, left with the old one
+        """
+        # joins that raced the ring change were queued for their old tracker,
+        # their hellos go first so the new tracker's hello is the last one
+        self.FlushRegistrations()
+        outcomes = {} # id -> registered by the new tracker
+        outcome = threading.Condition()
+        def done(gen_id, ok):
+            with outcome:
+                outcomes[gen_id] = ok
+                outcome.notify()
+        for gen, _, new_addr in moves:
+            self.dispatcher.submit(new_addr, gen, done=done)
+        with outcome:
+            if not outcome.wait_for(lambda: len(outcomes) == len(moves), MIGRATE_TIMEOUT):
+                LogLine('{} {} migrated generators still not registered after {} s\n'.format(
+                    datetime.datetime.now(), len(moves) - len(outcomes), MIGRATE_TIMEOUT))
+            registered = {gen_id for gen_id, ok in outcomes.items() if ok}
+        failed = [gen.id for gen, _, _ in moves if gen.id not in registered]
+
+        unregistering = []
+        if unshare:
+            for gen, old_addr, _ in moves:
+                if gen.id in registered and old_addr is not None:
+                    stub = GetStub(old_addr, scowl_pb2_grpc.TrackerStub)
+                    unregistering.append(stub.UnregisterGenerator.future(gen, timeout=MIGRATE_TIMEOUT))
+        # the new tracker has them either way, a failure leaves a stale copy on the old one
+        unshare_failed = sum(future.exception() is not None for future in unregistering)
+        with self.lock:
+            for gen, _, _ in moves:
+                if gen.id in registered and gen.id in self.Generators:
+                    self.Generators[gen.id][1] = TRACKER_RING.lookup(int(gen.id))
+        LogLine('------------ Trackers Changed ------------\n'
+                'Date:     {}\n'
+                'Trackers: {}\n'
+                'Migrated: {} generators\n'
+                'Failed:   {} (left with their old tracker)\n'
+                'Stale:    {} (not unregistered from their old tracker)\n'.format(
+                    datetime.datetime.now(), sorted(TRACKER_RING.weights), len(moves) - len(failed),
+                    len(failed), unshare_failed))
+        return failed
+
+def MigrationPlanMessage(plan, failed=()):
+    return scowl_pb2.MigrationPlan(migrations=[
+        scowl_pb2.Migration(gen_id=gen_id, from_tracker=old, to_tracker=new)
+        for gen_id, old, new in plan], failed=failed)
+
 def serve():
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    global log_writer
+    log_writer = HistoryWriter(LOG_PATH, mode='w', timer=REGISTRY.histogram('flush_seconds', file='log'))
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10), options=SERVER_OPTIONS,
+                         interceptors=[MetricsInterceptor()])
+    servicer = BootstrapServicer()
+    REGISTRY.gauge('consumers', lambda: servicer.consumers)
+    for name in ('joins', 'registered', 'failed', 'pending', 'batches'):
+        REGISTRY.gauge('registration_' + name, lambda name=name: servicer.dispatcher.stats()[name])
+    metrics_server = None
+    if METRICS_PORT is not None:
+        try:
+            metrics_server = ServeMetrics(METRICS_PORT)
+        except OSError as e:
+            print('metrics not served on {}: {}'.format(METRICS_PORT, e))
     scowl_pb2_grpc.add_BootstrapServicer_to_server(
-        BootstrapServicer(), server)
+        servicer, server)
     addr = GetOwnIP() + ':' + '50051'
     server.add_insecure_port('[::]:50051') # 
     server.start()
@@ -151,10 +360,25 @@ def serve():
     print("------------- Server Started -------------", )   
     print('Started: ', start_time)
     print('Addr:    ', addr)
-    with open(LOG_PATH, "w") as f:
-        f.write("------------- Server Started -------------\n")
-        f.write('Started: {}\n'.format(start_time))
-    server.wait_for_termination()
+    LogLine("------------- Server Started -------------\n"
+            'Started: {}\n'.format(start_time))
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.stop(None))
+    try:
+        server.wait_for_termination()
+    finally:
+        servicer.dispatcher.close()
+        stats = servicer.dispatcher.stats()
+        print('registrations: {}'.format(stats))
+        LogLine("------------- Server Stopped -------------\n"
+                "Consumers:  {consumers}\n"
+                "Joins:      {joins} ({joins_per_sec:.1f}/s)\n"
+                "Registered: {registered} ({registered_per_sec:.1f}/s)\n"
+                "Failed:     {failed}\n"
+                "Batches:    {batches}\n".format(consumers=servicer.consumers, **stats))
+        log_writer.close()
+        REGISTRY.dump(METRICS_PATH)
+        if metrics_server is not None:
+            metrics_server.shutdown()
 
 if __name__ == '__main__':
     # logging.basicConfig()
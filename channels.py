@@ -0,0 +1,135 @@
+"""
+Shared gRPC channels.
+
+Opening a grpc.insecure_channel costs a TCP and HTTP/2 handshake, so every
+component reuses one channel per address from a process-wide ChannelPool.
+Stubs are cached per channel, idle channels are closed after
+IDLE_TIMEOUT seconds and keepalive pings keep long-lived ones healthy. A
+channel is only idle while nothing holds it: wrap a call that outlives
+IDLE_TIMEOUT, e.g. a stream, in `with HoldChannel(addr):`.
+
+An AioChannelPool does the same for grpc.aio channels; use it from the
+event loop that owns them.
+"""
+import contextlib
+import threading
+import asyncio
+import time
+
+import grpc
+
+IDLE_TIMEOUT = 300 # seconds without use before a channel is closed
+
+# client side keepalive, pings only while calls are in flight
+CHANNEL_OPTIONS = [
+    ('grpc.keepalive_time_ms', 60000),
+    ('grpc.keepalive_timeout_ms', 20000),
+    ('grpc.keepalive_permit_without_calls', 0),
+]
+
+# server side, accept the pings sent by CHANNEL_OPTIONS
+SERVER_OPTIONS = [
+    ('grpc.keepalive_permit_without_calls', 0),
+    ('grpc.http2.min_ping_interval_without_data_ms', 30000),
+]
+
+
+class ChannelPool:
+    """Thread-safe cache of one channel (and its stubs) per address."""
+    def __init__(self, options=CHANNEL_OPTIONS, idle_timeout: float = IDLE_TIMEOUT):
+        self.options = options
+        self.idle_timeout = idle_timeout
+        self._entries = {} # addr -> [channel, last_used, {stub_class: stub}, holders]
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _entry(self, addr: str):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_sweep > self.idle_timeout / 2:
+                self._evict_idle(now)
+            entry = self._entries.get(addr)
+            if entry is None:
+                entry = [self._open(addr), now, {}, 0]
+                self._entries[addr] = entry
+            entry[1] = now
+            return entry
+
+    def _open(self, addr: str):
+        return grpc.insecure_channel(addr, options=self.options)
+
+    def _close(self, channel):
+        channel.close()
+
+    def channel(self, addr: str) -> grpc.Channel:
+        """returns the shared channel for addr, opening it if needed"""
+        return self._entry(addr)[0]
+
+    def stub(self, addr: str, stub_class):
+        """returns a cached stub_class (e.g. scowl_pb2_grpc.TrackerStub) for addr"""
+        channel, _, stubs, _ = self._entry(addr)
+        stub = stubs.get(stub_class)
+        if stub is None:
+            stub = stubs.setdefault(stub_class, stub_class(channel))
+        return stub
+
+    @contextlib.contextmanager
+    def hold(self, addr: str):
+        """keep addr's channel open while the block runs, however long since
+        it was last handed out. yields the channel"""
+        entry = self._entry(addr)
+        with self._lock:
+            entry[3] += 1
+        try:
+            yield entry[0]
+        finally:
+            with self._lock:
+                entry[3] -= 1
+                entry[1] = time.monotonic() # idle from now, not from when the block began
+
+    def _evict_idle(self, now: float):
+        """close channels unused for idle_timeout seconds and not held. Call with lock held."""
+        self._last_sweep = now
+        for addr in [a for a, e in self._entries.items() if not e[3] and now - e[1] > self.idle_timeout]:
+            self._close(self._entries.pop(addr)[0])
+
+    def evict_idle(self) -> int:
+        """returns the number of channels closed"""
+        with self._lock:
+            before = len(self._entries)
+            self._evict_idle(time.monotonic())
+            return before - len(self._entries)
+
+    def close(self, addr: str = None):
+        """close the channel for addr, or every channel"""
+        with self._lock:
+            addrs = list(self._entries) if addr is None else [addr]
+            for a in addrs:
+                entry = self._entries.pop(a, None)
+                if entry is not None:
+                    self._close(entry[0])
+
+
+class AioChannelPool(ChannelPool):
+    """ChannelPool of grpc.aio channels, closed in the background on the
+    running event loop."""
+    def _open(self, addr: str):
+        return grpc.aio.insecure_channel(addr, options=self.options)
+
+    def _close(self, channel):
+        asyncio.get_running_loop().create_task(channel.close())
+
+
+# one pool per process
+POOL = ChannelPool()
+
+def GetStub(addr: str, stub_class):
+    """shorthand for POOL.stub(addr, stub_class)"""
+    return POOL.stub(addr, stub_class)
+
+def HoldChannel(addr: str):
+    """shorthand for POOL.hold(addr)"""
+    return POOL.hold(addr)
@@ -0,0 +1,278 @@
+"""
+Compact registry of the consumers in a tracker's region.
+
+A consumer id is the 128-bit mmh3 hash ConsumerJoin signs, kept as one
+packed 16-byte record (ID_DTYPE) rather than a str. Each consumer's fields
+are parallel typed columns (CONSUMER_SCHEMA) indexed by a stable row, as
+in a GeneratorStateTable. Ids are found through an open-addressing index:
+a power-of-two int32 array of rows, probed linearly from the id's low bits
+(already a uniform hash) and kept at most MAX_LOAD full. A consumer costs
+about 40 bytes, so ten million fit in ~0.6 GB including spare capacity.
+
+add_many() and rows() work on whole batches, e.g. a BulkConsumerJoin
+reply, with vectorized probing. add(), row() and remove() are for one id.
+"""
+import numpy as np
+
+# a 128-bit id as two little-endian 64-bit halves, i.e. int.to_bytes(16, 'little')
+ID_DTYPE = np.dtype([('lo', '<u8'), ('hi', '<u8')])
+ID_MASK = 2**128 - 1 # ids from mmh3.hash128(..., signed=True) wrap to unsigned
+
+# column name -> dtype
+CONSUMER_SCHEMA = {
+    'max_consumption': np.float32, # MW, stochastic + deferrable
+    'deferrable':      np.float32, # fraction of max_consumption that can be defer()red
+    'responsive':      np.float32, # fraction of the deferrable part that can be shed()
+    'generator':       np.int32,   # GeneratorStateTable row of its generator, -1 if starving
+}
+CONSUMER_COLUMNS = list(CONSUMER_SCHEMA)
+
+EMPTY = -1      # free index slot, and the generator of an unassigned consumer
+MAX_LOAD = 0.5  # index slots in use before the index doubles
+
+
+def PackIds(ids) -> np.ndarray:
+    """returns ids (str or int as ConsumerJoin signs them, or an ID_DTYPE
+    array) as an ID_DTYPE array"""
+    if isinstance(ids, np.ndarray) and ids.dtype == ID_DTYPE:
+        return ids
+    packed = b''.join((int(id) & ID_MASK).to_bytes(16, 'little') for id in ids)
+    return np.frombuffer(packed, dtype=ID_DTYPE)
+
+def UnpackId(record) -> str:
+    """returns an ID_DTYPE record as the str ConsumerJoin signed"""
+    return str(int(record['hi']) << 64 | int(record['lo']))
+
+
+class ConsumerRegistry:
+    """Fixed-schema column store with one row per consumer id."""
+    __slots__ = ('ids', 'size', 'capacity', 'index', 'mask') + tuple(CONSUMER_COLUMNS)
+
+    def __init__(self, capacity: int = 1024):
+        """capacity: rows to allocate up front. Growing copies every
+        column, so size it for the expected consumers when that is known"""
+        self.size = 0
+        self.capacity = 0
+        self.ids = np.zeros(0, dtype=ID_DTYPE)
+        for name, dtype in CONSUMER_SCHEMA.items():
+            setattr(self, name, np.zeros(0, dtype=dtype))
+        self._grow(max(int(capacity), 1))
+        self._reindex(self._slots_for(self.capacity))
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, id):
+        return self.row(id) is not None
+
+    @property
+    def nbytes(self) -> int:
+        """bytes held by the ids, columns and index"""
+        return self.ids.nbytes + self.index.nbytes + sum(
+            getattr(self, name).nbytes for name in CONSUMER_COLUMNS)
+
+    def _grow(self, capacity: int):
+        ids = np.zeros(capacity, dtype=ID_DTYPE)
+        ids[:self.size] = self.ids[:self.size]
+        self.ids = ids
+        for name, dtype in CONSUMER_SCHEMA.items():
+            column = np.full(capacity, EMPTY, dtype=dtype) if name == 'generator' else np.zeros(capacity, dtype=dtype)
+            column[:self.size] = getattr(self, name)[:self.size]
+            setattr(self, name, column)
+        self.capacity = capacity
+
+    @staticmethod
+    def _slots_for(rows: int) -> int:
+        """returns the smallest power of two holding rows at MAX_LOAD"""
+        return 1 << max(int(np.ceil(rows / MAX_LOAD)) - 1, 1).bit_length()
+
+    def _reindex(self, slots: int):
+        """rebuild the index with `slots` slots"""
+        self.index = np.full(slots, EMPTY, dtype=np.int32)
+        self.mask = slots - 1
+        self._place(np.arange(self.size, dtype=np.int32))
+
+    def _place(self, rows: np.ndarray):
+        """index rows whose ids are not in the index yet"""
+        index, mask = self.index, self.mask
+        slots = (self.ids['lo'][rows] & np.uint64(mask)).astype(np.int64)
+        while rows.size:
+            free = index[slots] == EMPTY
+            # rows probing the same free slot: the first one takes it, the rest probe on
+            claimed, first = np.unique(slots[free], return_index=True)
+            index[claimed] = rows[free][first]
+            placed = np.zeros(rows.size, dtype=bool)
+            placed[np.flatnonzero(free)[first]] = True
+            rows, slots = rows[~placed], (slots[~placed] + 1) & mask
+
+    def _find(self, keys: np.ndarray):
+        """returns (rows, slots) of keys, row EMPTY and slot the free slot probing stopped at if absent"""
+        index, mask, ids = self.index, self.mask, self.ids
+        slots = (keys['lo'] & np.uint64(mask)).astype(np.int64)
+        rows = np.full(keys.size, EMPTY, dtype=np.int32)
+        active = np.arange(keys.size)
+        while active.size:
+            row = index[slots[active]]
+            found = ids[row] == keys[active] # ids[-1] for free slots, masked below
+            found &= row != EMPTY
+            rows[active[found]] = row[found]
+            active = active[(row != EMPTY) & ~found]
+            slots[active] = (slots[active] + 1) & mask
+        return rows, slots
+
+    def _slot(self, lo: int, hi: int) -> int:
+        """returns the index slot holding (lo, hi), or the free slot where probing stopped"""
+        index, mask, ids = self.index, self.mask, self.ids
+        slot = lo & mask
+        while True:
+            row = int(index[slot])
+            if row == EMPTY:
+                return slot
+            record = ids[row]
+            if int(record['lo']) == lo and int(record['hi']) == hi:
+                return slot
+            slot = (slot + 1) & mask
+
+    def row(self, id):
+        """returns the row of id, or None"""
+        id = int(id) & ID_MASK
+        row = int(self.index[self._slot(id & 0xFFFFFFFFFFFFFFFF, id >> 64)])
+        return None if row == EMPTY else row
+
+    def rows(self, ids) -> np.ndarray:
+        """vectorized row(). returns an int32 array of rows, EMPTY where unknown"""
+        return self._find(PackIds(ids))[0]
+
+    def add(self, id, max_consumption: float, deferrable: float = 0.0, responsive: float = 0.0) -> int:
+        """register or update one consumer.
+
+        returns:
+            int # the consumer's row
+        """
+        id = int(id) & ID_MASK
+        lo, hi = id & 0xFFFFFFFFFFFFFFFF, id >> 64
+        slot = self._slot(lo, hi)
+        row = int(self.index[slot])
+        if row == EMPTY:
+            if self.size == self.capacity:
+                self._grow(self.capacity * 2)
+            row = self.size
+            self.ids[row] = (lo, hi)
+            self.generator[row] = EMPTY
+            self.size += 1
+            if self.size > MAX_LOAD * self.index.size:
+                self._reindex(self.index.size * 2)
+            else:
+                self.index[slot] = row
+        self.max_consumption[row] = max_consumption
+        self.deferrable[row] = deferrable
+        self.responsive[row] = responsive
+        return row
+
+    def add_many(self, ids, max_consumption, deferrable=0.0, responsive=0.0) -> np.ndarray:
+        """register or update a batch of consumers. Fields are scalars or
+        arrays in the order of ids; of an id given twice the first is kept.
+
+        returns:
+            np.ndarray # int32 row of each id
+        """
+        keys = PackIds(ids)
+        n = keys.size
+        unique, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        order = np.argsort(first, kind='stable') # unique ids in the order they were given
+        unique, first = unique[order], first[order]
+        rows, _ = self._find(unique)
+        new = rows == EMPTY
+        added = int(new.sum())
+        if self.size + added > self.capacity:
+            self._grow(max(self.capacity * 2, self.size + added))
+        rows[new] = np.arange(self.size, self.size + added, dtype=np.int32)
+        self.ids[rows[new]] = unique[new]
+        self.generator[rows[new]] = EMPTY
+        self.size += added
+        if self.size > MAX_LOAD * self.index.size:
+            self._reindex(self._slots_for(self.size))
+        else:
+            self._place(rows[new])
+        for name, values in (('max_consumption', max_consumption), ('deferrable', deferrable),
+                             ('responsive', responsive)):
+            values = np.broadcast_to(np.asarray(values, dtype=CONSUMER_SCHEMA[name]), n)
+            getattr(self, name)[rows] = values[first]
+        by_input = np.empty(n, dtype=np.int32)
+        by_input[order] = np.arange(order.size) # unique position -> position in rows
+        return rows[by_input[inverse.reshape(-1)]]
+
+    def remove(self, id) -> int:
+        """drop id, moving the last row into its place.
+
+        returns:
+            int # the row that was vacated (and now holds the moved id)
+        """
+        id = int(id) & ID_MASK
+        slot = self._slot(id & 0xFFFFFFFFFFFFFFFF, id >> 64)
+        row = int(self.index[slot])
+        if row == EMPTY:
+            raise KeyError(str(id))
+        self._unindex(slot)
+        last = self.size - 1
+        if row != last:
+            moved = self.ids[last]
+            self.index[self._slot(int(moved['lo']), int(moved['hi']))] = row
+            self.ids[row] = moved
+            for name in CONSUMER_COLUMNS:
+                column = getattr(self, name)
+                column[row] = column[last]
+        self.size -= 1
+        return row
+
+    def _unindex(self, slot: int):
+        """free slot, shifting later entries of its probe run back so none is cut off"""
+        index, mask, lo = self.index, self.mask, self.ids['lo']
+        j = slot
+        while True:
+            j = (j + 1) & mask
+            row = int(index[j])
+            if row == EMPTY:
+                break
+            home = int(lo[row]) & mask
+            if (j - home) & mask >= (j - slot) & mask: # may sit at slot without being cut off
+                index[slot] = row
+                slot = j
+        index[slot] = EMPTY
+
+    def assign(self, rows, generator_row: int):
+        """hand consumers to the generator at generator_row, EMPTY to starve them"""
+        self.generator[rows] = generator_row
+
+    def move_generator(self, old_row: int, new_row: int):
+        """follow a GeneratorStateTable.remove(): consumers of old_row now
+        belong to new_row, EMPTY if their generator left"""
+        generator = self.generator[:self.size]
+        generator[generator == old_row] = new_row
+
+    def starving(self) -> np.ndarray:
+        """returns the rows of consumers without a generator"""
+        return np.flatnonzero(self.generator[:self.size] == EMPTY)
+
+    def load_by_generator(self, num_generators: int):
+        """per generator row: the MaxConsumption and DemandResponsiveConsumption
+        (MW) of the consumers in its tree.
+
+        returns:
+            (np.ndarray, np.ndarray) # float64 arrays of length num_generators
+        """
+        n = self.size
+        generator = self.generator[:n]
+        assigned = generator != EMPTY
+        max_consumption = self.max_consumption[:n][assigned].astype(np.float64)
+        responsive = max_consumption * self.deferrable[:n][assigned] * self.responsive[:n][assigned]
+        return (np.bincount(generator[assigned], weights=max_consumption, minlength=num_generators),
+                np.bincount(generator[assigned], weights=responsive, minlength=num_generators))
+
+    def to_frame(self):
+        """returns a copy of the live rows as a DataFrame indexed by id"""
+        import pandas as pd
+        ids = self.ids[:self.size]
+        return pd.DataFrame(
+            {name: getattr(self, name)[:self.size].copy() for name in CONSUMER_COLUMNS},
+            index=pd.Index([UnpackId(record) for record in ids], name='id'))
@@ -0,0 +1,236 @@
+"""
+GeneratorFleet: many simulated generators in one process.
+
+Instead of one generator.py process (and grpc server) per generator, a
+fleet holds generators as rows of an OutputKernel and steps them all on
+one clock. Every generator joins through the bootstrap server as usual, but
+with the fleet's grpc server as its callback_addr, so one server receives
+all of their TrackerHellos. Each tick the fleet reports with a single
+BatchUpdateGeneratorState call per tracker over the shared ChannelPool.
+
+    python fleet.py <listen addr> <bootstrap addr> <host_config.csv> [processes]
+
+host_config.csv is a generators/config/host_config_<n>.csv from the
+simulation notebook (type, counts, capacity_mw). With several processes the
+generators are dealt round robin and process p listens on port + p.
+"""
+from concurrent import futures
+import multiprocessing
+import threading
+import datetime
+import time
+import sys
+
+import numpy as np
+import grpc
+
+import scowl_pb2
+import scowl_pb2_grpc
+from channels import GetStub, SERVER_OPTIONS
+from history import HistoryWriter
+from mutation import OutputKernel, LoadCoefficientTable, OUTPUT_CONFIG_PATH
+
+REFRESH_RATE = 2      # seconds, as in generator.py
+JOIN_CONCURRENCY = 8  # GeneratorJoin calls in flight
+BATCH_CONCURRENCY = 8 # trackers updated in parallel per tick
+
+LOG_PATH = 'sim/2030/logs/fleet_{}.log'
+
+
+class FleetGenerator:
+    """what generator.py learns from bootstrapping, its state is row `row`
+    of the fleet's OutputKernel"""
+    __slots__ = ('addr', 'kind', 'capacity', 'row', 'id', 'tracker_id', 'tracker_addr')
+
+    def __init__(self, addr: str, kind: str, capacity: float, row: int):
+        self.addr = addr # only used as the hash input for the generator's id
+        self.kind = kind
+        self.capacity = capacity
+        self.row = row
+        self.id = None
+        self.tracker_id = None
+        self.tracker_addr = None
+
+
+class FleetServicer(scowl_pb2_grpc.GeneratorServicer):
+    """Receives the TrackerHellos of every generator in a fleet"""
+    def __init__(self, fleet):
+        self.fleet = fleet
+
+    def ReceiveHello(self, request, context):
+        self.fleet.ReceiveHello(request)
+        return scowl_pb2.Empty()
+
+    def ShutDown(self, request, context):
+        self.fleet.stop_event.set()
+        return scowl_pb2.Empty()
+
+
+class GeneratorFleet:
+    """Simulates many generators behind one grpc server."""
+    def __init__(self, listen_addr: str, bootstrap_addr: str, refresh_rate: float = REFRESH_RATE,
+                 rtt: int = 0, seed=None, coefficients=None):
+        self.listen_addr = listen_addr
+        self.bootstrap_addr = bootstrap_addr
+        self.refresh_rate = refresh_rate
+        self.rtt = rtt # ms, simulated latency of each batch
+        self.coefficients = (coefficients if coefficients is not None
+                             else LoadCoefficientTable(OUTPUT_CONFIG_PATH))
+        self.kernel = OutputKernel(self.coefficients)
+        self.seeds = np.random.SeedSequence(seed)
+        self.generators = []
+        self.by_id = {}   # gen id -> FleetGenerator
+        self._hellos = {} # gen id -> TrackerHello that arrived before GeneratorJoin returned
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.ticks = 0
+        self.failed_batches = 0
+        self.server = None
+        self.log = HistoryWriter(LOG_PATH.format(listen_addr), mode='w')
+        self._batches = futures.ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY)
+
+    def __len__(self):
+        return len(self.generators)
+
+    def add(self, kind: str, capacity: float, count: int = 1):
+        """add count generators of one kind, each with its own seeded rng"""
+        for seed in self.seeds.spawn(count):
+            addr = '{}/{}'.format(self.listen_addr, len(self.generators))
+            row = self.kernel.add(kind, capacity, seed)
+            self.generators.append(FleetGenerator(addr, kind, capacity, row))
+
+    def start(self):
+        """start the grpc server that receives TrackerHellos"""
+        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=10), options=SERVER_OPTIONS)
+        scowl_pb2_grpc.add_GeneratorServicer_to_server(FleetServicer(self), self.server)
+        self.server.add_insecure_port(self.listen_addr)
+        self.server.start()
+        self.log.write("------------- Fleet Started -------------\n"
+                       "Started:    {}\n"
+                       "Addr:       {}\n"
+                       "Generators: {}\n".format(
+                           datetime.datetime.now().isoformat(), self.listen_addr, len(self)))
+
+    def ReceiveHello(self, request):
+        with self.lock:
+            gen = self.by_id.get(request.gen_id)
+            if gen is None:
+                self._hellos[request.gen_id] = request
+                return
+            gen.tracker_id = request.tracker_id
+            gen.tracker_addr = request.tracker_addr
+
+    def join(self, gen: FleetGenerator):
+        """bootstrap one generator, as generator.run() does"""
+        stub = GetStub(self.bootstrap_addr, scowl_pb2_grpc.BootstrapStub)
+        gen_id = stub.GeneratorJoin(scowl_pb2.GeneratorCtx(
+            addr=gen.addr, kind=gen.kind, capacity=gen.capacity, callback_addr=self.listen_addr))
+        with self.lock:
+            gen.id = gen_id.id
+            self.by_id[gen.id] = gen
+            hello = self._hellos.pop(gen.id, None)
+        if hello is not None:
+            self.ReceiveHello(hello)
+
+    def join_all(self, concurrency: int = JOIN_CONCURRENCY) -> float:
+        """bootstrap every generator that has not joined yet.
+
+        returns:
+            float # seconds taken
+        """
+        start = time.monotonic()
+        with futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(self.join, [g for g in self.generators if g.id is None]))
+        elapsed = time.monotonic() - start
+        self.log.write("------------ Fleet Bootstrapped ------------\n"
+                       "Generators: {}\n"
+                       "Seconds:    {:.3f}\n".format(len(self.by_id), elapsed))
+        return elapsed
+
+    def _send(self, tracker_addr: str, gens: list):
+        time.sleep(self.rtt/1000) # simulated latency
+        kernel = self.kernel
+        rows = [g.row for g in gens]
+        stub = GetStub(tracker_addr, scowl_pb2_grpc.TrackerStub)
+        reply = stub.BatchUpdateGeneratorState(scowl_pb2.StateUpdateBatch(updates=[
+            scowl_pb2.StateUpdate(id=g.id, ts=ts, output=output, demand=demand)
+            for g, ts, output, demand in zip(gens, kernel.state_ts[rows].tolist(),
+                                             kernel.output[rows].tolist(),
+                                             kernel.demand[rows].tolist())]))
+        kernel.demand[rows] = [d.demand for d in reply.demands]
+
+    def step(self):
+        """advance every bootstrapped generator and report it to its tracker"""
+        by_tracker = {}
+        for gen in self.generators:
+            if gen.tracker_addr is not None:
+                by_tracker.setdefault(gen.tracker_addr, []).append(gen)
+        rows = [g.row for gens in by_tracker.values() for g in gens]
+        self.kernel.step(rows)
+        calls = {self._batches.submit(self._send, addr, gens): addr
+                 for addr, gens in by_tracker.items()}
+        for call in futures.as_completed(calls):
+            try:
+                call.result()
+            except grpc.RpcError as e:
+                self.failed_batches += 1
+                self.log.write('Tick {}: batch to {} failed: {}\n'.format(
+                    self.ticks, calls[call], e.code()))
+        self.ticks += 1
+        self.log.write('Tick {}: {} generators, {} trackers, {:.2f} MW output, {:.2f} MW demand\n'.format(
+            self.ticks, len(rows), len(by_tracker),
+            self.kernel.output[rows].sum(), self.kernel.demand[rows].sum()))
+
+    def run(self, ticks: int = None):
+        """step every refresh_rate seconds until stopped (or for `ticks` ticks)"""
+        deadline = time.monotonic()
+        while not self.stop_event.is_set() and (ticks is None or ticks > 0):
+            self.step()
+            if ticks is not None:
+                ticks -= 1
+            deadline += self.refresh_rate
+            self.stop_event.wait(max(deadline - time.monotonic(), 0))
+
+    def close(self):
+        if self.server is not None:
+            self.server.stop(None)
+        self._batches.shutdown()
+        self.log.write("------------- Fleet Stopped -------------\n"
+                       "Stopped:    {}\n"
+                       "Ticks:      {}\n".format(datetime.datetime.now().isoformat(), self.ticks))
+        self.log.close()
+
+
+def RunFleet(listen_addr: str, bootstrap_addr: str, generators: list, seed=None):
+    """generators: (kind, capacity_mw) of every generator in this fleet"""
+    fleet = GeneratorFleet(listen_addr, bootstrap_addr, seed=seed)
+    for kind, capacity in generators:
+        fleet.add(kind, capacity)
+    fleet.start()
+    print("------------- Fleet Started -------------")
+    print('Addr:       ', listen_addr)
+    print('Generators: ', len(fleet))
+    elapsed = fleet.join_all()
+    print("----------- Fleet Bootstrapped -----------")
+    print('Seconds:    ', round(elapsed, 3))
+    try:
+        fleet.run()
+    finally:
+        fleet.close()
+
+if __name__ == '__main__':
+    import pandas as pd
+    listen_addr, bootstrap_addr, config_path = sys.argv[1:4]
+    processes = int(sys.argv[4]) if len(sys.argv) > 4 else 1
+
+    config = pd.read_csv(config_path).set_index('type')
+    generators = [(kind, config.at[kind, 'capacity_mw'])
+                  for kind in config.index for _ in range(int(config.at[kind, 'counts']))]
+    host, port = listen_addr.rsplit(':', 1)
+    workers = [multiprocessing.Process(target=RunFleet, args=(
+                   '{}:{}'.format(host, int(port) + p), bootstrap_addr, generators[p::processes]))
+               for p in range(processes)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
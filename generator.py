@@ -1,8 +1,6 @@
 from concurrent import futures
-from collections import deque
 import threading
 import datetime
-import logging
 import grpc
 import time
 import sys
@@ -10,10 +8,13 @@ import os
 
 import scowl_pb2
 import scowl_pb2_grpc
-import bootstrap_client as client
+from channels import GetStub, HoldChannel, SERVER_OPTIONS
+from metrics import REGISTRY, MetricsInterceptor, ServeMetrics
 
-import pandas as pd
-import numpy as np
+# numpy (via mutation) is imported by startMutationEngine() on the first
+# tick, so the server and GeneratorJoin do not wait for it. Nothing here
+# needs pandas: the output config is read from its compiled cache.
+OUTPUT_CONFIG_PATH = 'sim/2030/generators/config/output_config.csv'
 
 SRC_ADDR  = sys.argv[1] # includes port, of format '111.111.1.1:32000'
 DEST_ADDR = sys.argv[2] # includes port, of format '111.111.1.1:32000'
@@ -21,16 +22,18 @@ RTT       = int(sys.argv[3])   # in ms
 CAPACITY  = float(sys.argv[4]) # in MW
 KIND      = sys.argv[5] # nuclear, petroleum-fired, hydroelectric, natural, gas-fired, land-based wind, offshore wind, utility-scale solar, distributed solar
 ID        = None # 32-bit int, use the ip until the id is received
+id_lock   = threading.Lock() # ID and the log file name change together, see AdoptId
 
-OUTPUT_COEFFICIENTS = None # populated by startMutationEngine(). Rows = months
+OUTPUT_COEFFICIENTS = None # populated by startMutationEngine(). Rows = months, columns = mu, sigma
+model = None # GeneratorModel, populated by startMutationEngine()
 OUTPUT_PERIOD_LENGTH = 3 # this could/should be user input
 
 REFRESH_RATE = 2 # seconds
-WINDOW_SIZE = 5
-window = deque([] * WINDOW_SIZE)
+# 'unary':  one UpdateGeneratorState call per tick
+# 'stream': one StreamGeneratorState call per tracker, demand is pushed back
+UPDATE_RPC = 'unary'
 output = CAPACITY
 state_ts = 0 # lamport ts...
-rng = None   # psuedo-rng needs to be global for high entropy
 demand = CAPACITY * 0.75 # 75% of nominal capacity
 
 # Received from a TrackerHello
@@ -41,26 +44,43 @@ tracker_addr = None
 # generator_server = None
 
 LOG_PATH = 'sim/2030/logs/gen_{}.log'
+# metrics, see metrics.py. Written to METRICS_PATH on shutdown, and served on
+# METRICS_PORT if set (off: a run starts thousands of generators)
+METRICS_PORT = None
+METRICS_PATH = 'sim/2030/logs/gen_{}.metrics'
+UPDATE_TIME = REGISTRY.histogram('update_seconds') # UpdateGeneratorState round trip, RTT included
+LOG_WRITE_TIME = REGISTRY.histogram('log_write_seconds')
+
+def AdoptId(id: str):
+    """set ID and move the log from gen_<SRC_ADDR>.log to gen_<ID>.log.
+
+    Called by both the TrackerHello and the GeneratorJoin reply, whichever
+    arrives first does the rename. Later hellos come from a new tracker after
+    a migration; the log is already renamed.
+    """
+    global ID
+    with id_lock:
+        if ID == id:
+            return
+        if os.path.exists(LOG_PATH.format(SRC_ADDR)):
+            os.rename(LOG_PATH.format(SRC_ADDR), LOG_PATH.format(id))
+        ID = id
 
 class GeneratorServicer(scowl_pb2_grpc.GeneratorServicer):
-    def __init__(self, stop_event):
+    def __init__(self, stop_event, tracker_assigned):
         self._stop_event = stop_event
+        self._tracker_assigned = tracker_assigned
 
     def ReceiveHello(self, request, context):
         """RPC for receiving TrackerHellos from the designated tracker
         """
-        global ID
+        global tracker_id
         global tracker_addr
-        ID = request.gen_id
+        AdoptId(request.gen_id)
         tracker_id = request.tracker_id
         tracker_addr = request.tracker_addr
+        self._tracker_assigned.set() # starts mutate()
 
-        # rename the log file now that we know the ID
-        # time.sleep(1)
-        os.rename(LOG_PATH.format(SRC_ADDR), LOG_PATH.format(ID))
-        # global LOG_PATH
-        # LOG_PATH = LOG_PATH.format(ID)  
-        
         check_metadata=False 
         if check_metadata:
             print("-------------- Hello Received --------------")
@@ -86,106 +106,95 @@ class GeneratorServicer(scowl_pb2_grpc.GeneratorServicer):
 
 def startMutationEngine():
     """call this to set up the mutation state variables"""
-    global OUTPUT_COEFFICIENTS
-    outputs_matrix = pd.read_csv('sim/2030/generators/config/output_config.csv')
-    outputs_matrix.set_index(outputs_matrix.columns[0], inplace=True)
-    outputs_matrix.index.names = ['month']
-    index = outputs_matrix.index
-
-    _data = {}
-    for col in outputs_matrix.columns:
-        tuples = []
-        for row in outputs_matrix[col]:
-            params = str(row)
-            params = params[1:-1].split(',')
-            if len(params) != 2:
-                params = (np.NaN, np.NaN)
-            else:
-                params = (float(params[0]), float(params[1]))
-            tuples.append(params)
-        _data[col] = tuples
-
-    outputs_matrix = pd.DataFrame(_data, index = index)
-
-    OUTPUT_COEFFICIENTS = outputs_matrix[KIND]
+    global OUTPUT_COEFFICIENTS, model
+    from mutation import GeneratorModel, LoadCoefficientTable
+    OUTPUT_COEFFICIENTS = LoadCoefficientTable(OUTPUT_CONFIG_PATH)[KIND]
+    # unseeded, as before: GenOutputCoefficient's seed=ID default was bound while ID was None
+    model = GeneratorModel(CAPACITY, KIND, OUTPUT_COEFFICIENTS, seed=None)
     return OUTPUT_COEFFICIENTS
 
-# seed was 36921
-def GenOutputCoefficient(mu, sigma, size:int=1,seed=ID):
-    """takes parameters from a normal dist.
-    returns a list of coefficients.
-    """
-    global rng
-    output = []
-    if (np.isnan(mu)):
-        output = [0.9] * size
-    else:
-        if rng is None:
-            rng = np.random.default_rng(seed)
-        output = rng.normal(mu, sigma, size)
-        output = [v if v > 0 else 0.0 for v in output] # remove all negative values
-    if size == 1:
-        return output[0]
-    else:
-        return output
-
 def mutateState():
     """when called, it computes to the next state in its sequence"""
-    global OUTPUT_COEFFICIENTS, CAPACITY
-    global state_ts, output, window
+    global state_ts, output
 
-    if  OUTPUT_COEFFICIENTS is None:
+    if model is None:
         startMutationEngine()
 
-    # resolves to string
-    month = OUTPUT_COEFFICIENTS.index[state_ts % len(OUTPUT_COEFFICIENTS.index)] 
-    params = OUTPUT_COEFFICIENTS.loc[month]
+    output = model.step()
 
-    mu = params[0]
-    sigma = params[1]
-    coef = GenOutputCoefficient(mu, sigma)
-    window.append(coef)
-    coef = np.array(window).mean()
-    output = CAPACITY * coef
-
-    with open(LOG_PATH.format(ID), 'a') as writer:
+    with LOG_WRITE_TIME.time(), open(LOG_PATH.format(ID), 'a') as writer:
             writer.write("--------------- New  State ---------------\n")
             writer.write('Timestamp:    {}\n'.format(state_ts))
-            writer.write('Coefficient:  {}\n'.format(coef))
+            writer.write('Coefficient:  {}\n'.format(model.coefficient))
             writer.write('Output:       {}\n'.format(output))
 
     state_ts += 1
 
-def mutate(stop_event: threading.Event, log_created: threading.Event, interval=1):
-    global tracker_addr, state_ts, output, demand
-    global ID
+def mutate(stop_event: threading.Event, tracker_assigned: threading.Event, interval=1):
+    global demand
 
-    log_created.wait()
+    tracker_assigned.wait()
     while True:
         if stop_event.is_set():
             break
         mutateState()
-        with grpc.insecure_channel(tracker_addr) as channel:
-            stub = scowl_pb2_grpc.TrackerStub(channel)
-            # print('CURRENT DEMAND:',demand, type(demand))
-            time.sleep(RTT/1000) # uncomment to add simluated latency
+        # the channel stays open between ticks, tracker_addr changes on migration
+        stub = GetStub(tracker_addr, scowl_pb2_grpc.TrackerStub)
+        # print('CURRENT DEMAND:',demand, type(demand))
+        with UPDATE_TIME.time():
+            time.sleep(RTT/1000) # simulated latency, RTT ms to the tracker
             new_demand = stub.UpdateGeneratorState(
                 scowl_pb2.StateUpdate(
                     id=str(ID),
                     ts=state_ts,
                     output=output,
                     demand=demand))
-            demand = new_demand.demand
+        demand = new_demand.demand
         # print('NEW DEMAND:',demand, type(demand))
-        time.sleep(interval)
+        stop_event.wait(interval)
 
-def run():
+def StateUpdates(stop_event: threading.Event, addr: str, interval=1):
+    """yields a StateUpdate every tick for as long as addr is our tracker"""
+    while not stop_event.is_set() and tracker_addr == addr:
+        mutateState()
+        time.sleep(RTT/1000) # simulated latency, no longer waits on a reply
+        yield scowl_pb2.StateUpdate(
+            id=str(ID),
+            ts=state_ts,
+            output=output,
+            demand=demand)
+        stop_event.wait(interval)
+
+def mutateStream(stop_event: threading.Event, tracker_assigned: threading.Event, interval=1):
+    """mutate() over a StreamGeneratorState call, reopened after a migration.
+    Falls back to mutate() if the tracker takes no more streams"""
+    global demand
+
+    tracker_assigned.wait()
+    while not stop_event.is_set():
+        addr = tracker_addr
+        stub = GetStub(addr, scowl_pb2_grpc.TrackerStub)
+        try:
+            with HoldChannel(addr): # the pool's idle sweep would close it under the stream
+                for new_demand in stub.StreamGeneratorState(StateUpdates(stop_event, addr, interval)):
+                    demand = new_demand.demand
+        except grpc.RpcError as e:
+            if e.code() != grpc.StatusCode.RESOURCE_EXHAUSTED:
+                raise
+            print('{}, updating by unary calls'.format(e.details()))
+            mutate(stop_event, tracker_assigned, interval)
+            return
+
+def run(server_ready: threading.Event):
+    """join once our server can take the TrackerHello. The tracker is told
+    about us after GeneratorJoin returns, so the hello usually comes later"""
     gen_id = None
-    with grpc.insecure_channel(DEST_ADDR) as channel:
-        stub = scowl_pb2_grpc.BootstrapStub(channel)
-        gen_id = stub.GeneratorJoin(scowl_pb2.GeneratorCtx(
-            addr=SRC_ADDR, kind=KIND, capacity=CAPACITY))
-    with open(LOG_PATH.format(ID), "w") as f:
+    server_ready.wait()
+    stub = GetStub(DEST_ADDR, scowl_pb2_grpc.BootstrapStub)
+    gen_id = stub.GeneratorJoin(scowl_pb2.GeneratorCtx(
+        addr=SRC_ADDR, kind=KIND, capacity=CAPACITY))
+    AdoptId(gen_id.id)
+    with open(LOG_PATH.format(ID), "a") as f:
         f.write("-------------- ID  Received --------------\n")
         f.write('Gen ID: {}\n'.format(gen_id.id))
     print("---------- Generator Bootstrapped ----------")
@@ -196,12 +205,13 @@ def run():
     # print("Dest. Addr:    {}".format(DEST_ADDR))
     # print("Dest. rtt:     {} ms".format(RTT))
 
-def serve(stop_flag: threading.Event, log_created: threading.Event):
+def serve(stop_flag: threading.Event, server_ready: threading.Event, tracker_assigned: threading.Event):
     """Used to receive TrackerHello message from assigned tracker"""
 
-    generator_server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    generator_server = grpc.server(futures.ThreadPoolExecutor(max_workers=10), options=SERVER_OPTIONS,
+                                   interceptors=[MetricsInterceptor()])
     scowl_pb2_grpc.add_GeneratorServicer_to_server(
-        GeneratorServicer(stop_flag), generator_server)
+        GeneratorServicer(stop_flag, tracker_assigned), generator_server)
     generator_server.add_insecure_port(SRC_ADDR) 
     generator_server.start()
     start_time = datetime.datetime.now().isoformat()
@@ -212,9 +222,10 @@ def serve(stop_flag: threading.Event, log_created: threading.Event):
         f.write("------------- Server Started -------------\n")
         f.write('Started: {}\n'.format(start_time))
         f.write('Addr:    {}\n'.format(SRC_ADDR))
-    log_created.set()
+    server_ready.set() # listening, and the log exists
     stop_flag.wait()
     generator_server.stop(None)
+    tracker_assigned.set() # wakes mutate() if no tracker ever said hello
     # generator_server.wait_for_termination()
     
 if __name__ == '__main__':
@@ -225,22 +236,24 @@ if __name__ == '__main__':
     #       then updating the tracker.
     
     stop_flag = threading.Event()
-    log_created = threading.Event()
+    server_ready = threading.Event()
+    tracker_assigned = threading.Event()
+    metrics_server = ServeMetrics(METRICS_PORT) if METRICS_PORT is not None else None
 
-    server = threading.Thread(target=serve, args=(stop_flag, log_created))
+    server = threading.Thread(target=serve, args=(stop_flag, server_ready, tracker_assigned))
     server.start()
 
-    intializer = threading.Thread(target=run)
+    intializer = threading.Thread(target=run, args=(server_ready,))
     intializer.start()
     intializer.join()
 
-    # Accessing the disk too quickly can cause an error:
-    # No such file or directory: \'sim/2030/logs/gen_localhost:33001.log
-    # time.sleep(0.25)
-
-    mutant = threading.Thread(target=mutate, args=(stop_flag,log_created, REFRESH_RATE))
+    mutant = threading.Thread(target=mutateStream if UPDATE_RPC == 'stream' else mutate,
+                              args=(stop_flag, tracker_assigned, REFRESH_RATE))
     mutant.start()
 
     # intializer.join()
     server.join()
+    REGISTRY.dump(METRICS_PATH.format(ID))
+    if metrics_server is not None:
+        metrics_server.shutdown()
     
\ No newline at end of file
@@ -0,0 +1,232 @@
+"""
+Buffered, asynchronous writers for tracker history and logs.
+
+Request handlers hand records to a HistoryWriter, which queues them and
+returns immediately. A background thread keeps the file open, batches the
+queued records and flushes them when a batch fills up or when
+`flush_interval` seconds have passed, so no handler waits on open/close
+or write syscalls.
+
+History can also be written in a columnar binary format (see
+EncodeColumnarChunk) and read back with LoadColumnarHistory, which
+memory-maps the files and skips chunks outside the requested ts range.
+"""
+import threading
+import calendar
+import queue
+import os
+import time
+
+import numpy as np
+
+# fsync policies
+FSYNC_NEVER = 'never' # leave it to the OS
+FSYNC_BATCH = 'batch' # after every flushed batch
+FSYNC_CLOSE = 'close' # once, on close()
+
+_CLOSE = object() # queue sentinel
+
+
+def JoinRecords(records) -> str:
+    """default encoder: records are strings, or callables returning one
+    (so expensive formatting also happens off the request thread)"""
+    return ''.join(r if isinstance(r, str) else r() for r in records)
+
+
+class HistoryWriter:
+    """Appends queued records to `path` from a background thread.
+
+    write() never blocks: when the queue is full the record is dropped and
+    counted. Call close() to flush everything still queued.
+    """
+    def __init__(self, path: str, mode: str = 'a', encode=JoinRecords, binary: bool = False,
+                 max_queue: int = 100000, batch_size: int = 1024, flush_interval: float = 0.5,
+                 fsync: str = FSYNC_NEVER, timer=None):
+        """timer: a metrics.Histogram observing how long each flush takes"""
+        if fsync not in (FSYNC_NEVER, FSYNC_BATCH, FSYNC_CLOSE):
+            raise ValueError('unknown fsync policy: {}'.format(fsync))
+        self.path = path
+        self.encode = encode
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.timer = timer
+
+        # counters
+        self.queued = 0   # records accepted by write()
+        self.dropped = 0  # records rejected because the queue was full
+        self.written = 0  # records flushed to the file
+        self.flushes = 0
+        self._counter_lock = threading.Lock()
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._file = open(path, mode + ('b' if binary else ''))
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, name='HistoryWriter({})'.format(path), daemon=True)
+        self._thread.start()
+
+    @property
+    def pending(self) -> int:
+        """records queued but not yet written"""
+        return self._queue.qsize()
+
+    def write(self, record) -> bool:
+        """queue a record for writing.
+
+        returns:
+            bool # False if the record was dropped
+        """
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            with self._counter_lock:
+                self.dropped += 1
+            return False
+        with self._counter_lock:
+            self.queued += 1
+        return True
+
+    def stats(self) -> dict:
+        return {'queued': self.queued, 'dropped': self.dropped, 'written': self.written,
+                'pending': self.pending, 'flushes': self.flushes}
+
+    def close(self):
+        """flush every queued record and close the file. Safe to call twice."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_CLOSE) # blocks until there is room, nothing is lost
+        self._thread.join()
+
+    def _flush(self, batch):
+        if batch:
+            start = time.perf_counter()
+            self._file.write(self.encode(batch))
+            self._file.flush()
+            if self.fsync == FSYNC_BATCH:
+                os.fsync(self._file.fileno())
+            if self.timer is not None:
+                self.timer.observe(time.perf_counter() - start)
+            with self._counter_lock:
+                self.written += len(batch)
+                self.flushes += 1
+
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                record = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                record = None
+            else:
+                if record is _CLOSE:
+                    break
+                batch.append(record)
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                self._flush(batch)
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+        self._flush(batch)
+        if self.fsync != FSYNC_NEVER:
+            os.fsync(self._file.fileno())
+        self._file.close()
+
+
+# Columnar history: a file is a sequence of chunks, one per flushed batch.
+# Each chunk is a CHUNK_HEADER followed by every HISTORY_SCHEMA column,
+# stored contiguously in order. `time` is the tracker's naive local wall
+# clock counted as if it were UTC (see HistoryTime), so it loads back as the
+# same naive times the csv history holds.
+HISTORY_SCHEMA = [
+    ('id',          '<i8'),
+    ('ts',          '<i8'), # lamport ts
+    ('host',        '<i8'),
+    ('tracker',     '<i8'),
+    ('output',      '<f8'), # MW
+    ('demand',      '<f8'), # MW
+    ('net_cap',     '<f8'), # MW
+    ('percent_use', '<f8'),
+    ('time',        '<i8'), # ns, see HistoryTime
+]
+HISTORY_RECORD = np.dtype(HISTORY_SCHEMA)
+CHUNK_MAGIC = b'SCWL'
+CHUNK_HEADER = np.dtype([
+    ('magic',  'S4'),
+    ('rows',   '<u4'),
+    ('ts_min', '<i8'),
+    ('ts_max', '<i8'),
+])
+
+
+def HistoryTime(t) -> int:
+    """returns the columnar `time` of naive datetime t, its fields as epoch ns.
+    pd.to_datetime(unit='ns') reads it back as t, as the csv's isoformat does"""
+    return calendar.timegm(t.timetuple()) * 10**9 + t.microsecond * 1000
+
+
+def EncodeColumnarChunk(records) -> bytes:
+    """encoder for HistoryWriter(binary=True): records are tuples in
+    HISTORY_SCHEMA order, the batch becomes one chunk"""
+    rows = np.array(records, dtype=HISTORY_RECORD)
+    header = np.array([(CHUNK_MAGIC, len(rows), rows['ts'].min(), rows['ts'].max())],
+                      dtype=CHUNK_HEADER)
+    return header.tobytes() + b''.join(
+        np.ascontiguousarray(rows[name]).tobytes() for name, _ in HISTORY_SCHEMA)
+
+
+def ScanColumnarHistory(path: str, ts_min: int = None, ts_max: int = None):
+    """Lazily yields {column: array} for each chunk of `path` that may hold
+    rows with ts_min <= ts <= ts_max. Arrays are views of a memory map, so
+    only the columns you touch are read from disk."""
+    if os.path.getsize(path) == 0:
+        return
+    data = np.memmap(path, dtype=np.uint8, mode='r')
+    offset = 0
+    while offset + CHUNK_HEADER.itemsize <= len(data):
+        header = np.frombuffer(data, dtype=CHUNK_HEADER, count=1, offset=offset)[0]
+        if header['magic'] != CHUNK_MAGIC:
+            raise ValueError('{}: corrupt chunk at byte {}'.format(path, offset))
+        rows = int(header['rows'])
+        offset += CHUNK_HEADER.itemsize
+        if offset + rows * HISTORY_RECORD.itemsize > len(data):
+            break # a chunk still being written
+        overlaps = ((ts_min is None or header['ts_max'] >= ts_min) and
+                    (ts_max is None or header['ts_min'] <= ts_max))
+        if overlaps:
+            chunk = {}
+            column_offset = offset
+            for name, dtype in HISTORY_SCHEMA:
+                chunk[name] = np.frombuffer(data, dtype=dtype, count=rows, offset=column_offset)
+                column_offset += rows * np.dtype(dtype).itemsize
+            yield chunk
+        offset += rows * HISTORY_RECORD.itemsize
+
+
+def LoadColumnarHistory(paths, ts_min: int = None, ts_max: int = None):
+    """Load columnar history from a directory or list of files into one
+    DataFrame, keeping only rows with ts_min <= ts <= ts_max.
+
+    returns:
+        pd.DataFrame # columns as in a tracker's csv history
+    """
+    import pandas as pd
+    if isinstance(paths, str):
+        paths = sorted(os.path.join(paths, f) for f in os.listdir(paths) if f.endswith('.bin'))
+    columns = {name: [] for name, _ in HISTORY_SCHEMA}
+    for path in paths:
+        for chunk in ScanColumnarHistory(path, ts_min, ts_max):
+            ts = chunk['ts']
+            keep = np.ones(len(ts), dtype=bool)
+            if ts_min is not None:
+                keep &= ts >= ts_min
+            if ts_max is not None:
+                keep &= ts <= ts_max
+            for name in columns:
+                columns[name].append(chunk[name][keep])
+    frame = pd.DataFrame({
+        name: np.concatenate(parts) if parts else np.empty(0, dtype=dtype)
+        for (name, dtype), parts in zip(HISTORY_SCHEMA, columns.values())})
+    frame['time'] = pd.to_datetime(frame['time'], unit='ns')
+    return frame
@@ -0,0 +1,344 @@
+"""
+Starts and stops a local scowl cluster: the bootstrap server, the trackers
+and one generator.py process per generator.
+
+Bootstrap and trackers start together and are admitted once their grpc
+ports accept connections. Generators are then started at most
+ADMISSION_RATE per second, with at most MAX_PENDING of them still
+bootstrapping at any time, instead of one every 0.2 s. A generator counts
+as bootstrapped once it prints its Generator ID. Every PID is written to
+PID_PATH so that `stop` can shut the cluster down later: generators via
+their ShutDown RPC, trackers and bootstrap with SIGTERM. `stop` asks the
+launcher to do this itself, since only it can reap its children.
+
+    python launcher.py start <num trackers> <host_config.csv> [admission rate]
+    python launcher.py stop
+"""
+import subprocess
+import threading
+import selectors
+import datetime
+import signal
+import json
+import time
+import sys
+import os
+
+import grpc
+
+import scowl_pb2
+import scowl_pb2_grpc
+from channels import POOL, GetStub
+
+BOOTSTRAP_ADDR = 'localhost:50051'
+TRACKER_PORT = 32000    # tracker i listens on TRACKER_PORT + i
+GENERATOR_PORT = 33000  # generator i listens on GENERATOR_PORT + i
+ADMISSION_RATE = 50     # generators started per second
+MAX_PENDING = 32        # generators started but not yet bootstrapped
+READY_TIMEOUT = 30      # seconds for a server to accept connections
+SHUTDOWN_TIMEOUT = 10   # seconds for a process to exit before it is killed
+
+BOOTSTRAPPED = b'---------- Generator Bootstrapped ----------'
+LOG_PATH = 'sim/2030/logs/launcher.log'
+OUTPUT_PATH = 'sim/2030/logs/{}.out' # stdout/stderr of each role
+PID_PATH = 'sim/2030/launcher_pids.json'
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__)) # bootstrap_server.py etc.
+
+
+def GeneratorInstances(config, starting_port: int = GENERATOR_PORT, hosts: str = 'localhost',
+                       latency_best_case: int = 10, latency_worst_case: int = 100, seed=None):
+    """the notebook's MakeGenInstances without pandas.
+
+    config: {kind: (count, capacity_mw)}, e.g. from a host_config csv
+
+    returns:
+        list # of dicts with kind, capacity_mw, addr and rtt (ms)
+    """
+    import random
+    rng = random.Random(seed)
+    instances = []
+    for kind, (count, capacity) in config.items():
+        for _ in range(int(count)):
+            instances.append({
+                'kind': kind,
+                'capacity_mw': float(capacity),
+                'addr': '{}:{}'.format(hosts, starting_port + len(instances)),
+                'rtt': rng.randint(latency_best_case, latency_worst_case)})
+    return instances
+
+def ReadHostConfig(path: str) -> dict:
+    """returns {kind: (count, capacity_mw)} from a host_config csv"""
+    import csv
+    with open(path, newline='') as f:
+        return {row['type']: (int(float(row['counts'])), float(row['capacity_mw']))
+                for row in csv.DictReader(f)}
+
+def WaitForServer(addr: str, timeout: float = READY_TIMEOUT) -> float:
+    """readiness probe: block until addr accepts grpc connections.
+
+    returns:
+        float # seconds waited
+    """
+    start = time.monotonic()
+    grpc.channel_ready_future(POOL.channel(addr)).result(timeout=timeout)
+    return time.monotonic() - start
+
+
+class Launched:
+    """a process started by the Launcher"""
+    __slots__ = ('role', 'addr', 'popen', 'started', 'ready', 'exited', '_buffer')
+
+    def __init__(self, role: str, addr: str, popen: subprocess.Popen):
+        self.role = role
+        self.addr = addr
+        self.popen = popen
+        self.started = time.monotonic()
+        self.ready = None  # monotonic time it became ready
+        self.exited = None # monotonic time its output closed
+        self._buffer = b''
+
+    @property
+    def pid(self) -> int:
+        return self.popen.pid
+
+
+class Launcher:
+    """Brings a cluster up concurrently and tears it down cleanly."""
+    def __init__(self, num_trackers: int, generators: list, bootstrap_addr: str = BOOTSTRAP_ADDR,
+                 rate: float = ADMISSION_RATE, max_pending: int = MAX_PENDING,
+                 python: str = sys.executable, host_id: int = 0):
+        self.num_trackers = num_trackers
+        self.generators = generators # as returned by GeneratorInstances
+        self.bootstrap_addr = bootstrap_addr
+        self.rate = rate
+        self.max_pending = max_pending
+        self.python = python
+        self.host_id = host_id
+        self.processes = []
+        self.failed = [] # generators that exited before bootstrapping
+        self.times = {}  # milestone -> seconds since start()
+        self._start = None
+        self._pending = threading.Semaphore(max_pending)
+        self._all_ready = threading.Event()
+        self._lock = threading.Lock()
+        self._selector = selectors.DefaultSelector()
+        self._watcher = None
+        self._outputs = {}
+        self.log = open(LOG_PATH, 'a')
+
+    def _env(self):
+        return dict(os.environ, PYTHONUNBUFFERED='1') # so readiness lines arrive promptly
+
+    def _output(self, role: str):
+        if role not in self._outputs:
+            self._outputs[role] = open(OUTPUT_PATH.format(role), 'ab')
+        return self._outputs[role]
+
+    def _spawn(self, role: str, addr: str, args: list, watch: bool = False) -> Launched:
+        popen = subprocess.Popen(
+            [self.python, os.path.join(SCRIPT_DIR, args[0])] + args[1:], env=self._env(),
+            stdout=subprocess.PIPE if watch else self._output(role), stderr=subprocess.STDOUT)
+        launched = Launched(role, addr, popen)
+        with self._lock:
+            self.processes.append(launched)
+            if watch:
+                self._selector.register(popen.stdout, selectors.EVENT_READ, launched)
+        self.WritePids()
+        return launched
+
+    def _mark(self, milestone: str):
+        self.times[milestone] = time.monotonic() - self._start
+        self.log.write('{:<24} {:>8.3f} s\n'.format(milestone, self.times[milestone]))
+        self.log.flush()
+
+    def WritePids(self):
+        """record every live process so `launcher.py stop` can find them"""
+        with self._lock:
+            pids = [{'role': p.role, 'addr': p.addr, 'pid': p.pid} for p in self.processes]
+        tmp = PID_PATH + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'launcher': os.getpid(), 'processes': pids}, f)
+        os.replace(tmp, PID_PATH)
+
+    def _watch(self):
+        """one thread reads every generator's stdout and admits the next
+        generator as soon as one prints that it is bootstrapped"""
+        out = self._output('generators')
+        while not self._all_ready.is_set() or self._selector.get_map():
+            if not self._selector.get_map():
+                time.sleep(0.05)
+                continue
+            for key, _ in self._selector.select(timeout=0.1):
+                launched = key.data
+                chunk = os.read(key.fileobj.fileno(), 65536)
+                if chunk:
+                    out.write(chunk)
+                    launched._buffer = (launched._buffer + chunk)[-len(BOOTSTRAPPED) * 2:]
+                    if launched.ready is None and BOOTSTRAPPED in launched._buffer:
+                        launched.ready = time.monotonic()
+                        self._pending.release()
+                        self._check_all_ready()
+                    continue
+                self._selector.unregister(key.fileobj)
+                key.fileobj.close()
+                launched.exited = time.monotonic()
+                if launched.ready is None:
+                    self.failed.append(launched)
+                    self._pending.release()
+                    self._check_all_ready()
+
+    def _check_all_ready(self):
+        done = sum(1 for p in self.processes if p.role == 'generator' and
+                   (p.ready is not None or p.exited is not None))
+        if done == len(self.generators):
+            self._mark('generators bootstrapped')
+            self._all_ready.set()
+
+    def start(self, timeout: float = None) -> dict:
+        """start the whole cluster and wait until every generator has bootstrapped.
+
+        returns:
+            dict # milestone -> seconds since start
+        """
+        self._start = time.monotonic()
+        self.log.write('------------- Cluster Started -------------\n'
+                       'Started:    {}\n'
+                       'Trackers:   {}\n'
+                       'Generators: {}\n'.format(
+                           datetime.datetime.now().isoformat(), self.num_trackers, len(self.generators)))
+        bootstrap = self._spawn('bootstrap', self.bootstrap_addr,
+                                ['bootstrap_server.py', str(self.num_trackers)])
+        trackers = [self._spawn('tracker', 'localhost:{}'.format(TRACKER_PORT + i),
+                                ['tracker.py', str(TRACKER_PORT + i), str(self.host_id), str(self.num_trackers)])
+                    for i in range(self.num_trackers)]
+        for server in [bootstrap] + trackers:
+            WaitForServer(server.addr)
+            server.ready = time.monotonic()
+        self._mark('servers ready')
+
+        self._watcher = threading.Thread(target=self._watch, name='launcher-watch', daemon=True)
+        self._watcher.start()
+        interval = 1 / self.rate
+        next_start = time.monotonic()
+        for gen in self.generators:
+            self._pending.acquire()
+            time.sleep(max(next_start - time.monotonic(), 0))
+            next_start = max(next_start, time.monotonic()) + interval
+            self._spawn('generator', gen['addr'], [
+                'generator.py', gen['addr'], self.bootstrap_addr, str(gen['rtt']),
+                str(gen['capacity_mw']), gen['kind']], watch=True)
+        self._mark('generators started')
+        if not self.generators:
+            self._all_ready.set()
+        self._all_ready.wait(timeout)
+        return self.times
+
+    def shutdown(self, timeout: float = SHUTDOWN_TIMEOUT):
+        """generators first (ShutDown RPC), then trackers and bootstrap (SIGTERM)"""
+        generators = [p for p in self.processes if p.role == 'generator' and p.popen.poll() is None]
+        servers = [p for p in self.processes if p.role != 'generator' and p.popen.poll() is None]
+        for p in generators:
+            ShutDownGenerator(p.addr)
+        WaitOrKill([p.popen for p in generators], timeout)
+        for p in servers:
+            p.popen.send_signal(signal.SIGTERM)
+        WaitOrKill([p.popen for p in servers], timeout)
+        self._all_ready.set()
+        if self._watcher is not None:
+            self._watcher.join() # every generator pipe is closed by now
+        self.log.write('------------- Cluster Stopped -------------\n'
+                       'Stopped:    {}\n'.format(datetime.datetime.now().isoformat()))
+        self.log.close()
+        for f in self._outputs.values():
+            f.close()
+        if os.path.exists(PID_PATH):
+            os.remove(PID_PATH)
+
+    def report(self):
+        ready = sorted(p.ready - self._start for p in self.processes
+                       if p.role == 'generator' and p.ready is not None)
+        print("------------- Cluster Ready -------------")
+        for milestone, seconds in self.times.items():
+            print('{:<26} {:>8.3f} s'.format(milestone, seconds))
+        print('{:<26} {:>8}'.format('generators joined', '{}/{}'.format(len(ready), len(self.generators))))
+        if ready:
+            print('{:<26} {:>8.1f} /s'.format('join throughput', len(ready) / max(ready[-1] - self.times['servers ready'], 1e-9)))
+        if self.failed:
+            print('{:<26} {:>8}'.format('generators failed', len(self.failed)))
+
+
+def ShutDownGenerator(addr: str, timeout: float = 2):
+    try:
+        GetStub(addr, scowl_pb2_grpc.GeneratorStub).ShutDown(scowl_pb2.Empty(), timeout=timeout)
+    except grpc.RpcError:
+        pass # already gone, WaitOrKill takes care of it
+
+def WaitOrKill(popens, timeout: float):
+    deadline = time.monotonic() + timeout
+    for popen in popens:
+        try:
+            popen.wait(max(deadline - time.monotonic(), 0))
+        except subprocess.TimeoutExpired:
+            popen.kill()
+            popen.wait()
+
+def Stop(pid_path: str = PID_PATH, timeout: float = SHUTDOWN_TIMEOUT):
+    """shut down a cluster started by another launcher process"""
+    with open(pid_path) as f:
+        recorded = json.load(f)
+    try:
+        os.kill(recorded['launcher'], signal.SIGTERM) # it shuts its children down itself
+        WaitForExit([recorded['launcher']], 3 * timeout)
+        return
+    except ProcessLookupError:
+        pass # the launcher is gone, its orphans have been reparented and get reaped
+    pids = recorded['processes']
+    generators = [p for p in pids if p['role'] == 'generator']
+    for p in generators:
+        ShutDownGenerator(p['addr'])
+    WaitForExit([p['pid'] for p in generators], timeout)
+    servers = [p['pid'] for p in pids if p['role'] != 'generator']
+    for pid in servers:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    WaitForExit(servers, timeout)
+    if os.path.exists(pid_path):
+        os.remove(pid_path)
+
+def WaitForExit(pids, timeout: float):
+    """wait for processes that are not our children, SIGKILL stragglers"""
+    deadline = time.monotonic() + timeout
+    alive = set(pids)
+    while alive and time.monotonic() < deadline:
+        for pid in list(alive):
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                alive.discard(pid)
+        time.sleep(0.1)
+    for pid in alive:
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+if __name__ == '__main__':
+    if sys.argv[1] == 'stop':
+        Stop()
+        sys.exit()
+    num_trackers = int(sys.argv[2])
+    generators = GeneratorInstances(ReadHostConfig(sys.argv[3]))
+    rate = float(sys.argv[4]) if len(sys.argv) > 4 else ADMISSION_RATE
+    launcher = Launcher(num_trackers, generators, rate=rate)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+    try:
+        launcher.start()
+        launcher.report()
+        signal.pause() # run until interrupted
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        launcher.shutdown()
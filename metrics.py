@@ -0,0 +1,333 @@
+"""
+In-process metrics for the bootstrap server, trackers and generators.
+
+A MetricsRegistry holds named Counters, fixed-bucket Histograms and Gauges
+(callables read when the metrics are rendered), each optionally labelled,
+e.g. REGISTRY.histogram('rpc_seconds', method='UpdateGeneratorState').
+Recording is a lock and an integer add, or a bisect over the bucket bounds.
+
+MetricsInterceptor (AioMetricsInterceptor for grpc.aio servers) counts and
+times every call to every servicer method. ServeMetrics() answers
+GET /metrics with the Prometheus text format and GET /metrics.json with
+snapshot(); dump() writes the text format to a file on shutdown.
+
+    curl localhost:50052/metrics   # the bootstrap server
+"""
+from bisect import bisect_left
+import threading
+import inspect
+import time
+
+import grpc
+
+# upper bounds (seconds) of the latency buckets, the last bucket is +Inf
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+                   0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PERCENTILES = (0.5, 0.95, 0.99) # estimated from the buckets in snapshot()
+
+
+class Counter:
+    """A count that only goes up."""
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, n: int = 1):
+        with self._lock:
+            self.value += n
+
+
+class Gauge:
+    """A value read from fn() whenever the metrics are rendered."""
+    __slots__ = ('fn',)
+
+    def __init__(self, fn):
+        self.fn = fn
+
+    @property
+    def value(self) -> float:
+        return self.fn()
+
+
+class Timer:
+    """context manager observing its duration in a Histogram"""
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Histogram:
+    """Counts of observations per fixed bucket, with their sum."""
+    __slots__ = ('bounds', 'counts', 'count', 'sum', '_lock')
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.bounds = tuple(buckets)
+        self.counts = [0] * (len(self.bounds) + 1) # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        bucket = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[bucket] += 1
+            self.count += 1
+            self.sum += value
+
+    def time(self) -> Timer:
+        """with histogram.time(): ... observes how long the block took"""
+        return Timer(self)
+
+    def percentile(self, q: float) -> float:
+        """returns the q-quantile (0-1), interpolated within its bucket.
+        Observations beyond the last bound count as the last bound."""
+        with self._lock:
+            counts, count = list(self.counts), self.count
+        if not count:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for i, n in enumerate(counts):
+            if n and seen + n >= rank:
+                if i == len(self.bounds):
+                    return self.bounds[-1]
+                lower = self.bounds[i - 1] if i else 0.0
+                return lower + (self.bounds[i] - lower) * (rank - seen) / n
+            seen += n
+        return self.bounds[-1]
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+
+def MetricKey(name: str, labels: dict) -> tuple:
+    return (name, tuple(sorted((label, str(value)) for label, value in labels.items())))
+
+def MetricName(name: str, labels: tuple) -> str:
+    """returns name{label="value",...} as in the Prometheus text format"""
+    if not labels:
+        return name
+    return '{}{{{}}}'.format(name, ','.join('{}="{}"'.format(k, v) for k, v in labels))
+
+
+class MetricsRegistry:
+    """Every metric of a process, by name and labels."""
+    def __init__(self):
+        self.metrics = {} # (name, ((label, value), ...)) -> Counter, Histogram or Gauge
+        self.lock = threading.Lock()
+
+    def _get(self, kind, name: str, labels: dict, *args):
+        key = MetricKey(name, labels)
+        metric = self.metrics.get(key)
+        if metric is None:
+            with self.lock:
+                metric = self.metrics.setdefault(key, kind(*args))
+        if not isinstance(metric, kind):
+            raise TypeError('{} is a {}, not a {}'.format(
+                MetricName(*key), type(metric).__name__, kind.__name__))
+        return metric
+
+    def counter(self, name: str, **labels) -> Counter:
+        """returns the Counter name{labels}, created on first use"""
+        return self._get(Counter, name, labels)
+
+    def histogram(self, name: str, buckets=LATENCY_BUCKETS, **labels) -> Histogram:
+        """returns the Histogram name{labels}, created on first use"""
+        return self._get(Histogram, name, labels, buckets)
+
+    def gauge(self, name: str, fn, **labels) -> Gauge:
+        """report fn() as name{labels}, replacing an earlier gauge of that name"""
+        key = MetricKey(name, labels)
+        with self.lock:
+            self.metrics[key] = Gauge(fn)
+        return self.metrics[key]
+
+    def snapshot(self) -> dict:
+        """returns {name{labels}: value} for counters and gauges and
+        {name{labels}: {count, sum, mean, p50, p95, p99}} for histograms"""
+        with self.lock:
+            metrics = sorted(self.metrics.items())
+        snapshot = {}
+        for key, metric in metrics:
+            if isinstance(metric, Histogram):
+                snapshot[MetricName(*key)] = dict(
+                    count=metric.count, sum=metric.sum, mean=metric.mean,
+                    **{'p{:g}'.format(q * 100): metric.percentile(q) for q in PERCENTILES})
+            else:
+                snapshot[MetricName(*key)] = metric.value
+        return snapshot
+
+    def render(self) -> str:
+        """returns every metric in the Prometheus text format"""
+        with self.lock:
+            metrics = sorted(self.metrics.items())
+        lines = []
+        for (name, labels), metric in metrics:
+            if isinstance(metric, Histogram):
+                with metric._lock:
+                    counts, count, total = list(metric.counts), metric.count, metric.sum
+                cumulative = 0
+                for bound, n in zip(metric.bounds + ('+Inf',), counts):
+                    cumulative += n
+                    lines.append('{} {}'.format(
+                        MetricName(name + '_bucket', labels + (('le', bound),)), cumulative))
+                lines.append('{} {}'.format(MetricName(name + '_sum', labels), total))
+                lines.append('{} {}'.format(MetricName(name + '_count', labels), count))
+            else:
+                lines.append('{} {}'.format(MetricName(name, labels), metric.value))
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path: str):
+        """write render() to path"""
+        with open(path, 'w') as f:
+            f.write(self.render())
+
+
+REGISTRY = MetricsRegistry() # the process-wide registry
+
+
+def ServeMetrics(port: int, registry: MetricsRegistry = REGISTRY, host: str = ''):
+    """serve GET /metrics (text) and /metrics.json from a daemon thread.
+
+    returns:
+        http.server.ThreadingHTTPServer # call shutdown() to stop it
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    import json
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == '/metrics':
+                body, content_type = registry.render(), 'text/plain; version=0.0.4'
+            elif self.path == '/metrics.json':
+                body, content_type = json.dumps(registry.snapshot(), indent=1), 'application/json'
+            else:
+                self.send_error(404)
+                return
+            body = body.encode()
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass # no line on stderr per scrape
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics:{}'.format(port), daemon=True).start()
+    return server
+
+
+def MethodName(handler_call_details) -> str:
+    """'/scowl.Tracker/UpdateGeneratorState' -> 'UpdateGeneratorState'"""
+    return handler_call_details.method.rsplit('/', 1)[-1]
+
+def _RpcMetrics(registry: MetricsRegistry, method: str):
+    return (registry.counter('rpc_total', method=method),
+            registry.counter('rpc_errors_total', method=method),
+            registry.histogram('rpc_seconds', method=method))
+
+def _RebuildHandler(handler, wrap):
+    """returns handler with each of its behaviours replaced by wrap(behaviour, streaming)"""
+    if handler.unary_unary:
+        return grpc.unary_unary_rpc_method_handler(
+            wrap(handler.unary_unary, False), handler.request_deserializer, handler.response_serializer)
+    if handler.unary_stream:
+        return grpc.unary_stream_rpc_method_handler(
+            wrap(handler.unary_stream, True), handler.request_deserializer, handler.response_serializer)
+    if handler.stream_unary:
+        return grpc.stream_unary_rpc_method_handler(
+            wrap(handler.stream_unary, False), handler.request_deserializer, handler.response_serializer)
+    return grpc.stream_stream_rpc_method_handler(
+        wrap(handler.stream_stream, True), handler.request_deserializer, handler.response_serializer)
+
+
+class MetricsInterceptor(grpc.ServerInterceptor):
+    """Counts, fails and times (until the last response) every call of a grpc.server."""
+    def __init__(self, registry: MetricsRegistry = REGISTRY):
+        self.registry = registry
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        if handler is None:
+            return None
+        calls, errors, seconds = _RpcMetrics(self.registry, MethodName(handler_call_details))
+
+        def wrap(behaviour, streaming):
+            if streaming:
+                def timed(request, context):
+                    calls.inc()
+                    start = time.perf_counter()
+                    try:
+                        yield from behaviour(request, context)
+                    except BaseException:
+                        errors.inc()
+                        raise
+                    finally:
+                        seconds.observe(time.perf_counter() - start)
+            else:
+                def timed(request, context):
+                    calls.inc()
+                    start = time.perf_counter()
+                    try:
+                        return behaviour(request, context)
+                    except BaseException:
+                        errors.inc()
+                        raise
+                    finally:
+                        seconds.observe(time.perf_counter() - start)
+            return timed
+        return _RebuildHandler(handler, wrap)
+
+
+class AioMetricsInterceptor(grpc.aio.ServerInterceptor):
+    """MetricsInterceptor for a grpc.aio.server"""
+    def __init__(self, registry: MetricsRegistry = REGISTRY):
+        self.registry = registry
+
+    async def intercept_service(self, continuation, handler_call_details):
+        handler = await continuation(handler_call_details)
+        if handler is None:
+            return None
+        calls, errors, seconds = _RpcMetrics(self.registry, MethodName(handler_call_details))
+
+        def wrap(behaviour, streaming):
+            if inspect.isasyncgenfunction(behaviour): # a streaming handler may await context.write() instead
+                async def timed(request, context):
+                    calls.inc()
+                    start = time.perf_counter()
+                    try:
+                        async for response in behaviour(request, context):
+                            yield response
+                    except BaseException:
+                        errors.inc()
+                        raise
+                    finally:
+                        seconds.observe(time.perf_counter() - start)
+            else:
+                async def timed(request, context):
+                    calls.inc()
+                    start = time.perf_counter()
+                    try:
+                        response = behaviour(request, context)
+                        return await response if inspect.isawaitable(response) else response
+                    except BaseException:
+                        errors.inc()
+                        raise
+                    finally:
+                        seconds.observe(time.perf_counter() - start)
+            return timed
+        return _RebuildHandler(handler, wrap)
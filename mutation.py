@@ -0,0 +1,293 @@
+"""
+Generator output model.
+
+Each tick a generator draws an output coefficient from the normal
+distribution configured for its kind and the current month (see
+output_config.csv), clamps it at 0, and runs at CAPACITY times the mean of
+the coefficients drawn so far. generator.py keeps that state in module
+globals; GeneratorModel keeps it on an object so one process can hold many.
+"""
+import csv
+import os
+
+import numpy as np
+
+OUTPUT_CONFIG_PATH = 'sim/2030/generators/config/output_config.csv'
+COEFFICIENT_CACHE_SUFFIX = '.coef' # compiled CoefficientTable, next to the csv
+DEFAULT_COEFFICIENT = 0.9 # kinds without a distribution, e.g. nuclear
+INITIAL_DEMAND = 0.75     # share of nominal capacity
+
+# CoefficientTable cache: header, then kind and month names ('\n' separated),
+# then params as little endian float64
+CACHE_MAGIC = b'SCCT'
+CACHE_HEADER = np.dtype([
+    ('magic',    'S4'),
+    ('mtime_ns', '<i8'), # of the csv the table was compiled from
+    ('size',     '<i8'),
+    ('kinds',    '<u4'),
+    ('months',   '<u4'),
+    ('names',    '<u4'), # bytes
+])
+
+
+def ParseParams(cell: str):
+    """returns (mu, sigma) from an output_config.csv cell like '(1.0, 0.2)',
+    or (nan, nan) for an empty cell"""
+    params = str(cell)[1:-1].split(',')
+    if len(params) != 2:
+        return (np.nan, np.nan)
+    return (float(params[0]), float(params[1]))
+
+
+class CoefficientTable:
+    """output_config.csv compiled to a (kind x month x {mu, sigma}) array.
+
+    Look a kind up once with kind_index and index params with integers
+    from then on; nothing here needs pandas.
+    """
+    __slots__ = ('kinds', 'months', 'params', 'kind_index')
+
+    def __init__(self, kinds, months, params: np.ndarray):
+        self.kinds = list(kinds)
+        self.months = list(months)
+        self.params = np.asarray(params, dtype=np.float64) # kind x month x 2
+        self.kind_index = {kind: i for i, kind in enumerate(self.kinds)}
+
+    @property
+    def mu(self) -> np.ndarray:
+        return self.params[:, :, 0]
+
+    @property
+    def sigma(self) -> np.ndarray:
+        return self.params[:, :, 1]
+
+    def __getitem__(self, kind: str) -> np.ndarray:
+        """returns the (month x {mu, sigma}) params of kind"""
+        return self.params[self.kind_index[kind]]
+
+    @classmethod
+    def from_csv(cls, path: str = OUTPUT_CONFIG_PATH):
+        """parse output_config.csv: months down the first column, one column
+        per kind, cells are '(mu, sigma)' or empty"""
+        with open(path, newline='') as f:
+            rows = list(csv.reader(f))
+        kinds = rows[0][1:]
+        months = [row[0] for row in rows[1:]]
+        params = [[ParseParams(row[1 + k]) for row in rows[1:]] for k in range(len(kinds))]
+        return cls(kinds, months, np.array(params, dtype=np.float64).reshape(len(kinds), len(months), 2))
+
+    @classmethod
+    def from_frame(cls, frame):
+        """from a DataFrame of (mu, sigma) cells, rows = months, columns = kinds"""
+        return cls(frame.columns, frame.index, np.array(
+            [[params for params in frame[kind]] for kind in frame.columns],
+            dtype=np.float64).reshape(len(frame.columns), len(frame.index), 2))
+
+    def to_frame(self):
+        """returns the table as the notebook's DataFrame of (mu, sigma) cells"""
+        import pandas as pd
+        frame = pd.DataFrame({kind: [tuple(p) for p in self[kind].tolist()] for kind in self.kinds},
+                             index=pd.Index(self.months, name='month'))
+        return frame
+
+    def save(self, path: str, source_mtime_ns: int = 0, source_size: int = 0):
+        """write the table, keyed on the csv it was built from, to a cache file"""
+        names = '\n'.join(self.kinds + self.months).encode()
+        header = np.array([(CACHE_MAGIC, source_mtime_ns, source_size,
+                            len(self.kinds), len(self.months), len(names))], dtype=CACHE_HEADER)
+        # per process: generators starting together each build the cache
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(header.tobytes() + names + self.params.astype('<f8').tobytes())
+            os.replace(tmp, path) # readers never see a partial cache
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    @classmethod
+    def load(cls, path: str):
+        """returns (table, (source mtime ns, source size)) from a cache file"""
+        with open(path, 'rb') as f:
+            data = f.read()
+        header = np.frombuffer(data, dtype=CACHE_HEADER, count=1)[0]
+        if header['magic'] != CACHE_MAGIC:
+            raise ValueError('{}: not a coefficient cache'.format(path))
+        kinds, months = int(header['kinds']), int(header['months'])
+        offset = CACHE_HEADER.itemsize + int(header['names'])
+        names = data[CACHE_HEADER.itemsize:offset].decode().split('\n')
+        params = np.frombuffer(data, dtype='<f8', count=kinds * months * 2, offset=offset)
+        table = cls(names[:kinds], names[kinds:], params.reshape(kinds, months, 2))
+        return table, (int(header['mtime_ns']), int(header['size']))
+
+
+def CachePath(path: str) -> str:
+    return os.path.splitext(path)[0] + COEFFICIENT_CACHE_SUFFIX
+
+def LoadCoefficientTable(path: str = OUTPUT_CONFIG_PATH, cache: bool = True) -> CoefficientTable:
+    """returns the CoefficientTable of output_config.csv at path.
+
+    The compiled table is cached next to the csv and rebuilt whenever the
+    csv's mtime or size no longer match the ones recorded in the cache.
+    """
+    if not cache:
+        return CoefficientTable.from_csv(path)
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    cache_path = CachePath(path)
+    try:
+        table, source = CoefficientTable.load(cache_path)
+        if source == key:
+            return table
+    except (OSError, ValueError, KeyError):
+        pass # missing or unreadable, rebuild it
+    table = CoefficientTable.from_csv(path)
+    try:
+        table.save(cache_path, *key)
+    except OSError:
+        pass # a read-only config dir only costs the parse
+    return table
+
+
+class GeneratorModel:
+    """The output state of one generator, stepped like generator.mutateState."""
+    __slots__ = ('capacity', 'kind', 'params', 'rng', 'state_ts', 'output', 'demand',
+                 'coefficient', '_coef_sum', '_coef_count')
+
+    def __init__(self, capacity: float, kind: str, params, seed=None):
+        """params: the (mu, sigma) of each month for this kind, e.g.
+        LoadCoefficientTable()[kind]"""
+        self.capacity = capacity
+        self.kind = kind
+        self.params = [tuple(p) for p in np.asarray(params, dtype=np.float64).tolist()]
+        self.rng = np.random.default_rng(seed)
+        self.state_ts = 0 # lamport ts
+        self.output = capacity
+        self.demand = capacity * INITIAL_DEMAND
+        self.coefficient = None # mean coefficient after the last step()
+        self._coef_sum = 0.0
+        self._coef_count = 0
+
+    def draw(self) -> float:
+        """returns the next coefficient for the current month"""
+        mu, sigma = self.params[self.state_ts % len(self.params)]
+        if np.isnan(mu):
+            return DEFAULT_COEFFICIENT
+        return max(self.rng.normal(mu, sigma), 0.0)
+
+    def step(self) -> float:
+        """advance to the next state.
+
+        returns:
+            float # the new output (MW)
+        """
+        self._coef_sum += self.draw()
+        self._coef_count += 1
+        self.coefficient = self._coef_sum / self._coef_count
+        self.output = self.capacity * self.coefficient
+        self.state_ts += 1
+        return self.output
+
+
+class OutputKernel:
+    """Steps the output of many generators with a few array operations.
+
+    Row i behaves exactly like a GeneratorModel with the same seed: each
+    row keeps its own rng, from which blocks of standard normals are drawn
+    ahead of time, and mu + sigma * z is what rng.normal(mu, sigma) returns.
+    Months without a distribution use DEFAULT_COEFFICIENT and consume no
+    draw. With `window` set, the mean is taken over the last `window`
+    coefficients from a ring buffer instead of over every coefficient.
+    """
+    def __init__(self, coefficients: CoefficientTable, window: int = None, block: int = 64,
+                 capacity: int = 1024):
+        self.kinds = coefficients.kinds
+        self.kind_index = coefficients.kind_index
+        self.mu = coefficients.mu       # kind x month
+        self.sigma = coefficients.sigma # kind x month
+        self.months = len(coefficients.months)
+        self.window = window
+        self.block = block
+        self.rngs = []
+        self.size = 0
+        self.capacity = 0
+        self._grow(capacity)
+
+    def __len__(self):
+        return self.size
+
+    def _columns(self):
+        columns = [('capacity_mw', np.float64, ()), ('kind', np.intp, ()),
+                   ('state_ts', np.int64, ()), ('output', np.float64, ()),
+                   ('demand', np.float64, ()), ('coefficient', np.float64, ()),
+                   ('coef_sum', np.float64, ()), ('coef_count', np.int64, ()),
+                   ('cursor', np.intp, ()), ('normals', np.float64, (self.block,))]
+        if self.window is not None:
+            columns.append(('ring', np.float64, (self.window,)))
+        return columns
+
+    def _grow(self, capacity: int):
+        for name, dtype, shape in self._columns():
+            column = np.zeros((capacity,) + shape, dtype=dtype)
+            if self.size:
+                column[:self.size] = getattr(self, name)[:self.size]
+            setattr(self, name, column)
+        self.capacity = capacity
+
+    def add(self, kind: str, capacity: float, seed=None) -> int:
+        """returns the row of a new generator"""
+        if self.size == self.capacity:
+            self._grow(self.capacity * 2)
+        row = self.size
+        self.capacity_mw[row] = capacity
+        self.kind[row] = self.kind_index[kind]
+        self.output[row] = capacity
+        self.demand[row] = capacity * INITIAL_DEMAND
+        self.cursor[row] = self.block # nothing drawn yet
+        self.rngs.append(np.random.default_rng(seed))
+        self.size += 1
+        return row
+
+    def _standard_normals(self, rows: np.ndarray) -> np.ndarray:
+        """returns the next standard normal of each row in rows"""
+        cursor = self.cursor[rows]
+        for row in rows[cursor == self.block]:
+            self.normals[row] = self.rngs[row].standard_normal(self.block)
+        cursor[cursor == self.block] = 0
+        self.cursor[rows] = cursor + 1
+        return self.normals[rows, cursor]
+
+    def step(self, rows=None) -> np.ndarray:
+        """advance rows (default: every row) to their next state.
+
+        returns:
+            np.ndarray # the new output (MW) of each row stepped
+        """
+        rows = np.arange(self.size) if rows is None else np.asarray(rows, dtype=np.intp)
+        kind = self.kind[rows]
+        month = self.state_ts[rows] % self.months
+        mu = self.mu[kind, month]
+        sigma = self.sigma[kind, month]
+        draws = ~np.isnan(mu)
+
+        coef = np.full(len(rows), DEFAULT_COEFFICIENT)
+        z = self._standard_normals(rows[draws])
+        coef[draws] = np.maximum(mu[draws] + sigma[draws] * z, 0.0)
+
+        count = self.coef_count[rows]
+        if self.window is None:
+            coef_sum = self.coef_sum[rows] + coef
+            mean = coef_sum / (count + 1)
+        else:
+            slot = count % self.window
+            coef_sum = self.coef_sum[rows] + coef - self.ring[rows, slot]
+            self.ring[rows, slot] = coef
+            mean = coef_sum / np.minimum(count + 1, self.window)
+        self.coef_sum[rows] = coef_sum
+        self.coef_count[rows] = count + 1
+        self.coefficient[rows] = mean
+        output = self.capacity_mw[rows] * mean
+        self.output[rows] = output
+        self.state_ts[rows] += 1
+        return output
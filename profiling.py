@@ -0,0 +1,206 @@
+"""
+Runtime-switchable profiling of a tracker's hot path.
+
+A Profiler has three captures, all off until switched on with configure(),
+a signal (InstallSignals) or the tracker's SetProfiling RPC:
+
+    spans   `with profiler.span('allocate'):` observes the block in the
+            histogram span_seconds{span="allocate"} (see metrics.py)
+    cpu     every `every`th call of a @profiler.sampled function runs under
+            the process's one cProfile, a call overlapping a sample in
+            another thread is not sampled; switching it off writes the stats
+    memory  tracemalloc; switching it off writes a snapshot and the top
+            allocation sites
+
+While off, span() is a dict lookup returning a shared no-op context
+manager and a sampled function costs one extra call, so the hooks can stay
+in production code.
+Captures are written to `path`, formatted with kind ('cpu' or 'memory')
+and time:
+
+    python -m pstats sim/2030/logs/host_0_tracker_0_cpu_<time>.prof
+"""
+import collections
+import functools
+import itertools
+import threading
+import datetime
+import signal
+import io
+import os
+
+from metrics import REGISTRY
+
+PROFILE_EVERY = 100   # calls per cProfiled call when cpu profiling is switched on by signal
+MEMORY_FRAMES = 10    # traceback depth kept by tracemalloc
+TOP_STATS = 40        # functions / allocation sites in the text summaries
+
+
+class NullSpan:
+    """does nothing, for spans and samples that are switched off"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return None
+
+NULL_SPAN = NullSpan()
+# span() while spans are off: name -> NULL_SPAN without a python call
+NULL_SPANS = collections.defaultdict(lambda: NULL_SPAN)
+
+
+class Profiled:
+    """runs the block under `profile`, then releases `busy`"""
+    __slots__ = ('profile', 'busy', 'enabled')
+
+    def __init__(self, profile, busy):
+        self.profile = profile
+        self.busy = busy
+        self.enabled = False
+
+    def __enter__(self):
+        try:
+            self.profile.enable()
+            self.enabled = True
+        except ValueError: # another profiler is active (sys.monitoring, 3.12+), run unprofiled
+            pass
+        return self
+
+    def __exit__(self, *exc):
+        if self.enabled:
+            self.profile.disable()
+        self.busy.release()
+
+
+class Profiler:
+    """Spans, sampled cProfile and tracemalloc for one tracker."""
+    def __init__(self, path: str, registry=REGISTRY, **labels):
+        """path: where captures go, e.g. 'logs/t0_{kind}_{time}'
+        labels: added to every span_seconds histogram"""
+        self.path = path
+        self.registry = registry
+        self.labels = labels
+        self.spans = False
+        self.span = NULL_SPANS.__getitem__ # see configure()
+        self.every = 0       # cProfile one call in `every`, 0 when off
+        self.memory = False  # tracemalloc is tracing
+        self._histograms = {} # span name -> Histogram
+        self._calls = itertools.count()
+        self._profile = None # cProfile.Profile, one per process: 3.12+ refuses a second enabled one
+        self._busy = threading.Lock() # held while a sample runs
+        self._lock = threading.Lock()
+
+    def _span(self, name: str):
+        """span() while spans are on: returns a context manager timing its block as `name`"""
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            histogram = self.registry.histogram('span_seconds', span=name, **self.labels)
+            self._histograms[name] = histogram
+        return histogram.time()
+
+    def sample(self):
+        """returns a context manager profiling its block if this call is sampled"""
+        if not self.every or next(self._calls) % self.every:
+            return NULL_SPAN
+        if not self._busy.acquire(blocking=False): # sampling another thread, skip rather than wait
+            return NULL_SPAN
+        profile = self._profile
+        if profile is None:
+            import cProfile
+            profile = self._profile = cProfile.Profile()
+        return Profiled(profile, self._busy)
+
+    def sampled(self, fn):
+        """decorator: run fn under sample()"""
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not self.every:
+                return fn(*args, **kwargs)
+            with self.sample():
+                return fn(*args, **kwargs)
+        return wrapper
+
+    def status(self) -> dict:
+        return {'spans': self.spans, 'cpu_every': self.every, 'memory': self.memory}
+
+    def configure(self, spans: bool = None, every: int = None, memory: bool = None) -> list:
+        """switch captures on or off, None leaves one as it is. A cpu or
+        memory capture that is switched off (or to another `every`) is written.
+
+        returns:
+            list # paths written
+        """
+        written = []
+        with self._lock:
+            if spans is not None:
+                self.spans = spans
+                self.span = self._span if spans else NULL_SPANS.__getitem__
+            if every is not None and every != self.every:
+                self.every = 0 # no new samples
+                with self._busy: # the one in flight finishes and disables the profile
+                    profile = self._profile
+                    self._profile = None
+                    self._calls = itertools.count()
+                self.every = max(int(every), 0)
+                if profile is not None:
+                    written += self._write_cpu(profile)
+            if memory is not None and memory != self.memory:
+                import tracemalloc
+                if memory:
+                    tracemalloc.start(MEMORY_FRAMES)
+                else:
+                    written += self._write_memory(tracemalloc.take_snapshot())
+                    tracemalloc.stop()
+                self.memory = memory
+        return written
+
+    def _capture_path(self, kind: str) -> str:
+        path = self.path.format(kind=kind, time=datetime.datetime.now().strftime('%Y%m%dT%H%M%S'))
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        return path
+
+    def _write_cpu(self, profile) -> list:
+        import pstats
+        path = self._capture_path('cpu')
+        pstats.Stats(profile).dump_stats(path + '.prof')
+        summary = io.StringIO()
+        pstats.Stats(path + '.prof', stream=summary).sort_stats('cumulative').print_stats(TOP_STATS)
+        with open(path + '.txt', 'w') as f:
+            f.write(summary.getvalue())
+        return [path + '.prof', path + '.txt']
+
+    def _write_memory(self, snapshot) -> list:
+        path = self._capture_path('memory')
+        snapshot.dump(path + '.tracemalloc') # tracemalloc.Snapshot.load() to compare captures
+        with open(path + '.txt', 'w') as f:
+            for stat in snapshot.statistics('lineno')[:TOP_STATS]:
+                f.write('{}\n'.format(stat))
+        return [path + '.tracemalloc', path + '.txt']
+
+    def toggle_cpu(self, every: int = PROFILE_EVERY) -> list:
+        """spans and sampled cProfile on if they are off, else off"""
+        if self.spans or self.every:
+            return self.configure(spans=False, every=0)
+        return self.configure(spans=True, every=every)
+
+    def toggle_memory(self) -> list:
+        return self.configure(memory=not self.memory)
+
+
+def InstallSignals(profiler: Profiler, on_change=None, loop=None):
+    """SIGUSR1 toggles spans and sampled cProfile, SIGUSR2 toggles
+    tracemalloc. on_change is called with the paths written. Pass the event
+    loop of a grpc.aio server. Call from the main thread."""
+    def handler(switch):
+        def toggle(*args):
+            written = switch()
+            if on_change is not None:
+                on_change(written)
+        return toggle
+    for signum, switch in ((signal.SIGUSR1, profiler.toggle_cpu), (signal.SIGUSR2, profiler.toggle_memory)):
+        if loop is not None:
+            loop.add_signal_handler(signum, handler(switch))
+        else:
+            signal.signal(signum, handler(switch))
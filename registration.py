@@ -0,0 +1,209 @@
+"""
+Background registration of joined generators with their trackers.
+
+GeneratorJoin hands each new generator to a RegistrationDispatcher and
+answers with its id straight away. One thread per tracker drains that
+tracker's queue: every registration that arrived while the previous
+BatchRegisterGenerator call was in flight goes out in the next call (up to
+MAX_BATCH), so batches grow with the join rate instead of waiting on a
+timer. The tracker sends each generator's TrackerHello as before and
+answers with the generators it could not say hello to; only those are
+queued again, up to REGISTER_RETRIES times each.
+"""
+import threading
+import time
+
+import grpc
+
+import scowl_pb2
+import scowl_pb2_grpc
+from channels import GetStub
+
+MAX_BATCH = 512      # registrations per BatchRegisterGenerator call
+REGISTER_TIMEOUT = 30 # seconds per call, the tracker answers before it even if hellos are still running
+REGISTER_RETRIES = 3  # attempts after the first, per call and per generator whose hello failed
+REGISTER_BACKOFF = 0.1 # seconds before the first retry, doubled each retry
+
+# failures a whole batch is retried on
+RETRY_CODES = (grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.DEADLINE_EXCEEDED)
+
+
+class RegistrationDispatcher:
+    """Coalesces generator registrations per tracker and sends them from
+    background threads.
+
+    submit() never blocks on the network. Call flush() to wait until a
+    tracker has been told about everything submitted for it, e.g. before
+    unregistering a generator from it, or pass done to hear how each
+    registration ended.
+    """
+    def __init__(self, max_batch: int = MAX_BATCH, timeout: float = REGISTER_TIMEOUT,
+                 retries: int = REGISTER_RETRIES, backoff: float = REGISTER_BACKOFF, log=None):
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.log = log # called with a line of text when a batch is given up on
+
+        # counters
+        self.joins = 0      # registrations submitted
+        self.registered = 0 # acknowledged by their tracker
+        self.failed = 0     # given up on after retries
+        self.batches = 0
+        self.first_join = None
+        self.last_join = None
+        self.last_registered = None
+
+        self._queues = {}    # tracker addr -> [GeneratorMetadata]
+        self._in_flight = {} # tracker addr -> registrations being sent
+        self._attempts = {}  # id -> registrations sent again after a failed hello
+        self._done = {}      # (tracker addr, id) -> [done callbacks]
+        self._threads = {}
+        self._cond = threading.Condition()
+        self._closed = False
+
+    @property
+    def pending(self) -> int:
+        """submitted but neither registered nor failed"""
+        return self.joins - self.registered - self.failed
+
+    def submit(self, tracker_addr: str, gen: scowl_pb2.GeneratorMetadata, done=None):
+        """queue gen for registration with the tracker at tracker_addr. done,
+        if given, is called from a background thread with (gen.id, ok) once
+        gen is registered (ok True) or given up on (ok False)"""
+        now = time.monotonic()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('RegistrationDispatcher is closed')
+            self._queues.setdefault(tracker_addr, []).append(gen)
+            if done is not None:
+                self._done.setdefault((tracker_addr, gen.id), []).append(done)
+            self.joins += 1
+            if self.first_join is None:
+                self.first_join = now
+            self.last_join = now
+            if tracker_addr not in self._threads:
+                thread = threading.Thread(target=self._run, args=(tracker_addr,),
+                                          name='RegistrationDispatcher({})'.format(tracker_addr),
+                                          daemon=True)
+                self._threads[tracker_addr] = thread
+                thread.start()
+            self._cond.notify_all()
+
+    def flush(self, tracker_addr: str = None, timeout: float = None) -> bool:
+        """wait until nothing is queued or in flight for tracker_addr (or
+        for any tracker).
+
+        returns:
+            bool # False if timeout passed first
+        """
+        addrs = None if tracker_addr is None else [tracker_addr]
+        def idle():
+            return not any(self._queues.get(a) or self._in_flight.get(a)
+                           for a in (addrs or list(self._queues)))
+        with self._cond:
+            return self._cond.wait_for(idle, timeout)
+
+    def stats(self) -> dict:
+        with self._cond:
+            joining = (self.last_join - self.first_join) if self.joins > 1 else 0
+            registering = (self.last_registered - self.first_join) if self.last_registered else 0
+            return {'joins': self.joins, 'registered': self.registered, 'failed': self.failed,
+                    'pending': self.pending, 'batches': self.batches,
+                    'joins_per_sec': self.joins / joining if joining else 0.0,
+                    'registered_per_sec': self.registered / registering if registering else 0.0}
+
+    def close(self, timeout: float = None):
+        """send everything still queued, then stop the threads. Safe to call twice."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            threads = list(self._threads.values())
+        for thread in threads:
+            thread.join(timeout)
+
+    def _send(self, tracker_addr: str, batch: list):
+        """returns:
+            list # the generators of batch whose hello failed, None if the call itself failed
+        """
+        stub = GetStub(tracker_addr, scowl_pb2_grpc.TrackerStub)
+        request = scowl_pb2.GeneratorMetadataBatch(generators=batch)
+        backoff = self.backoff
+        for attempt in range(self.retries + 1):
+            try:
+                # wait_for_ready: a tracker that is still starting is not a failure
+                reply = stub.BatchRegisterGenerator(request, wait_for_ready=True, timeout=self.timeout)
+                failed = set(reply.failed)
+                return [gen for gen in batch if gen.id in failed]
+            except grpc.RpcError as e:
+                if attempt == self.retries or e.code() not in RETRY_CODES:
+                    if self.log is not None:
+                        self.log('Registration of {} generators with {} failed: {}\n'.format(
+                            len(batch), tracker_addr, e.code()))
+                    return None
+            time.sleep(backoff)
+            backoff *= 2
+
+    def _requeue(self, tracker_addr: str, batch: list, failed: list) -> list:
+        """queue the generators whose hello failed again, if they have
+        attempts left, and forget the rest. Call with _cond held.
+
+        returns:
+            list # the generators given up on
+        """
+        attempts = self._attempts
+        retry = [gen for gen in failed if attempts.get(gen.id, 0) < self.retries]
+        retry_ids = {gen.id for gen in retry}
+        for gen in batch:
+            if gen.id in retry_ids:
+                attempts[gen.id] = attempts.get(gen.id, 0) + 1
+            else:
+                attempts.pop(gen.id, None)
+        self._queues[tracker_addr].extend(retry)
+        given_up = [gen for gen in failed if gen.id not in retry_ids]
+        if given_up and self.log is not None:
+            self.log('Registration of {} generators with {} failed: no TrackerHello after {} attempts\n'.format(
+                len(given_up), tracker_addr, self.retries + 1))
+        return given_up
+
+    def _finish(self, tracker_addr: str, gens: list, ok: bool) -> list:
+        """returns the done callbacks of gens bound to their outcome. Call with _cond held"""
+        calls = []
+        for gen in gens:
+            for done in self._done.pop((tracker_addr, gen.id), ()):
+                calls.append((done, gen.id, ok))
+        return calls
+
+    def _run(self, tracker_addr: str):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._queues[tracker_addr] or self._closed)
+                queued = self._queues[tracker_addr]
+                if not queued: # closed and drained
+                    return
+                batch = queued[:self.max_batch]
+                del queued[:self.max_batch]
+                self._in_flight[tracker_addr] = len(batch)
+            failed = self._send(tracker_addr, batch)
+            with self._cond:
+                self.batches += 1
+                if failed is None:
+                    self.failed += len(batch)
+                    for gen in batch:
+                        self._attempts.pop(gen.id, None)
+                    calls = self._finish(tracker_addr, batch, False)
+                else:
+                    failed_ids = {gen.id for gen in failed}
+                    registered = [gen for gen in batch if gen.id not in failed_ids]
+                    given_up = self._requeue(tracker_addr, batch, failed)
+                    self.registered += len(registered)
+                    self.failed += len(given_up)
+                    if registered:
+                        self.last_registered = time.monotonic()
+                    calls = (self._finish(tracker_addr, registered, True)
+                             + self._finish(tracker_addr, given_up, False))
+            for done, id, ok in calls: # outside _cond, done may take its own locks
+                done(id, ok)
+            with self._cond: # in flight until done has run, so flush() sees every outcome
+                self._in_flight[tracker_addr] = 0
+                self._cond.notify_all()
@@ -0,0 +1,138 @@
+"""
+Routing of generator ids to trackers.
+
+RoutingTable: the 32-bit hash space is split into equal ranges, one per
+tracker. The break points are computed once per (num_buckets, hash_size)
+and shared by the bootstrap server, which assigns ids to trackers, and the
+trackers, which report the range they are responsible for.
+
+HashRing: consistent hashing with weighted virtual nodes, so trackers can
+be added or removed during a run while moving as few generators as
+possible.
+"""
+from bisect import bisect_left, bisect_right
+import functools
+
+import numpy as np
+import mmh3
+
+HASH_SIZE = 32 # bits
+VNODES = 64    # virtual nodes per unit of tracker weight
+RING_SEED = 42 # for use with mmh3
+
+
+class RoutingTable:
+    """Precomputed hash ranges; bucket i owns [break_points[i], break_points[i+1])."""
+    def __init__(self, num_buckets: int, hash_size: int = HASH_SIZE):
+        self.num_buckets = num_buckets
+        self.hash_size = hash_size
+        self.break_points = np.linspace((2**(hash_size-1) * -1), (2**(hash_size-1)),
+                                        num_buckets + 1, dtype=int)
+        self._bounds = self.break_points.tolist() # python ints bisect faster
+
+    def lookup(self, hash_result: int):
+        """returns the bucket for hash_result, or None if it is out of range"""
+        bucket = bisect_right(self._bounds, hash_result) - 1
+        if 0 <= bucket < self.num_buckets:
+            return bucket
+        return None
+
+    def lookup_many(self, hashes) -> np.ndarray:
+        """vectorized lookup. returns an int array of buckets, -1 where out of range"""
+        buckets = np.searchsorted(self.break_points, np.asarray(hashes), side='right') - 1
+        buckets[buckets >= self.num_buckets] = -1
+        return buckets
+
+    def range(self, bucket_id: int):
+        """returns (lower, upper) bounds of the ids bucket_id is responsible for"""
+        return self.break_points[bucket_id], self.break_points[bucket_id+1]
+
+
+@functools.lru_cache(maxsize=None)
+def GetRoutingTable(num_buckets: int, hash_size: int = HASH_SIZE) -> RoutingTable:
+    """returns the shared RoutingTable for num_buckets"""
+    return RoutingTable(num_buckets, hash_size)
+
+
+class HashRing:
+    """Consistent hash ring with weighted virtual nodes.
+
+    Each tracker owns round(weight * vnodes) points on the 32-bit ring and
+    an id belongs to the tracker owning the first point at or after it
+    (wrapping around). Adding or removing a tracker only moves the ids
+    between it and its neighbours.
+    """
+    def __init__(self, vnodes: int = VNODES, seed: int = RING_SEED):
+        self.vnodes = vnodes
+        self.seed = seed
+        self.weights = {} # tracker_id -> weight
+        self.points = np.empty(0, dtype=np.int64)
+        self.owners = np.empty(0, dtype=np.int64)
+        self._points = [] # python ints bisect faster
+        self._owners = []
+
+    def __len__(self):
+        return len(self.weights)
+
+    def __contains__(self, tracker_id):
+        return tracker_id in self.weights
+
+    def _rebuild(self):
+        points = []
+        for tracker_id, weight in self.weights.items():
+            for v in range(max(1, round(weight * self.vnodes))):
+                points.append((mmh3.hash('tracker_{}#{}'.format(tracker_id, v), self.seed), tracker_id))
+        points.sort()
+        self._points = [p for p, _ in points]
+        self._owners = [t for _, t in points]
+        self.points = np.array(self._points, dtype=np.int64)
+        self.owners = np.array(self._owners, dtype=np.int64)
+
+    def lookup(self, hash_result: int):
+        """returns the tracker responsible for hash_result, or None if the ring is empty"""
+        if not self._points:
+            return None
+        i = bisect_left(self._points, hash_result)
+        return self._owners[i % len(self._owners)]
+
+    def lookup_many(self, hashes) -> np.ndarray:
+        """vectorized lookup. returns an int array of trackers, -1 if the ring is empty"""
+        hashes = np.asarray(hashes)
+        if not self._points:
+            return np.full(hashes.shape, -1, dtype=np.int64)
+        i = np.searchsorted(self.points, hashes, side='left') % len(self.points)
+        return self.owners[i]
+
+    def _reassign(self, change, ids):
+        """apply change() and return [(id, old tracker, new tracker)] for the
+        ids whose owner changed"""
+        ids = list(ids)
+        hashes = np.array([int(id) for id in ids], dtype=np.int64)
+        before = self.lookup_many(hashes)
+        change()
+        self._rebuild()
+        after = self.lookup_many(hashes)
+        moved = np.flatnonzero(before != after)
+        return [(ids[i], int(before[i]), int(after[i])) for i in moved]
+
+    def add(self, tracker_id: int, weight: float = 1.0, ids=()):
+        """add (or re-weight) a tracker.
+
+        returns:
+            list # migration plan [(id, old tracker, new tracker), ...] for ids
+        """
+        if weight <= 0:
+            raise ValueError('tracker weight must be positive')
+        return self._reassign(lambda: self.weights.__setitem__(tracker_id, weight), ids)
+
+    def remove(self, tracker_id: int, ids=()):
+        """remove a tracker.
+
+        returns:
+            list # migration plan [(id, old tracker, new tracker), ...] for ids
+        """
+        if tracker_id not in self.weights:
+            raise KeyError(tracker_id)
+        if len(self.weights) == 1 and ids:
+            raise ValueError('cannot remove the last tracker while it owns generators')
+        return self._reassign(lambda: self.weights.pop(tracker_id), ids)
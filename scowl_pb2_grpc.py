@@ -25,6 +25,26 @@ class BootstrapStub(object):
                 request_serializer=scowl__pb2.PeerCtx.SerializeToString,
                 response_deserializer=scowl__pb2.Id128Bit.FromString,
                 )
+        self.BulkConsumerJoin = channel.unary_unary(
+                '/Bootstrap/BulkConsumerJoin',
+                request_serializer=scowl__pb2.PeerCtxBatch.SerializeToString,
+                response_deserializer=scowl__pb2.Id128BitBatch.FromString,
+                )
+        self.AddTracker = channel.unary_unary(
+                '/Bootstrap/AddTracker',
+                request_serializer=scowl__pb2.TrackerCtx.SerializeToString,
+                response_deserializer=scowl__pb2.MigrationPlan.FromString,
+                )
+        self.RemoveTracker = channel.unary_unary(
+                '/Bootstrap/RemoveTracker',
+                request_serializer=scowl__pb2.TrackerCtx.SerializeToString,
+                response_deserializer=scowl__pb2.MigrationPlan.FromString,
+                )
+        self.GetJoinStats = channel.unary_unary(
+                '/Bootstrap/GetJoinStats',
+                request_serializer=scowl__pb2.Empty.SerializeToString,
+                response_deserializer=scowl__pb2.JoinStats.FromString,
+                )
 
 
 class BootstrapServicer(object):
@@ -45,6 +65,34 @@ class BootstrapServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def BulkConsumerJoin(self, request, context):
+        """An RPC for joining many consumers at once, e.g. a whole feeder
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def AddTracker(self, request, context):
+        """RPC for adding (or re-weighting) a tracker on the hash ring during a run
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def RemoveTracker(self, request, context):
+        """RPC for removing a tracker from the hash ring during a run
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GetJoinStats(self, request, context):
+        """RPC for reading the join and registration counters
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_BootstrapServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -58,6 +106,26 @@ def add_BootstrapServicer_to_server(servicer, server):
                     request_deserializer=scowl__pb2.PeerCtx.FromString,
                     response_serializer=scowl__pb2.Id128Bit.SerializeToString,
             ),
+            'BulkConsumerJoin': grpc.unary_unary_rpc_method_handler(
+                    servicer.BulkConsumerJoin,
+                    request_deserializer=scowl__pb2.PeerCtxBatch.FromString,
+                    response_serializer=scowl__pb2.Id128BitBatch.SerializeToString,
+            ),
+            'AddTracker': grpc.unary_unary_rpc_method_handler(
+                    servicer.AddTracker,
+                    request_deserializer=scowl__pb2.TrackerCtx.FromString,
+                    response_serializer=scowl__pb2.MigrationPlan.SerializeToString,
+            ),
+            'RemoveTracker': grpc.unary_unary_rpc_method_handler(
+                    servicer.RemoveTracker,
+                    request_deserializer=scowl__pb2.TrackerCtx.FromString,
+                    response_serializer=scowl__pb2.MigrationPlan.SerializeToString,
+            ),
+            'GetJoinStats': grpc.unary_unary_rpc_method_handler(
+                    servicer.GetJoinStats,
+                    request_deserializer=scowl__pb2.Empty.FromString,
+                    response_serializer=scowl__pb2.JoinStats.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'Bootstrap', rpc_method_handlers)
@@ -103,6 +171,74 @@ class Bootstrap(object):
             options, channel_credentials,
             insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
 
+    @staticmethod
+    def BulkConsumerJoin(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/Bootstrap/BulkConsumerJoin',
+            scowl__pb2.PeerCtxBatch.SerializeToString,
+            scowl__pb2.Id128BitBatch.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def AddTracker(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/Bootstrap/AddTracker',
+            scowl__pb2.TrackerCtx.SerializeToString,
+            scowl__pb2.MigrationPlan.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def RemoveTracker(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/Bootstrap/RemoveTracker',
+            scowl__pb2.TrackerCtx.SerializeToString,
+            scowl__pb2.MigrationPlan.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def GetJoinStats(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/Bootstrap/GetJoinStats',
+            scowl__pb2.Empty.SerializeToString,
+            scowl__pb2.JoinStats.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
 
 class TrackerStub(object):
     """the interfaces exported by tracker servers
@@ -119,11 +255,36 @@ class TrackerStub(object):
                 request_serializer=scowl__pb2.GeneratorMetadata.SerializeToString,
                 response_deserializer=scowl__pb2.Empty.FromString,
                 )
+        self.BatchRegisterGenerator = channel.unary_unary(
+                '/Tracker/BatchRegisterGenerator',
+                request_serializer=scowl__pb2.GeneratorMetadataBatch.SerializeToString,
+                response_deserializer=scowl__pb2.BatchRegistration.FromString,
+                )
         self.UpdateGeneratorState = channel.unary_unary(
                 '/Tracker/UpdateGeneratorState',
                 request_serializer=scowl__pb2.StateUpdate.SerializeToString,
                 response_deserializer=scowl__pb2.DemandUpdate.FromString,
                 )
+        self.StreamGeneratorState = channel.stream_stream(
+                '/Tracker/StreamGeneratorState',
+                request_serializer=scowl__pb2.StateUpdate.SerializeToString,
+                response_deserializer=scowl__pb2.DemandUpdate.FromString,
+                )
+        self.BatchUpdateGeneratorState = channel.unary_unary(
+                '/Tracker/BatchUpdateGeneratorState',
+                request_serializer=scowl__pb2.StateUpdateBatch.SerializeToString,
+                response_deserializer=scowl__pb2.DemandUpdateBatch.FromString,
+                )
+        self.UnregisterGenerator = channel.unary_unary(
+                '/Tracker/UnregisterGenerator',
+                request_serializer=scowl__pb2.GeneratorMetadata.SerializeToString,
+                response_deserializer=scowl__pb2.Empty.FromString,
+                )
+        self.SetProfiling = channel.unary_unary(
+                '/Tracker/SetProfiling',
+                request_serializer=scowl__pb2.ProfilingRequest.SerializeToString,
+                response_deserializer=scowl__pb2.ProfilingStatus.FromString,
+                )
 
 
 class TrackerServicer(object):
@@ -137,6 +298,13 @@ class TrackerServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def BatchRegisterGenerator(self, request, context):
+        """RegisterGenerator for many generators at once, see registration.py
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
     def UpdateGeneratorState(self, request, context):
         """RPC for receiving StateUpdateMessages from generators
         """
@@ -144,6 +312,35 @@ class TrackerServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def StreamGeneratorState(self, request_iterator, context):
+        """long-lived version of UpdateGeneratorState, the tracker pushes a
+        DemandUpdate whenever a generator's demand is (re)computed
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def BatchUpdateGeneratorState(self, request, context):
+        """UpdateGeneratorState for many generators at once, rebalances once per batch
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def UnregisterGenerator(self, request, context):
+        """RPC for dropping a generator that migrated to another tracker
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def SetProfiling(self, request, context):
+        """admin RPC switching the tracker's profiling on or off, see profiling.py
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_TrackerServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -152,11 +349,36 @@ def add_TrackerServicer_to_server(servicer, server):
                     request_deserializer=scowl__pb2.GeneratorMetadata.FromString,
                     response_serializer=scowl__pb2.Empty.SerializeToString,
             ),
+            'BatchRegisterGenerator': grpc.unary_unary_rpc_method_handler(
+                    servicer.BatchRegisterGenerator,
+                    request_deserializer=scowl__pb2.GeneratorMetadataBatch.FromString,
+                    response_serializer=scowl__pb2.BatchRegistration.SerializeToString,
+            ),
             'UpdateGeneratorState': grpc.unary_unary_rpc_method_handler(
                     servicer.UpdateGeneratorState,
                     request_deserializer=scowl__pb2.StateUpdate.FromString,
                     response_serializer=scowl__pb2.DemandUpdate.SerializeToString,
             ),
+            'StreamGeneratorState': grpc.stream_stream_rpc_method_handler(
+                    servicer.StreamGeneratorState,
+                    request_deserializer=scowl__pb2.StateUpdate.FromString,
+                    response_serializer=scowl__pb2.DemandUpdate.SerializeToString,
+            ),
+            'BatchUpdateGeneratorState': grpc.unary_unary_rpc_method_handler(
+                    servicer.BatchUpdateGeneratorState,
+                    request_deserializer=scowl__pb2.StateUpdateBatch.FromString,
+                    response_serializer=scowl__pb2.DemandUpdateBatch.SerializeToString,
+            ),
+            'UnregisterGenerator': grpc.unary_unary_rpc_method_handler(
+                    servicer.UnregisterGenerator,
+                    request_deserializer=scowl__pb2.GeneratorMetadata.FromString,
+                    response_serializer=scowl__pb2.Empty.SerializeToString,
+            ),
+            'SetProfiling': grpc.unary_unary_rpc_method_handler(
+                    servicer.SetProfiling,
+                    request_deserializer=scowl__pb2.ProfilingRequest.FromString,
+                    response_serializer=scowl__pb2.ProfilingStatus.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'Tracker', rpc_method_handlers)
@@ -185,6 +407,23 @@ class Tracker(object):
             options, channel_credentials,
             insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
 
+    @staticmethod
+    def BatchRegisterGenerator(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/Tracker/BatchRegisterGenerator',
+            scowl__pb2.GeneratorMetadataBatch.SerializeToString,
+            scowl__pb2.BatchRegistration.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
     @staticmethod
     def UpdateGeneratorState(request,
             target,
@@ -202,6 +441,74 @@ class Tracker(object):
             options, channel_credentials,
             insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
 
+    @staticmethod
+    def StreamGeneratorState(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_stream(request_iterator, target, '/Tracker/StreamGeneratorState',
+            scowl__pb2.StateUpdate.SerializeToString,
+            scowl__pb2.DemandUpdate.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def BatchUpdateGeneratorState(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/Tracker/BatchUpdateGeneratorState',
+            scowl__pb2.StateUpdateBatch.SerializeToString,
+            scowl__pb2.DemandUpdateBatch.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def UnregisterGenerator(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/Tracker/UnregisterGenerator',
+            scowl__pb2.GeneratorMetadata.SerializeToString,
+            scowl__pb2.Empty.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def SetProfiling(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/Tracker/SetProfiling',
+            scowl__pb2.ProfilingRequest.SerializeToString,
+            scowl__pb2.ProfilingStatus.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
 
 class GeneratorStub(object):
     """the interfaces exported by generator servers
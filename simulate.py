@@ -0,0 +1,240 @@
+"""
+Discrete-event simulation of a scowl grid on a virtual clock.
+
+Runs the real tracker logic and the generators' output model in one
+process, without grpc and without sleeping. Every simulated tracker is its
+own copy of tracker.py (see LoadTracker), so it has its own region state,
+balancer, log and history file, in the same format as a live run. Each
+generator is a GeneratorModel stepped like generator.mutate: a tick, then
+RTT ms later its StateUpdate reaches the tracker and the reply sets its
+demand, then REFRESH_RATE s later the next tick. Those delays are events
+on a heap, the clock jumps from one event to the next, and the timestamps
+a tracker records come from that clock.
+
+    python simulate.py <host_config.csv> [ticks] [trackers,...] [consumers|-,...] [update|epoch]
+
+Runs every combination of tracker count and consumer count (the G:C
+ratio) and prints one row of README evaluation metrics per run.
+"""
+import importlib.util
+import datetime
+import heapq
+import time
+import sys
+import os
+
+import mmh3
+import numpy as np
+
+import scowl_pb2
+from launcher import GeneratorInstances, ReadHostConfig
+from mutation import GeneratorModel, LoadCoefficientTable, OUTPUT_CONFIG_PATH
+from routing import GetRoutingTable
+
+HASH_SEED = 42     # as in bootstrap_server.py
+HASH_SIZE = 32     # bits
+START_PORT = 32000 # tracker i "listens" on START_PORT + i, as in tracker.py
+REFRESH_RATE = 2   # seconds, as in generator.py
+RES_CONSUMPTION = 0.00131 # MW per home, as in tracker.py
+TICKS = 100
+
+TRACKER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tracker.py')
+
+
+class VirtualClock:
+    """seconds since the start of the simulation, advanced by the event loop"""
+    def __init__(self, start: datetime.datetime = None):
+        self.start = start if start is not None else datetime.datetime.now()
+        self.now = 0.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def datetime(self) -> datetime.datetime:
+        return self.start + datetime.timedelta(seconds=self.now)
+
+
+def LoadTracker(tracker_id: int, clock: VirtualClock, num_trackers: int = 1, host_id: int = 0,
+                mode: str = 'update'):
+    """returns a new copy of the tracker.py module, set up as if it had been
+    started with `tracker.py <port> <host_id> <num_trackers> <mode>` and
+    reading the time from clock"""
+    spec = importlib.util.spec_from_file_location(
+        'tracker_{}_{}'.format(host_id, tracker_id), TRACKER_PATH)
+    tracker = importlib.util.module_from_spec(spec)
+    argv = sys.argv
+    sys.argv = ['tracker.py', str(START_PORT + tracker_id), str(host_id), str(num_trackers), mode]
+    try:
+        spec.loader.exec_module(tracker)
+    finally:
+        sys.argv = argv
+    tracker.Now = clock.datetime
+    tracker.StartEpochs(clock=clock.monotonic)
+    return tracker
+
+
+class SimGenerator:
+    """a generator.py process: its id, the tracker it was routed to and its model"""
+    __slots__ = ('addr', 'id', 'rtt', 'tracker', 'model')
+
+    def __init__(self, addr: str, id: str, rtt: int, tracker: int, model: GeneratorModel):
+        self.addr = addr
+        self.id = id
+        self.rtt = rtt # ms
+        self.tracker = tracker
+        self.model = model
+
+
+class Simulation:
+    """One simulated grid. Call run() once."""
+    def __init__(self, instances: list, num_trackers: int = 1, mode: str = 'update',
+                 refresh_rate: float = REFRESH_RATE, consumers: int = None, coefficients=None,
+                 seed=None, host_id: int = 0, start: datetime.datetime = None):
+        """instances: as returned by launcher.GeneratorInstances
+        consumers: homes spread over the generators by capacity, each
+            generator starts with their demand. None keeps generator.py's
+            75% of capacity"""
+        self.clock = VirtualClock(start)
+        self.num_trackers = num_trackers
+        self.mode = mode
+        self.refresh_rate = refresh_rate
+        self.consumers = consumers
+        self.trackers = [LoadTracker(i, self.clock, num_trackers, host_id, mode)
+                         for i in range(num_trackers)]
+        self.servicers = [t.TrackerServicer() for t in self.trackers]
+        self.ticks = 0
+
+        # metrics
+        self.updates = 0
+        self.shifted = 0.0    # sum of |demand answered - demand reported| (MW)
+        self.unmanaged = 0.0  # sum of demand answered beyond output (MW)
+        self.tracker_cpu = 0.0 # seconds spent in tracker handlers
+        self.wall = 0.0
+
+        coefficients = (coefficients if coefficients is not None
+                        else LoadCoefficientTable(OUTPUT_CONFIG_PATH))
+        routing = GetRoutingTable(num_trackers, HASH_SIZE)
+        seeds = np.random.SeedSequence(seed).spawn(len(instances) + 1)
+        total_capacity = sum(g['capacity_mw'] for g in instances)
+        self.generators = []
+        for g, gen_seed in zip(instances, seeds[1:]):
+            id = mmh3.hash(g['addr'], HASH_SEED)
+            model = GeneratorModel(g['capacity_mw'], g['kind'], coefficients[g['kind']], gen_seed)
+            if consumers is not None:
+                model.demand = consumers * RES_CONSUMPTION * g['capacity_mw'] / total_capacity
+            self.generators.append(SimGenerator(g['addr'], str(id), g['rtt'], routing.lookup(id), model))
+
+        # GeneratorJoin: each tracker learns about its generators in one batch
+        for tracker_id, servicer in enumerate(self.servicers):
+            servicer.RecordRegistrations(scowl_pb2.GeneratorMetadataBatch(generators=[
+                scowl_pb2.GeneratorMetadata(addr=g.addr, id=g.id, kind=g.model.kind,
+                                            capacity=g.model.capacity)
+                for g in self.generators if g.tracker == tracker_id]), None)
+
+        self._events = [] # (time, seq, action, args)
+        self._seq = 0
+        # generators do not start in lockstep, spread their first tick over a period
+        offsets = np.random.default_rng(seeds[0]).uniform(0, refresh_rate, len(self.generators))
+        for gen, offset in zip(self.generators, offsets.tolist()):
+            self.schedule(offset, self.Tick, gen)
+
+    def schedule(self, delay: float, action, *args):
+        """run action(*args) delay virtual seconds from now"""
+        self._seq += 1
+        heapq.heappush(self._events, (self.clock.now + delay, self._seq, action, args))
+
+    def Tick(self, gen: SimGenerator):
+        """generator.mutate: mutateState(), then the RTT before the update lands"""
+        gen.model.step()
+        self.schedule(gen.rtt / 1000, self.Update, gen)
+
+    def Update(self, gen: SimGenerator):
+        """the tracker handles the StateUpdate and the generator adopts the reply"""
+        model = gen.model
+        request = scowl_pb2.StateUpdate(id=gen.id, ts=model.state_ts, output=model.output,
+                                        demand=model.demand)
+        start = time.process_time()
+        reply = self.servicers[gen.tracker].UpdateGeneratorState(request, None)
+        self.tracker_cpu += time.process_time() - start
+        self.updates += 1
+        self.shifted += abs(reply.demand - model.demand)
+        self.unmanaged += max(reply.demand - model.output, 0.0)
+        model.demand = reply.demand
+        if model.state_ts < self.ticks:
+            self.schedule(self.refresh_rate, self.Tick, gen)
+
+    def run(self, ticks: int = TICKS) -> dict:
+        """simulate until every generator has reported `ticks` times.
+
+        returns:
+            dict # see results()
+        """
+        self.ticks = ticks
+        start = time.perf_counter()
+        events = self._events
+        clock = self.clock
+        while events:
+            clock.now, _, action, args = heapq.heappop(events)
+            action(*args)
+        self.wall = time.perf_counter() - start
+        self.close()
+        return self.results()
+
+    def close(self):
+        """flush every tracker's history and log"""
+        for tracker in self.trackers:
+            tracker.data_writer.close()
+            tracker.log_writer.close()
+
+    def results(self) -> dict:
+        updates = max(self.updates, 1)
+        return {
+            'generators': len(self.generators),
+            'consumers': self.consumers,
+            'trackers': self.num_trackers,
+            'mode': self.mode,
+            'ticks': self.ticks,
+            'updates': self.updates,
+            'sim_seconds': self.clock.now,
+            'wall_seconds': self.wall,
+            'speedup': self.clock.now / self.wall if self.wall else 0.0,
+            'tracker_cpu_us': self.tracker_cpu / updates * 1e6, # per StateUpdate
+            'delta_load_mw': self.shifted / updates,  # mean load moved per StateUpdate
+            'unmanaged_mw': self.unmanaged / updates, # mean demand left beyond output
+            'history_dropped': sum(t.data_writer.dropped for t in self.trackers),
+        }
+
+
+def Sweep(config_path: str, ticks: int = TICKS, trackers=(1,), consumers=(None,),
+          mode: str = 'update', seed: int = 0) -> list:
+    """run a Simulation per (tracker count, consumer count) and print a row for each.
+
+    returns:
+        list # of Simulation.results()
+    """
+    instances = GeneratorInstances(ReadHostConfig(config_path), seed=seed)
+    print("{:>6} {:>9} {:>6} {:>8} {:>9} {:>8} {:>8} {:>11} {:>12} {:>12}".format(
+        'gens', 'consumers', 'G:C', 'trackers', 'updates', 'sim (s)', 'wall (s)',
+        'cpu/update', 'delta (MW)', 'unmanaged'))
+    results = []
+    for num_trackers in trackers:
+        for num_consumers in consumers:
+            r = Simulation(instances, num_trackers, mode, consumers=num_consumers, seed=seed).run(ticks)
+            results.append(r)
+            print("{:>6} {:>9} {:>6} {:>8} {:>9} {:>8.0f} {:>8.2f} {:>8.1f} us {:>12.3f} {:>12.3f}".format(
+                r['generators'], '-' if num_consumers is None else num_consumers,
+                '-' if num_consumers is None else '1:{:.0f}'.format(num_consumers / r['generators']),
+                num_trackers, r['updates'], r['sim_seconds'], r['wall_seconds'],
+                r['tracker_cpu_us'], r['delta_load_mw'], r['unmanaged_mw']))
+    return results
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    config_path = args[0]
+    ticks = int(args[1]) if len(args) > 1 else TICKS
+    trackers = [int(n) for n in args[2].split(',')] if len(args) > 2 else [1]
+    # '-': generators keep their default demand
+    consumers = [None if n == '-' else int(n) for n in args[3].split(',')] if len(args) > 3 else [None]
+    mode = args[4] if len(args) > 4 else 'update'
+    Sweep(config_path, ticks, trackers, consumers, mode)
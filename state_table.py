@@ -0,0 +1,242 @@
+"""
+Slot-indexed generator state for a tracker.
+
+Each generator id is mapped to a fixed row in a set of typed column arrays,
+so recording a StateUpdate is a dict lookup and a few scalar stores. The
+arrays grow by doubling when a new id no longer fits. Use to_frame() to get
+a pandas DataFrame for analysis; nothing on the update path touches pandas.
+
+A SharedStateTable keeps the same columns in a multiprocessing.shared_memory
+segment instead, so other processes on the host (see tracker_host.py) can
+read a region's totals through a SharedStateView without asking the
+tracker. Its capacity is fixed when the segment is created.
+"""
+from multiprocessing import shared_memory
+import numpy as np
+
+# column name -> dtype, in the order written to the tracker history
+STATE_SCHEMA = {
+    'ts':          np.int64,   # lamport ts
+    'host':        np.int64,
+    'tracker':     np.int64,
+    'output':      np.float64, # MW
+    'demand':      np.float64, # MW
+    'net_cap':     np.float64, # MW
+    'percent_use': np.float64,
+    'time':        'datetime64[us]', # wall clock of the last update
+}
+STATE_COLUMNS = list(STATE_SCHEMA)
+
+
+class GeneratorStateTable:
+    """Fixed-schema column store with one row per generator id.
+
+    Not thread safe: row() assigns slots and _grow() replaces the columns
+    without a lock, so concurrent writers must hold one (tracker.py's
+    state_lock).
+    """
+    __slots__ = ('rows', 'ids', 'size', 'capacity') + tuple(STATE_COLUMNS)
+
+    def __init__(self, capacity: int = 64):
+        self.rows = {} # id -> row
+        self.ids = []  # row -> id
+        self.size = 0
+        self.capacity = 0
+        self._grow(max(int(capacity), 1))
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, id):
+        return id in self.rows
+
+    def _grow(self, capacity: int):
+        for name, dtype in STATE_SCHEMA.items():
+            column = np.zeros(capacity, dtype=dtype)
+            if self.size:
+                column[:self.size] = getattr(self, name)[:self.size]
+            setattr(self, name, column)
+        self.capacity = capacity
+
+    def row(self, id) -> int:
+        """returns the row for id, assigning the next free one if id is new"""
+        row = self.rows.get(id)
+        if row is None:
+            if self.size == self.capacity:
+                self._grow(self.capacity * 2)
+            row = self.size
+            self.rows[id] = row
+            self.ids.append(id)
+            self.size += 1
+        return row
+
+    def remove(self, id) -> int:
+        """drop id, moving the last row into its place.
+
+        returns:
+            int # the row that was vacated (and now holds the moved id)
+        """
+        row = self.rows.pop(id)
+        last = self.size - 1
+        if row != last:
+            for name in STATE_COLUMNS:
+                column = getattr(self, name)
+                column[row] = column[last]
+            moved = self.ids[last]
+            self.ids[row] = moved
+            self.rows[moved] = row
+        self.ids.pop()
+        self.size -= 1
+        return row
+
+    def update(self, id, ts: int, host: int, tracker: int, output: float, demand: float, time) -> int:
+        """record a StateUpdate, deriving net_cap and percent_use.
+
+        returns:
+            int # the generator's row
+        """
+        row = self.row(id)
+        self.ts[row] = ts
+        self.host[row] = host
+        self.tracker[row] = tracker
+        self.output[row] = output
+        self.demand[row] = demand
+        self.net_cap[row] = output - demand
+        if output == 0:
+            self.percent_use[row] = -1.0 # really negative infinity
+        else:
+            self.percent_use[row] = (output - demand) / output
+        self.time[row] = time
+        return row
+
+    def to_frame(self):
+        """returns a copy of the live rows as a DataFrame indexed by id"""
+        import pandas as pd
+        frame = pd.DataFrame(
+            {name: getattr(self, name)[:self.size].copy() for name in STATE_COLUMNS},
+            index=pd.Index(self.ids[:self.size], name='id'))
+        return frame
+
+
+# shared segment: header, then every STATE_SCHEMA column, `capacity` rows each.
+# seq is odd while the owner is writing (a seqlock), readers retry until it
+# is even and unchanged across their read.
+SHARED_MAGIC = b'SCST'
+SHARED_HEADER = np.dtype([
+    ('magic',    'S4'),
+    ('capacity', '<i8'),
+    ('size',     '<i8'),
+    ('seq',      '<u8'),
+], align=True)
+SHARED_CAPACITY = 65536 # rows, a shared table cannot grow
+READ_RETRIES = 100      # SharedStateView reads before settling for a torn one
+
+
+def SharedStateSize(capacity: int) -> int:
+    """returns the bytes of a shared segment holding capacity rows"""
+    return SHARED_HEADER.itemsize + capacity * sum(
+        np.dtype(dtype).itemsize for dtype in STATE_SCHEMA.values())
+
+def MapColumns(buf, capacity: int) -> dict:
+    """returns {column: array} over the column area of a shared segment"""
+    columns = {}
+    offset = SHARED_HEADER.itemsize
+    for name, dtype in STATE_SCHEMA.items():
+        columns[name] = np.ndarray(capacity, dtype=dtype, buffer=buf, offset=offset)
+        offset += capacity * np.dtype(dtype).itemsize
+    return columns
+
+def CreateSharedState(name: str, capacity: int = SHARED_CAPACITY) -> shared_memory.SharedMemory:
+    """create an empty shared segment. The creator owns it: close() and
+    unlink() it when every tracker using it has stopped."""
+    shm = shared_memory.SharedMemory(name=name, create=True, size=SharedStateSize(capacity))
+    header = np.ndarray(1, dtype=SHARED_HEADER, buffer=shm.buf)
+    header[0] = (SHARED_MAGIC, capacity, 0, 0)
+    return shm
+
+def AttachSharedState(name: str):
+    """returns (SharedMemory, header, capacity) of an existing segment"""
+    shm = shared_memory.SharedMemory(name=name)
+    header = np.ndarray(1, dtype=SHARED_HEADER, buffer=shm.buf)
+    if header['magic'][0] != SHARED_MAGIC:
+        shm.close()
+        raise ValueError('{}: not a shared state table'.format(name))
+    return shm, header, int(header['capacity'][0])
+
+
+class SharedStateTable(GeneratorStateTable):
+    """GeneratorStateTable whose columns live in a shared segment made by
+    CreateSharedState. Only one process may write to it."""
+    __slots__ = ('shm', '_size', '_seq')
+
+    def __init__(self, name: str):
+        """attach to segment `name` and start with no rows"""
+        self.shm, header, capacity = AttachSharedState(name)
+        self._size = header['size'] # views into the header
+        self._seq = header['seq']
+        self._seq[0] += 1
+        self._size[0] = 0 # rows left by a previous owner belong to ids we no longer know
+        self._seq[0] += 1
+        self.rows = {}
+        self.ids = []
+        self.size = 0
+        self.capacity = capacity
+        for column_name, column in MapColumns(self.shm.buf, capacity).items():
+            setattr(self, column_name, column)
+
+    def _grow(self, capacity: int):
+        raise MemoryError('shared state table {} is full ({} rows)'.format(self.shm.name, self.capacity))
+
+    def update(self, id, ts: int, host: int, tracker: int, output: float, demand: float, time) -> int:
+        self._seq[0] += 1
+        try:
+            row = GeneratorStateTable.update(self, id, ts, host, tracker, output, demand, time)
+            self._size[0] = self.size
+        finally:
+            self._seq[0] += 1
+        return row
+
+    def remove(self, id) -> int:
+        self._seq[0] += 1
+        try:
+            row = GeneratorStateTable.remove(self, id)
+            self._size[0] = self.size
+        finally:
+            self._seq[0] += 1
+        return row
+
+    def close(self):
+        """detach; the segment itself stays until its creator unlinks it"""
+        for name in STATE_COLUMNS:
+            setattr(self, name, None)
+        self._size = self._seq = None
+        self.shm.close()
+
+
+class SharedStateView:
+    """Read-only access to a SharedStateTable in another process."""
+    def __init__(self, name: str):
+        self.name = name
+        self.shm, self.header, self.capacity = AttachSharedState(name)
+        self.columns = MapColumns(self.shm.buf, self.capacity)
+
+    def totals(self) -> dict:
+        """returns the region's generator count and total output and demand
+        (MW), as of one moment between two of the owner's updates"""
+        header = self.header
+        output, demand = self.columns['output'], self.columns['demand']
+        for attempt in range(READ_RETRIES + 1):
+            seq = int(header['seq'][0])
+            if seq % 2 and attempt < READ_RETRIES:
+                continue
+            size = int(header['size'][0])
+            totals = {'generators': size,
+                      'output': float(output[:size].sum()),
+                      'demand': float(demand[:size].sum())}
+            if int(header['seq'][0]) == seq:
+                break
+        return totals
+
+    def close(self):
+        self.columns = self.header = None
+        self.shm.close()
@@ -7,16 +7,25 @@ A tracker must:
         4a. unit size of consumption passed: 1 home / 0.00131 MW
 """
 from concurrent import futures
-from tabulate import tabulate
-import pandas as pd
 import numpy as np
+import functools
+import threading
 import datetime
-import typing
+import asyncio
+import queue
+import signal
 import grpc
 import time
 
 import scowl_pb2
 import scowl_pb2_grpc
+from balancer import LoadBalancer, EpochBalancer
+from state_table import GeneratorStateTable, STATE_COLUMNS
+from history import HistoryWriter, EncodeColumnarChunk, HistoryTime
+from routing import GetRoutingTable
+from channels import GetStub, AioChannelPool, SERVER_OPTIONS
+from metrics import REGISTRY, MetricsInterceptor, AioMetricsInterceptor, ServeMetrics
+from profiling import Profiler, InstallSignals
 
 import sys
 # Generator hash size (bits)
@@ -28,21 +37,86 @@ LISTEN_PORT = int(sys.argv[1]) # [0] is the program name
 HOST_ID = int(sys.argv[2])
 TRACKER_ID = LISTEN_PORT - START_PORT
 NUM_BUCKETS = int(sys.argv[3]) # int
+# 'update': rebalance the region on every StateUpdate
+# 'epoch':  record updates, rebalance once per round/REBALANCE_EPOCH
+REBALANCE_MODE = sys.argv[4] if len(sys.argv) > 4 else 'update'
+REBALANCE_EPOCH = 2 # seconds, the generators' REFRESH_RATE
+# 'threads': grpc.server on a thread pool
+# 'asyncio': grpc.aio server, see AsyncTrackerServicer
+SERVER_MODE = 'threads'
+SERVER_WORKERS = 10 # thread-pool workers for unary calls
+# StreamGeneratorState calls the thread-pool server takes at once. Each holds
+# a worker for its whole life, so the pool has this many more workers and
+# further streams are refused (RESOURCE_EXHAUSTED) instead of starving unary
+# calls. Use 'asyncio' for more streams than that
+MAX_STREAMS = 32
+# TrackerHello delivery: each attempt waits for the generator's server to
+# accept connections, failed attempts are retried with exponential backoff
+HELLO_TIMEOUT = 5     # seconds per attempt
+HELLO_RETRIES = 3     # attempts after the first
+HELLO_BACKOFF = 0.05  # seconds before the first retry, doubled each retry
+HELLO_CONCURRENCY = 32 # hellos in flight per BatchRegisterGenerator call
+HELLO_REPLY_MARGIN = 1 # seconds before its deadline a BatchRegisterGenerator call is answered
 
 # log file path
 LOG_PATH = 'sim/2030/logs/host_{}_tracker_{}.log'.format(HOST_ID, TRACKER_ID)
-DATA_PATH = 'sim/2030/logs/his/host_{}_tracker_{}.csv'.format(HOST_ID, TRACKER_ID)
+# 'csv': text rows, 'columnar': binary chunks, see history.LoadColumnarHistory
+HISTORY_FORMAT = 'csv'
+DATA_PATH = 'sim/2030/logs/his/host_{}_tracker_{}.{}'.format(
+    HOST_ID, TRACKER_ID, 'bin' if HISTORY_FORMAT == 'columnar' else 'csv')
+# metrics, see metrics.py. Served on METRICS_PORT (None: not served), written to METRICS_PATH on shutdown.
+# Off by default: generators listen from 33000 up, e.g. 9100 + TRACKER_ID is clear of both
+METRICS_PORT = None
+METRICS_PATH = 'sim/2030/logs/host_{}_tracker_{}.metrics'.format(HOST_ID, TRACKER_ID)
+# cProfile/tracemalloc captures, see profiling.py. Off until SIGUSR1/SIGUSR2 or SetProfiling
+PROFILE_PATH = 'sim/2030/logs/prof/host_{}_tracker_{}_{{kind}}_{{time}}'.format(HOST_ID, TRACKER_ID)
 
 # Electricity Stuff
 RES_CONSUMPTION = 0.00131 # MW
 SAFETY_THRESHOLD = 0.1    # 10% of generator output
 
-# a data frame with columns per STATE_COLUMNS and generators as rows
-STATE_COLUMNS = ['ts', 'host','tracker','output', 'demand', 'net_cap', 'percent_use','time']
-
-state = pd.DataFrame(columns=STATE_COLUMNS)
-state.index.name = 'id'
-state.to_csv(DATA_PATH) # start a new log
+# typed columns per STATE_COLUMNS and one row per generator.
+# use state.to_frame() for a DataFrame
+state = GeneratorStateTable()
+# held across a state update, the rebalance and reading its result. Handlers
+# run on a thread pool and neither the table nor the balancer's scratch
+# arrays (which allocate() returns a view of) may change meanwhile.
+# Reentrant, as the EpochBalancer takes it too
+state_lock = threading.RLock()
+# history rows and log text are written by background threads, see history.py
+HISTORY_FSYNC = 'never' # 'never', 'batch' or 'close'
+if HISTORY_FORMAT == 'columnar':
+    data_writer = HistoryWriter(DATA_PATH, mode='w', binary=True, encode=EncodeColumnarChunk,
+                                fsync=HISTORY_FSYNC,
+                                timer=REGISTRY.histogram('flush_seconds', file='history', tracker=TRACKER_ID))
+else:
+    with open(DATA_PATH, 'w') as writer: # start a new log
+        writer.write(','.join(['id'] + STATE_COLUMNS) + '\n')
+    data_writer = HistoryWriter(DATA_PATH, fsync=HISTORY_FSYNC,
+                                timer=REGISTRY.histogram('flush_seconds', file='history', tracker=TRACKER_ID))
+log_writer = HistoryWriter(LOG_PATH, mode='w', fsync=HISTORY_FSYNC,
+                           timer=REGISTRY.histogram('flush_seconds', file='log', tracker=TRACKER_ID))
+
+balancer = LoadBalancer(state, safety_threshold=SAFETY_THRESHOLD, res_consumption=RES_CONSUMPTION,
+                        timer=REGISTRY.histogram('load_balance_seconds', tracker=TRACKER_ID))
+epochs = None # an EpochBalancer when REBALANCE_MODE == 'epoch', see serve()
+profiler = Profiler(PROFILE_PATH, tracker=TRACKER_ID)
+aio_channels = None # an AioChannelPool, see serve_async()
+
+# generators with an open StreamGeneratorState call: id -> outbox of DemandUpdates
+streams = {}
+streams_lock = threading.Lock()
+stream_slots = threading.BoundedSemaphore(MAX_STREAMS) # see MAX_STREAMS, thread-pool server only
+
+# failures a TrackerHello is retried on
+RETRY_CODES = (grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.DEADLINE_EXCEEDED)
+# sends the hellos of a BatchRegisterGenerator call
+hello_pool = futures.ThreadPoolExecutor(max_workers=HELLO_CONCURRENCY, thread_name_prefix='hello')
+
+def Now() -> datetime.datetime:
+    """the time stamped on requests, history and logs. simulate.py replaces
+    it with a virtual clock"""
+    return datetime.datetime.now()
 
 def GetOwnIP():
     import socket   
@@ -51,23 +125,22 @@ def GetOwnIP():
     return IPAddr
 
 def ComputeBucketRange(num_buckets: int = NUM_BUCKETS, bucket_id: int = TRACKER_ID, hash_size: int = 32):
-    break_points = np.linspace((2**(hash_size-1) * -1), (2**(hash_size-1)), num_buckets + 1, dtype=int)
-    lower = break_points[bucket_id]
-    upper = break_points[bucket_id+1]
-    return lower, upper
+    """the same table the bootstrap server assigns ids with, see routing.py"""
+    return GetRoutingTable(num_buckets, hash_size).range(bucket_id)
 
 def LogRequest(request, context, response=None, to_log=False, to_stdout=True):
     if to_log:
-        with open(LOG_PATH, 'a') as f:
-            f.write('------------ Request Received ------------\n')
-            f.write('Date:     {}\n'.format(datetime.datetime.now()))
-            f.write('ID:       {}\n'.format(request.id))
-            f.write('Src Addr: {}\n'.format(request.addr))
-            f.write('Type:     "{}"\n'.format(request.kind))
-            f.write('Capacity: {}\n'.format(request.capacity))
+        log_writer.write(
+            '------------ Request Received ------------\n'
+            'Date:     {}\n'
+            'ID:       {}\n'
+            'Src Addr: {}\n'
+            'Type:     "{}"\n'
+            'Capacity: {}\n'.format(
+                Now(), request.id, request.addr, request.kind, request.capacity))
     if to_stdout:
         print("------------ New Generator ------------")
-        print("Date     {}".format(datetime.datetime.now()))
+        print("Date     {}".format(Now()))
         print("ID       {}".format(request.id))
         print('Type:    "{}"\n'.format(request.kind))
         # print("Request  {}".format(request.addr))
@@ -75,102 +148,199 @@ def LogRequest(request, context, response=None, to_log=False, to_stdout=True):
         # if response is not None:
         #     print("Response {}".format(response))
 
-def SendGeneratorHello(request):
-    """Reach out to the Generator"""
-    time.sleep(0.2)
-    with grpc.insecure_channel(request.addr) as channel:
-        stub = scowl_pb2_grpc.GeneratorStub(channel)
-        stub.ReceiveHello(scowl_pb2.TrackerHello(
-            tracker_addr='localhost' + ':' + str(LISTEN_PORT),
-            tracker_id=TRACKER_ID,
-            gen_id=request.id,
-            kind=request.kind,
-            capacity=request.capacity)) # returns None
-
-def LoadBalance(id):
-    global state
-
-    df = state.copy() # make a copy of the state
-    previous_load = state.loc[id].demand
-
-    # add 'safety' metrics for safe demand and safe net capacity.
-    # the safety threshold is 10% (0.1) for all generators
-    df['s_demand'] = np.round((df.output * (1 - SAFETY_THRESHOLD)), 2)
-    df['s_net_cap'] =  df['s_demand'] - df['demand']
-
-    # create views of the state for generators in safe and unsafe state
-    surplus = df[df['percent_use'] > SAFETY_THRESHOLD].copy()
-    deficit = df[df['percent_use'] < SAFETY_THRESHOLD].copy()
-
-    # if len(deficit) < 1:
-    #     print('{}.{}: {} left in the deficit group'.format(id, int(_ts) ,len(deficit)))
-
-    net_system_cap = surplus.net_cap.sum() - deficit.net_cap.sum()
-    total_safe_capacity = (surplus.output * (1 - SAFETY_THRESHOLD) - surplus.demand).sum()
-
-    safe_load   = (df.output * (1 - SAFETY_THRESHOLD)).sum()
-    unsafe_load = (deficit.output * (1 - SAFETY_THRESHOLD) - deficit.demand).sum()
+def TrackerHelloFor(request):
+    """returns the scowl_pb2.TrackerHello for GeneratorMetadata request"""
+    return scowl_pb2.TrackerHello(
+        tracker_addr='localhost' + ':' + str(LISTEN_PORT),
+        tracker_id=TRACKER_ID,
+        gen_id=request.id,
+        kind=request.kind,
+        capacity=request.capacity)
 
+def SendGeneratorHello(request):
+    """Reach out to the Generator.
+
+    wait_for_ready holds the call until the generator's server accepts
+    connections instead of failing fast; UNAVAILABLE or DEADLINE_EXCEEDED
+    attempts are retried HELLO_RETRIES times before the error is raised.
+    """
+    stub = GetStub(request.addr, scowl_pb2_grpc.GeneratorStub)
+    hello = TrackerHelloFor(request)
+    backoff = HELLO_BACKOFF
+    for attempt in range(HELLO_RETRIES + 1):
+        try:
+            return stub.ReceiveHello(hello, wait_for_ready=True, timeout=HELLO_TIMEOUT)
+        except grpc.RpcError as e:
+            if attempt == HELLO_RETRIES or e.code() not in RETRY_CODES:
+                raise
+        time.sleep(backoff)
+        backoff *= 2
+
+async def SendGeneratorHelloAsync(request):
+    """Reach out to the Generator without blocking the event loop"""
+    stub = aio_channels.stub(request.addr, scowl_pb2_grpc.GeneratorStub)
+    hello = TrackerHelloFor(request)
+    backoff = HELLO_BACKOFF
+    for attempt in range(HELLO_RETRIES + 1):
+        try:
+            return await stub.ReceiveHello(hello, wait_for_ready=True, timeout=HELLO_TIMEOUT)
+        except grpc.RpcError as e:
+            if attempt == HELLO_RETRIES or e.code() not in RETRY_CODES:
+                raise
+        await asyncio.sleep(backoff)
+        backoff *= 2
+
+def LogHelloFailed(request, error):
+    log_writer.write('------------ Hello Failed ------------\n'
+                     'Date:     {}\n'
+                     'ID:       {}\n'
+                     'Src Addr: {}\n'
+                     'Error:    {}\n'.format(Now(), request.id, request.addr, error.code()))
+
+def LogLateHello(request, hello):
+    """done callback of a hello its BatchRegisterGenerator call was answered without"""
+    if hello.cancelled(): # the server is stopping
+        return
+    error = hello.exception()
+    if isinstance(error, grpc.RpcError):
+        LogHelloFailed(request, error)
+
+def HelloWaitTime(context):
+    """returns how long a BatchRegisterGenerator call may wait on its hellos, None for no deadline"""
+    remaining = context.time_remaining()
+    if remaining is None:
+        return None
+    return max(remaining - HELLO_REPLY_MARGIN, 0)
+
+def FormatLoadBalance(s, id=None, previous_load=None, new_load=None):
+    """returns a LoadBalancer.summary formatted as a log block"""
+    lines = []
+    lines.append("------------- Load  Balanced -------------\n")
+    lines.append("{} generators with energy surplus\n".format(str(s['surplus']).rjust(3)))
+    lines.append("{} generators with energy deficit\n".format(str(s['deficit']).rjust(3)))
+    lines.append("------------------------------------\n")
+    lines.append("   - total capacity was  {:.2f} MW\n".format(s['total_output']))
+    lines.append("   - total demand was    {:.2f} MW\n".format(s['total_demand']))  
+    lines.append("                         ---------\n")
+    lines.append("   - spare capacity was  {:.2f} MW    // ignoring safety factor\n".format(
+        s['net_system_cap']))
+    lines.append("------------------------------------\n")
+    lines.append('   - able to shift       {} MW    // considering safety factor\n'.format(
+        '{:.1f}'.format(s['total_safe_capacity']).rjust(6)))
+    lines.append("------------------------------------\n")
+    lines.append("   - 'Safe Load' was     {:.2f} MW    // considering safety factor\n".format(
+        s['safe_load']))
+    if s['unsafe_load'] < 0:
+        lines.append("   - 'Unsafe Load' was   {} MW    // need to shift\n".format('({:.1f})'.format(abs(s['unsafe_load'])).rjust(6, " ")))
+        lines.append('   - Load shifting to   {} homes // {:,.1f} MW shifted\n'.format('{:,}'.format(s['homes_to_shift']).rjust(7),
+                                                                            s['shifted']))
+
+        if s['total_safe_capacity'] > np.abs(s['unsafe_load']):
+            lines.append("------------------------------------\n")
+            lines.append("SUCCESS -- load safely shifted\n")
+        else:
+            lines.append("------------------------------------\n")
+            lines.append("FAILURE -- load NOT shifted\n")
+    else:
+        # if   deficit.output - deficit.demand = (+) then no load need be shifted
+        lines.append("   - 'Unsafe Load' was        0 MW    \n")
+        lines.append("------------------------------------\n")
+        lines.append("NO LOAD TO SHIFT".center(36) + "\n")
+    lines.append("------------------------------------\n")
+    if id is not None:
+        lines.append('   - Previous Load for {}: {} MW\n'.format(id, previous_load))
+        lines.append('   - New Load for      {}: {} MW\n'.format(id, new_load))
+        lines.append("------------------------------------\n")
+    return ''.join(lines)
+
+def LogLoadBalance(s, id=None, previous_load=None, new_load=None):
+    """queues a LoadBalancer.summary for the log if load had to be shifted"""
     # when the error occurs, there is no unsafe load
-    if unsafe_load < 0:
+    if s['unsafe_load'] < 0:
         # else deficit.output - deficit.demand = (-) load must be shifted
-        homes_to_shift = np.ceil(np.abs(unsafe_load) / RES_CONSUMPTION).astype(int)
-        surplus['s_net_cap'] = (surplus.output * (1 - SAFETY_THRESHOLD)) - surplus.demand
-        deficit['s_net_cap'] = (deficit.output * (1 - SAFETY_THRESHOLD)) - deficit.demand
-        surplus['share_of_net'] =  surplus['s_net_cap'] / surplus['s_net_cap'].sum()
-        # this breaks when there is only 1 element in the deficit.
-        # devide by zero error?
-        deficit['share_of_net'] =  deficit['s_net_cap'] / deficit['s_net_cap'].sum()
-        surplus['new_load'] = -1 * np.round(
-            (surplus['share_of_net'] * unsafe_load) / RES_CONSUMPTION) * RES_CONSUMPTION
-        deficit['new_load'] = -1 * surplus['new_load'].sum() * deficit['share_of_net']
-        results = pd.concat([surplus,deficit])
-        # s = surplus['percent_use'].sort_values(ascending=True)
-        with open(LOG_PATH, 'a') as writer:
-            writer.write("------------- Load  Balanced -------------\n")
-            writer.write("{} generators with energy surplus\n".format(str(len(surplus)).rjust(3)))
-            writer.write("{} generators with energy deficit\n".format(str(len(deficit)).rjust(3)))
-            writer.write("------------------------------------\n")
-            writer.write("   - total capacity was  {:.2f} MW\n".format(df.output.sum()))
-            writer.write("   - total demand was    {:.2f} MW\n".format(df.demand.sum()))  
-            writer.write("                         ---------\n")
-            writer.write("   - spare capacity was  {:.2f} MW    // ignoring safety factor\n".format(
-                net_system_cap))
-            writer.write("------------------------------------\n")
-            writer.write('   - able to shift       {} MW    // considering safety factor\n'.format(
-                '{:.1f}'.format(total_safe_capacity).rjust(6)))
-            writer.write("------------------------------------\n")
-            writer.write("   - 'Safe Load' was     {:.2f} MW    // considering safety factor\n".format(
-                safe_load))
-
-            if unsafe_load < 0:
-                writer.write("   - 'Unsafe Load' was   {} MW    // need to shift\n".format('({:.1f})'.format(abs(unsafe_load)).rjust(6, " ")))
-                writer.write('   - Load shifting to   {} homes // {:,.1f} MW shifted\n'.format('{:,}'.format(homes_to_shift).rjust(7),
-                                                                                    abs(surplus.new_load.sum()),abs(surplus.new_load.sum())))
-
-                if total_safe_capacity > np.abs(unsafe_load):
-                    writer.write("------------------------------------\n")
-                    writer.write("SUCCESS -- load safely shifted\n")
-                else:
-                    writer.write("------------------------------------\n")
-                    writer.write("FAILURE -- load NOT shifted\n")
-            else:
-                # if   deficit.output - deficit.demand = (+) then no load need be shifted
-                writer.write("   - 'Unsafe Load' was        0 MW    \n".format(unsafe_load)) # // {:.2f}
-                writer.write("------------------------------------\n")
-                writer.write("NO LOAD TO SHIFT\n".center(36))  
-            writer.write("------------------------------------\n")
-            writer.write('   - Previous Load for {}: {} MW\n'.format(id, previous_load))
-            writer.write('   - New Load for      {}: {} MW\n'.format(id, results.loc[id].demand))
-            writer.write("------------------------------------\n")
-            columns_to_write = ['ts','output','demand','net_cap','percent_use','s_demand','s_net_cap','share_of_net','new_load']
-            # writer.write(tabulate(results[columns_to_write], headers='keys', tablefmt='psql'))
-            # writer.write('\n')
-            return previous_load + results.loc[id].new_load
+        log_writer.write(functools.partial(FormatLoadBalance, s, id, previous_load, new_load))
+
+
+def LogProfiling(written=()):
+    status = profiler.status()
+    log_writer.write('----------- Profiling Switched -----------\n'
+                     'Date:     {}\n'
+                     'Spans:    {}\n'
+                     'CPU:      {}\n'
+                     'Memory:   {}\n'.format(
+                         Now(), 'on' if status['spans'] else 'off',
+                         'one call in {}'.format(status['cpu_every']) if status['cpu_every'] else 'off',
+                         'on' if status['memory'] else 'off')
+                     + ''.join('Wrote:    {}\n'.format(path) for path in written))
+
+def StopProfiling():
+    """write the captures still running, before the log closes"""
+    written = profiler.configure(spans=False, every=0, memory=False)
+    if written:
+        LogProfiling(written)
+
+def PushDemand(s):
+    """on_rebalance hook: send the new allocation down every open state
+    stream instead of waiting for the generator's next StateUpdate"""
+    LogLoadBalance(s)
+    with streams_lock:
+        outboxes = dict(streams)
+    for id, demand in epochs.take_pending(outboxes).items():
+        outboxes[id].put_nowait(scowl_pb2.DemandUpdate(demand=demand))
+
+def OpenStream(id, outbox):
+    with streams_lock:
+        streams[id] = outbox
+
+def CloseStream(id, outbox=None):
+    """forget the stream of id (only if it is still `outbox`) and end it"""
+    with streams_lock:
+        if id not in streams or outbox not in (None, streams[id]):
+            return
+        outbox = streams.pop(id)
+    outbox.put_nowait(None)
+
+def RecordHistory(request, wall_clock_time):
+    """queue the history row of a StateUpdate already applied to `state`. Call with state_lock held"""
+    slot = state.rows[request.id]
+
+    if HISTORY_FORMAT == 'columnar':
+        row = (int(request.id),
+               request.ts,
+               HOST_ID,
+               TRACKER_ID,
+               request.output,
+               request.demand,
+               state.net_cap[slot],
+               state.percent_use[slot],
+               HistoryTime(wall_clock_time))
+    else:
+        row = '{},{},{},{},{},{},{},{},{}\n'.format(
+                request.id,
+                request.ts,
+                HOST_ID,
+                TRACKER_ID,
+                request.output,
+                request.demand,
+                state.net_cap[slot],
+                state.percent_use[slot],
+                wall_clock_time.isoformat())
+
+    data_writer.write(row)
+
+def LoadBalance(id):
+    """rebalance the region and return the new demand (MW) for id. Call with state_lock held"""
+    slot = state.rows[id]
+    previous_load = state.demand[slot]
+    with profiler.span('allocate'):
+        new_load = balancer.allocate()
+    s = balancer.summary
+    if s['unsafe_load'] < 0:
+        new_demand = previous_load + new_load[slot]
+        with profiler.span('log_load_balance'):
+            LogLoadBalance(s, id, previous_load, new_demand)
+        return new_demand
     else:
-        # print('{}.{}: {} returning same demand'.format(id, int(_ts) ,state.loc[id].demand))
-        # print(state[['ts','output','demand','percent_use']])
-        # print()
         return previous_load
 
 
@@ -189,71 +359,330 @@ class TrackerServicer(scowl_pb2_grpc.TrackerServicer):
         LogRequest(request, context, to_log=True)
         SendGeneratorHello(request)
         return scowl_pb2.Empty()
+
+    def RecordRegistrations(self, request, context):
+        """RegisterGenerator without the hellos, for each generator in a batch"""
+        for gen in request.generators:
+            self.Generators[gen.id] = gen
+            LogRequest(gen, context, to_log=True, to_stdout=False)
+        print("------------ New Generators ------------")
+        print("Date     {}".format(Now()))
+        print("Count    {}\n".format(len(request.generators)))
+
+    def BatchRegisterGenerator(self, request, context):
+        """request: scowl_pb2.GeneratorMetadataBatch, see registration.py
+
+        returns:
+            scowl_pb2.BatchRegistration # once every generator in it has been
+            said hello to, or just before the call's deadline. Hellos still
+            running then carry on and are logged if they fail
+        """
+        self.RecordRegistrations(request, context)
+        hellos = {hello_pool.submit(SendGeneratorHello, gen): gen for gen in request.generators}
+        done, late = futures.wait(hellos, timeout=HelloWaitTime(context))
+        failed = []
+        for hello in done:
+            try:
+                hello.result()
+            except grpc.RpcError as e:
+                LogHelloFailed(hellos[hello], e)
+                failed.append(hellos[hello].id)
+        for hello in late:
+            hello.add_done_callback(functools.partial(LogLateHello, hellos[hello]))
+        return scowl_pb2.BatchRegistration(failed=failed)
     
+    def UnregisterGenerator(self, request, context):
+        """request: scowl_pb2.GeneratorMetadata of a generator that migrated
+        to another tracker
+
+        returns:
+            scowl_pb2.Empty
+        """
+        self.Generators.pop(request.id, None)
+        CloseStream(request.id)
+        with state_lock:
+            if epochs is not None:
+                epochs.remove(request.id)
+            elif request.id in state:
+                state.remove(request.id)
+        log_writer.write('------------ Generator Left ------------\n'
+                         'Date:     {}\n'
+                         'ID:       {}\n'.format(Now(), request.id))
+        return scowl_pb2.Empty()
+
+    def SetProfiling(self, request, context):
+        """request: scowl_pb2.ProfilingRequest, unset fields are left as they are
+
+        returns:
+            scowl_pb2.ProfilingStatus
+        """
+        written = profiler.configure(
+            spans=request.spans if request.HasField('spans') else None,
+            every=request.cpu_every if request.HasField('cpu_every') else None,
+            memory=request.memory if request.HasField('memory') else None)
+        LogProfiling(written)
+        return scowl_pb2.ProfilingStatus(written=written, **profiler.status())
+
+    @profiler.sampled
     def UpdateGeneratorState(self, request, context):
         """request is a StateUpdate
         Returns: DemandUpdate:float
         """
-        global state # id: ['ts', 'output', 'demand', 'net_cap', 'net_cap_percent']
-        safe_net_cap_percent = None # this prevents a division by zero error
-        if request.output == 0:
-            safe_net_cap_percent = -1.0 # really negative infinity
-        else:
-            safe_net_cap_percent = (request.output - request.demand) / request.output
-        
-        wall_clock_time = datetime.datetime.now().isoformat()
-
-        state.loc[request.id] = [
-            request.ts,
-            HOST_ID,
-            TRACKER_ID,
-            request.output,
-            request.demand,
-            request.output - request.demand,
-            safe_net_cap_percent,
-            wall_clock_time]
-
-        row = '{},{},{},{},{},{},{},{},{}\n'.format(
-                request.id,
-                request.ts,
-                HOST_ID,
-                TRACKER_ID,
-                request.output,
-                request.demand,
-                request.output - request.demand,
-                safe_net_cap_percent,
-                wall_clock_time)
-
-        # print("{} VECTOR CLOCK SIZE: {}\n{}".format(request.id, len(state), state))
-        # vector_clock_size = len(state)
-        # # print("{}".format(state[state.ts >= state.loc[request.id].ts]))
-        # clocks_ahead_of_request = len(state[state.ts >= state.loc[request.id].ts])
-        # # print("{} VECTOR UPDATE SIZE: {}".format(len(state), request.id))
-        # new_demand = request.demand
-        # if vector_clock_size >= clocks_ahead_of_request:
-        #     # all clocks are equal to or greater than this one's
-        new_demand = LoadBalance(request.id)
-
-        with open(DATA_PATH, 'a') as writer:
-            writer.write(row)
+        wall_clock_time = Now()
+        with state_lock:
+            if epochs is not None:
+                # answered from the latest allocation, see EpochBalancer
+                with profiler.span('epoch_update'):
+                    new_demand = epochs.update(request.id, request.ts, HOST_ID, TRACKER_ID,
+                                               request.output, request.demand, wall_clock_time)
+            else:
+                with profiler.span('update_state'):
+                    state.update(request.id, request.ts, HOST_ID, TRACKER_ID,
+                                 request.output, request.demand, wall_clock_time)
+                new_demand = LoadBalance(request.id)
+            with profiler.span('record_history'):
+                RecordHistory(request, wall_clock_time)
 
         return scowl_pb2.DemandUpdate(demand=new_demand)
 
+    @profiler.sampled
+    def BatchUpdateGeneratorState(self, request, context):
+        """request is a StateUpdateBatch, e.g. every generator on one host.
+        All updates are recorded before the region is rebalanced once.
+
+        returns:
+            scowl_pb2.DemandUpdateBatch # one DemandUpdate per StateUpdate
+        """
+        wall_clock_time = Now()
+        updates = request.updates
+        with state_lock:
+            if epochs is not None:
+                with profiler.span('epoch_update'):
+                    new_demands = epochs.update_many(
+                        [(u.id, u.ts, u.output, u.demand) for u in updates],
+                        HOST_ID, TRACKER_ID, wall_clock_time)
+            else:
+                with profiler.span('update_state'):
+                    for u in updates:
+                        state.update(u.id, u.ts, HOST_ID, TRACKER_ID, u.output, u.demand, wall_clock_time)
+                with profiler.span('allocate'):
+                    new_load = balancer.allocate()
+                with profiler.span('log_load_balance'):
+                    LogLoadBalance(balancer.summary)
+                new_demands = [u.demand + new_load[state.rows[u.id]] for u in updates]
+            with profiler.span('record_history'):
+                for u in updates:
+                    RecordHistory(u, wall_clock_time)
+
+        return scowl_pb2.DemandUpdateBatch(
+            demands=[scowl_pb2.DemandUpdate(demand=d) for d in new_demands])
+
+    def StreamGeneratorState(self, request_iterator, context):
+        """request_iterator: StateUpdates from one generator
+
+        yields:
+            scowl_pb2.DemandUpdate # whenever the generator's demand changes,
+            i.e. after its own update, or after a rebalance in epoch mode
+        """
+        if not stream_slots.acquire(blocking=False):
+            context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED,
+                          'tracker {} has {} state streams open, send unary updates'.format(
+                              TRACKER_ID, MAX_STREAMS))
+        try:
+            outbox = queue.Queue()
+            context.add_callback(lambda: outbox.put_nowait(None))
+            threading.Thread(target=self.ReadStateStream, args=(request_iterator, context, outbox),
+                             daemon=True).start()
+            while True:
+                reply = outbox.get()
+                if reply is None:
+                    break
+                yield reply
+        finally:
+            stream_slots.release()
+
+    def ReadStateStream(self, request_iterator, context, outbox):
+        """apply the StateUpdates of a stream, queueing replies in outbox"""
+        id = None
+        try:
+            for request in request_iterator:
+                if not context.is_active():
+                    break
+                if id is None:
+                    id = request.id
+                    OpenStream(id, outbox)
+                reply = self.UpdateGeneratorState(request, context)
+                if reply.demand != request.demand:
+                    outbox.put_nowait(reply)
+        except grpc.RpcError:
+            pass # the generator cancelled the call
+        finally:
+            CloseStream(id, outbox)
+            outbox.put_nowait(None)
+
+class AsyncTrackerServicer(TrackerServicer):
+    """grpc.aio version of TrackerServicer.
+
+    Every handler runs on the one event loop thread, so the region state is
+    never mutated concurrently. History and log records are handed to the
+    HistoryWriter threads, and the Hello to a new generator is awaited
+    instead of blocking a worker thread.
+    """
+    async def RegisterGenerator(self, request, context):
+        self.Generators[request.id] = request
+        LogRequest(request, context, to_log=True)
+        await SendGeneratorHelloAsync(request)
+        return scowl_pb2.Empty()
+
+    async def BatchRegisterGenerator(self, request, context):
+        self.RecordRegistrations(request, context)
+        hellos = {asyncio.ensure_future(SendGeneratorHelloAsync(gen)): gen for gen in request.generators}
+        if not hellos:
+            return scowl_pb2.BatchRegistration()
+        done, late = await asyncio.wait(hellos, timeout=HelloWaitTime(context))
+        failed = []
+        for hello in done:
+            error = hello.exception()
+            if isinstance(error, grpc.RpcError):
+                LogHelloFailed(hellos[hello], error)
+                failed.append(hellos[hello].id)
+            elif error is not None:
+                raise error
+        for hello in late:
+            hello.add_done_callback(functools.partial(LogLateHello, hellos[hello]))
+        return scowl_pb2.BatchRegistration(failed=failed)
+
+    async def UnregisterGenerator(self, request, context):
+        return TrackerServicer.UnregisterGenerator(self, request, context)
+
+    async def SetProfiling(self, request, context):
+        # writing a capture takes a while, keep it off the event loop
+        return await asyncio.to_thread(TrackerServicer.SetProfiling, self, request, context)
+
+    async def UpdateGeneratorState(self, request, context):
+        return TrackerServicer.UpdateGeneratorState(self, request, context)
+
+    async def BatchUpdateGeneratorState(self, request, context):
+        return TrackerServicer.BatchUpdateGeneratorState(self, request, context)
+
+    async def StreamGeneratorState(self, request_iterator, context):
+        outbox = asyncio.Queue()
+        reader = asyncio.ensure_future(self.ReadStateStream(request_iterator, context, outbox))
+        try:
+            while True:
+                reply = await outbox.get()
+                if reply is None:
+                    break
+                yield reply
+        finally:
+            reader.cancel()
+            try:
+                await reader # else asyncio logs "Task exception was never retrieved"
+            except asyncio.CancelledError:
+                pass
+
+    async def ReadStateStream(self, request_iterator, context, outbox):
+        id = None
+        try:
+            async for request in request_iterator:
+                if id is None:
+                    id = request.id
+                    OpenStream(id, outbox)
+                reply = TrackerServicer.UpdateGeneratorState(self, request, context)
+                if reply.demand != request.demand:
+                    outbox.put_nowait(reply)
+        finally:
+            CloseStream(id, outbox)
+            outbox.put_nowait(None)
+
+def UseStateTable(table: GeneratorStateTable):
+    """keep the region state in `table` instead, e.g. a SharedStateTable
+    from tracker_host.py. Call before serve()."""
+    global state, balancer
+    state = table
+    balancer = LoadBalancer(state, safety_threshold=SAFETY_THRESHOLD, res_consumption=RES_CONSUMPTION,
+                            timer=balancer.timer)
+
+def StartEpochs(clock=time.monotonic):
+    global epochs
+    if REBALANCE_MODE == 'epoch':
+        epochs = EpochBalancer(balancer, epoch=REBALANCE_EPOCH, on_rebalance=PushDemand, clock=clock,
+                               lock=state_lock)
+
+def LogStart(addr):
+    start_time = Now().isoformat()
+    print("------------- Tracker Started -------------", )   
+    print('Started: ', start_time)
+    print('Addr:    ', addr)
+    log_writer.write("------------- Tracker Started -------------\n"
+                     "Started: {}\n".format(start_time))
+
+def StartMetrics():
+    """serve the metrics on METRICS_PORT, if set. A port in use only costs the endpoint"""
+    REGISTRY.gauge('generators', lambda: state.size, tracker=TRACKER_ID)
+    REGISTRY.gauge('history_dropped', lambda: data_writer.dropped, tracker=TRACKER_ID)
+    REGISTRY.gauge('history_pending', lambda: data_writer.pending, tracker=TRACKER_ID)
+    if METRICS_PORT is None:
+        return None
+    try:
+        return ServeMetrics(METRICS_PORT)
+    except OSError as e:
+        print('metrics not served on {}: {}'.format(METRICS_PORT, e))
+        return None
+
+def StopMetrics(metrics_server):
+    REGISTRY.dump(METRICS_PATH)
+    if metrics_server is not None:
+        metrics_server.shutdown()
+
 def serve():
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    StartEpochs()
+    metrics_server = StartMetrics()
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=SERVER_WORKERS + MAX_STREAMS),
+                         options=SERVER_OPTIONS, interceptors=[MetricsInterceptor()])
     scowl_pb2_grpc.add_TrackerServicer_to_server(
         TrackerServicer(), server)
     addr = GetOwnIP() + ':' + str(LISTEN_PORT)
     server.add_insecure_port('[::]:' + str(LISTEN_PORT)) # one higher than Bootstrap server
     server.start()
-    start_time = datetime.datetime.now().isoformat()
-    print("------------- Tracker Started -------------", )   
-    print('Started: ', start_time)
-    print('Addr:    ', addr)
-    with open(LOG_PATH, "w") as f:
-        f.write("------------- Tracker Started -------------\n")
-        f.write('Started: {}\n'.format(start_time))
-    server.wait_for_termination()
+    LogStart(addr)
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.stop(None))
+    InstallSignals(profiler, on_change=LogProfiling)
+    try:
+        server.wait_for_termination()
+    finally:
+        StopProfiling()
+        CloseWriters()
+        StopMetrics(metrics_server)
+
+async def serve_async():
+    """serve() on a grpc.aio server, see AsyncTrackerServicer"""
+    global aio_channels
+    StartEpochs()
+    aio_channels = AioChannelPool()
+    metrics_server = StartMetrics()
+    server = grpc.aio.server(options=SERVER_OPTIONS, interceptors=[AioMetricsInterceptor()])
+    scowl_pb2_grpc.add_TrackerServicer_to_server(
+        AsyncTrackerServicer(), server)
+    addr = GetOwnIP() + ':' + str(LISTEN_PORT)
+    server.add_insecure_port('[::]:' + str(LISTEN_PORT))
+    await server.start()
+    LogStart(addr)
+    asyncio.get_running_loop().add_signal_handler(
+        signal.SIGTERM, lambda: asyncio.ensure_future(server.stop(None)))
+    InstallSignals(profiler, on_change=LogProfiling, loop=asyncio.get_running_loop())
+    try:
+        await server.wait_for_termination()
+    finally:
+        await asyncio.to_thread(StopProfiling)
+        await asyncio.to_thread(CloseWriters)
+        StopMetrics(metrics_server)
+
+def CloseWriters():
+    """flush queued history/log records to disk and report the writer counters"""
+    for writer in (data_writer, log_writer):
+        writer.close()
+        print('{}: {}'.format(writer.path, writer.stats()))
 
 
 if __name__ == '__main__':
@@ -262,4 +691,7 @@ if __name__ == '__main__':
     print("Tracker {} is responsible for:".format(TRACKER_ID))
     lower, upper = ComputeBucketRange(NUM_BUCKETS, TRACKER_ID, HASH_SIZE) 
     print("IDs [{} , {})".format(lower, upper))
-    serve()
\ No newline at end of file
+    if SERVER_MODE == 'asyncio':
+        asyncio.run(serve_async())
+    else:
+        serve()
\ No newline at end of file
@@ -0,0 +1,201 @@
+"""
+Runs the trackers of one host as shard processes under one supervisor.
+
+Replaces starting one tracker.py per shell line (the notebook's
+TrackersPerHost/GenTrackerLaunchScripts). Shard i is tracker.py serving
+tracker `first + i` on START_PORT + first + i in its own process, pinned to
+its own core when the host has enough of them, so shards share nothing but
+the machine. Each shard keeps its region state in a SharedStateTable. The
+supervisor reads every region's output and demand straight from shared
+memory, logs the host totals every REPORT_INTERVAL seconds, and restarts a
+shard that dies. A restarted shard's region fills up again from the
+generators' next StateUpdates.
+
+    python tracker_host.py <host id> <num trackers> [num hosts] [update|epoch]
+
+num trackers is the total over every host, as for tracker.py. They are
+spread over num hosts (default 1) as evenly as they go, in blocks of
+consecutive ids as the notebook's TrackersPerHost does, so every id is in
+[0, num trackers) and each host runs its own block (see HostTrackers).
+"""
+from multiprocessing import shared_memory
+import multiprocessing
+import threading
+import datetime
+import signal
+import sys
+import os
+
+from history import HistoryWriter
+from state_table import (CreateSharedState, SharedStateTable, SharedStateView, SHARED_CAPACITY,
+                         SharedStateSize)
+
+START_PORT = 32000     # as in tracker.py
+REPORT_INTERVAL = 2    # seconds between host totals, the generators' REFRESH_RATE
+SHUTDOWN_TIMEOUT = 10  # seconds for a shard to exit after SIGTERM before it is killed
+
+LOG_PATH = 'sim/2030/logs/host_{}.log'
+SHM_NAME = 'scowl_h{}_t{}' # host id, tracker id
+
+
+def RunShard(tracker_id: int, host_id: int, num_trackers: int, mode: str, shm_name: str, cpu=None):
+    """process target: tracker.py for one tracker, on a shared state table"""
+    if cpu is not None:
+        os.sched_setaffinity(0, {cpu})
+    sys.argv = ['tracker.py', str(START_PORT + tracker_id), str(host_id), str(num_trackers), mode]
+    import tracker # parses sys.argv
+    tracker.UseStateTable(SharedStateTable(shm_name))
+    tracker.serve()
+
+
+class Shard:
+    """one tracker process and its shared state segment"""
+    __slots__ = ('tracker_id', 'shm', 'view', 'process', 'cpu', 'restarts')
+
+    def __init__(self, tracker_id: int, shm, cpu=None):
+        self.tracker_id = tracker_id
+        self.shm = shm
+        self.view = SharedStateView(shm.name)
+        self.process = None
+        self.cpu = cpu
+        self.restarts = 0
+
+
+def HostTrackers(host_id: int, num_trackers: int, num_hosts: int = 1) -> range:
+    """returns the tracker ids host_id runs when num_trackers are spread
+    over num_hosts, the first num_trackers % num_hosts hosts taking one more"""
+    if not 0 <= host_id < num_hosts:
+        raise ValueError('host id {} is not in [0, {})'.format(host_id, num_hosts))
+    per_host, extra = divmod(num_trackers, num_hosts)
+    first = host_id * per_host + min(host_id, extra)
+    return range(first, first + per_host + (host_id < extra))
+
+
+class TrackerHost:
+    """Starts, watches and stops the tracker shards of one host."""
+    def __init__(self, host_id: int, num_trackers: int, num_hosts: int = 1, shards: int = None,
+                 first: int = None, mode: str = 'update', capacity: int = SHARED_CAPACITY, pin: bool = True):
+        """shards, first: run trackers first .. first + shards - 1 instead of
+        this host's share of HostTrackers()"""
+        self.host_id = host_id
+        self.num_trackers = num_trackers
+        self.mode = mode
+        self.capacity = capacity # rows per shard
+        if shards is None or first is None:
+            trackers = HostTrackers(host_id, num_trackers, num_hosts)
+            shards = len(trackers) if shards is None else shards
+            first = trackers.start if first is None else first
+        if first < 0 or first + shards > num_trackers:
+            raise ValueError('trackers {}..{} are not in [0, {})'.format(first, first + shards - 1, num_trackers))
+        cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else []
+        pin = pin and len(cpus) >= shards # sharing a core, let the OS schedule
+        self.shards = [Shard(tracker_id, self._create_segment(tracker_id),
+                             cpus[i] if pin else None)
+                       for i, tracker_id in enumerate(range(first, first + shards))]
+        self.stop_event = threading.Event()
+        self._context = multiprocessing.get_context('spawn') # no grpc state crosses a fork
+        self.log = HistoryWriter(LOG_PATH.format(host_id), mode='w')
+
+    def _create_segment(self, tracker_id: int):
+        name = SHM_NAME.format(self.host_id, tracker_id)
+        try:
+            return CreateSharedState(name, self.capacity)
+        except FileExistsError: # left behind by a host that was killed
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            return CreateSharedState(name, self.capacity)
+
+    def _spawn(self, shard: Shard):
+        shard.process = self._context.Process(
+            target=RunShard, name='tracker-{}'.format(shard.tracker_id),
+            args=(shard.tracker_id, self.host_id, self.num_trackers, self.mode, shard.shm.name, shard.cpu))
+        shard.process.start()
+
+    def start(self):
+        for shard in self.shards:
+            self._spawn(shard)
+        self.log.write("------------- Host Started -------------\n"
+                       "Started:  {}\n"
+                       "Host:     {}\n"
+                       "Trackers: {}\n"
+                       "Ports:    {}\n"
+                       "Shared:   {:.1f} MB per tracker\n".format(
+                           datetime.datetime.now().isoformat(), self.host_id,
+                           [s.tracker_id for s in self.shards],
+                           [START_PORT + s.tracker_id for s in self.shards],
+                           SharedStateSize(self.capacity) / 2**20))
+
+    def totals(self) -> dict:
+        """reads every shard's region from shared memory, no RPCs.
+
+        returns:
+            dict # generators, output and demand (MW) of the host, and per tracker
+        """
+        trackers = {s.tracker_id: s.view.totals() for s in self.shards}
+        return {'generators': sum(t['generators'] for t in trackers.values()),
+                'output': sum(t['output'] for t in trackers.values()),
+                'demand': sum(t['demand'] for t in trackers.values()),
+                'trackers': trackers}
+
+    def LogTotals(self):
+        totals = self.totals()
+        self.log.write("-------------- Host Totals --------------\n"
+                       "Date:       {}\n"
+                       "Generators: {}\n"
+                       "Output:     {:.2f} MW\n"
+                       "Demand:     {:.2f} MW\n".format(
+                           datetime.datetime.now(), totals['generators'],
+                           totals['output'], totals['demand'])
+                       + ''.join('   - tracker {}: {} generators, {:.2f} MW output, {:.2f} MW demand\n'.format(
+                           id, t['generators'], t['output'], t['demand'])
+                           for id, t in totals['trackers'].items()))
+
+    def supervise(self, interval: float = REPORT_INTERVAL):
+        """log host totals and restart dead shards until stop() is called"""
+        while not self.stop_event.wait(interval):
+            for shard in self.shards:
+                if not shard.process.is_alive():
+                    shard.restarts += 1
+                    self.log.write('Tracker {} exited with {}, restart {}\n'.format(
+                        shard.tracker_id, shard.process.exitcode, shard.restarts))
+                    self._spawn(shard)
+            self.LogTotals()
+
+    def stop(self, timeout: float = SHUTDOWN_TIMEOUT):
+        """SIGTERM every shard (tracker.serve flushes its writers), then free the segments"""
+        self.stop_event.set()
+        for shard in self.shards:
+            if shard.process is not None and shard.process.is_alive():
+                shard.process.terminate()
+        for shard in self.shards:
+            if shard.process is not None:
+                shard.process.join(timeout)
+                if shard.process.is_alive():
+                    shard.process.kill()
+                    shard.process.join()
+        self.LogTotals()
+        for shard in self.shards:
+            shard.view.close()
+            shard.shm.close()
+            shard.shm.unlink()
+        self.log.write("------------- Host Stopped -------------\n"
+                       "Stopped:  {}\n".format(datetime.datetime.now().isoformat()))
+        self.log.close()
+
+
+if __name__ == '__main__':
+    host_id, num_trackers = int(sys.argv[1]), int(sys.argv[2])
+    num_hosts = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    mode = sys.argv[4] if len(sys.argv) > 4 else 'update'
+    host = TrackerHost(host_id, num_trackers, num_hosts, mode=mode)
+    signal.signal(signal.SIGTERM, lambda signum, frame: host.stop_event.set())
+    host.start()
+    print("------------- Host Started -------------")
+    print('Trackers: ', [s.tracker_id for s in host.shards])
+    try:
+        host.supervise()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        host.stop()